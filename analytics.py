@@ -0,0 +1,393 @@
+"""
+Columnar analytics over the transaction store.
+
+Transactions are loaded into NumPy arrays, one per column, and saved in analytics_cache/
+as .npy files that later loads memory-map. Only the rows written since the cache was
+saved have to be parsed: with the partitioned store each month is cached on its own, so a
+write has just its month read again. Reports are vectorized over the arrays instead of
+looping over CSV rows:
+
+    import analytics
+    columns = analytics.load_columns()
+    columns.daily_sales(start=date(2025, 4, 1), end=date(2025, 4, 30))
+    columns.top_products(10, products=["Apple", "Milk"])
+
+    python analytics.py daily --start 2025-04-01 --end 2025-04-30
+    python analytics.py top --n 10 --customer "Customer 12"
+
+NumPy is only needed by this module, the app runs without it (pip install numpy).
+"""
+import argparse
+import json
+import os
+import uuid
+from datetime import date, datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # Optional, see requirements.txt
+    np = None
+
+import pos_core
+
+CACHE_FORMAT = 1  # Bumped when the cache layout changes, older caches are rebuilt
+REFRESH_ROWS = 100000  # Rows parsed on top of the cache before it is saved again
+CONVERT_BLOCK_ROWS = 8192  # Rows converted at a time, a block holding a bad row is split until it's found
+COLUMNS = {"index": "int64", "timestamp": "int64", "product": "int32", "customer": "int32", "cents": "int64", "amount": "int32"}
+_EPOCH = date(1970, 1, 1)
+
+def _day_number(day):
+    return (day - _EPOCH).days
+
+def _convert(rows):
+    """
+    Converts the numeric and timestamp columns of `rows`, a whole column at a time.
+
+    Raises:
+        ValueError: If any row can't be converted.
+    """
+    if not rows:
+        return {name: np.empty(0, COLUMNS[name]) for name in ("index", "timestamp", "cents", "amount")}
+    index, customer, product, price, amount, total, timestamp = zip(*rows)
+    # NumPy reads '2025-04-02 10:00:00' itself, only legacy '31/3/2025 22:58' needs pos_core
+    timestamp = [value if value[4:5] == "-" else pos_core.normalize_timestamp(value) for value in timestamp]
+    return {
+        "index": np.array(index, dtype=COLUMNS["index"]),
+        "timestamp": np.array(timestamp, dtype="datetime64[s]").astype(COLUMNS["timestamp"]),
+        "cents": np.rint(np.array(total, dtype="float64") * 100).astype(COLUMNS["cents"]),
+        "amount": np.array(amount, dtype=COLUMNS["amount"]),
+    }
+
+def _convert_block(rows, parts, bad):
+    """
+    Appends (rows, arrays) of `rows` to `parts`. If they don't convert, each half is tried
+    on its own, down to the single rows that can't be, which go to `bad` as (row, error).
+    """
+    try:
+        parts.append((rows, _convert(rows)))
+    except (ValueError, IndexError) as e:
+        if len(rows) == 1:
+            bad.append((rows[0], e))
+            return
+        half = len(rows) // 2
+        _convert_block(rows[:half], parts, bad)
+        _convert_block(rows[half:], parts, bad)
+
+def _parse_rows(rows, product_codes, customer_codes, bad):
+    """
+    Turns transaction rows (lists of strings) into column arrays. Rows that can't be
+    converted are skipped and added to `bad` as (row, error), for the caller to report.
+    Product and customer names are replaced by their codes, new names are added to the
+    code dicts.
+
+    Returns:
+        dict: {column: array}
+    """
+    parts = []
+    skipped = len(bad)
+    for start in range(0, len(rows), CONVERT_BLOCK_ROWS):
+        _convert_block(rows[start:start + CONVERT_BLOCK_ROWS], parts, bad)
+    if len(bad) > skipped:
+        rows = [row for block, _ in parts for row in block]
+    if not parts:
+        arrays = _convert([])
+    elif len(parts) == 1:
+        arrays = parts[0][1]
+    else:
+        arrays = {name: np.concatenate([block[name] for _, block in parts]) for name in parts[0][1]}
+    arrays["product"] = np.array([product_codes.setdefault(row[2], len(product_codes)) for row in rows], dtype=COLUMNS["product"])
+    arrays["customer"] = np.array([customer_codes.setdefault(row[1], len(customer_codes)) for row in rows], dtype=COLUMNS["customer"])
+    return arrays
+
+class TransactionColumns:
+    """
+    Transactions as one NumPy array per column:
+
+        index      int64  transaction index
+        timestamp  int64  seconds since 1970-01-01 of the timestamp, read as local time
+        product    int32  code into .products
+        customer   int32  code into .customers
+        cents      int64  row total in cents
+        amount     int32  quantity
+
+    `live` masks out voided rows. Every report takes the same optional filters: start and
+    end dates (inclusive) and lists of product or customer names.
+    """
+
+    def __init__(self, arrays, products, customers, live=None):
+        self.arrays = arrays
+        self.products = products
+        self.customers = customers
+        self.live = live
+        self.product_codes = {name: code for code, name in enumerate(products)}
+        self.customer_codes = {name: code for code, name in enumerate(customers)}
+
+    def __len__(self):
+        return len(self.arrays["index"]) if self.live is None else int(np.count_nonzero(self.live))
+
+    def mask(self, start=None, end=None, products=None, customers=None):
+        """
+        Returns a boolean array selecting the live rows that pass the filters, or None if
+        that is every row.
+        """
+        mask = self.live
+        conditions = []
+        if start is not None:
+            conditions.append(self.arrays["timestamp"] >= _day_number(start) * 86400)
+        if end is not None:
+            conditions.append(self.arrays["timestamp"] < (_day_number(end) + 1) * 86400)
+        if products is not None:
+            codes = [self.product_codes[name] for name in products if name in self.product_codes]
+            conditions.append(np.isin(self.arrays["product"], codes))
+        if customers is not None:
+            codes = [self.customer_codes[name] for name in customers if name in self.customer_codes]
+            conditions.append(np.isin(self.arrays["customer"], codes))
+        for condition in conditions:
+            mask = condition if mask is None else mask & condition
+        return mask
+
+    def column(self, name, mask=None):
+        """
+        Returns the array of column `name`, only the rows selected by `mask` if given.
+        """
+        return self.arrays[name] if mask is None else self.arrays[name][mask]
+
+    def _totals_by(self, seconds, **filters):
+        mask = self.mask(**filters)
+        buckets = self.column("timestamp", mask) // seconds
+        if not len(buckets):
+            return buckets, None, None
+        first = buckets.min()
+        totals = np.bincount(buckets - first, weights=self.column("cents", mask))
+        rows = np.bincount(buckets - first)
+        return np.flatnonzero(rows), first, totals
+
+    def daily_sales(self, **filters):
+        """
+        Returns:
+            dict: {"YYYY-MM-DD": total sales} in date order.
+        """
+        days, first, totals = self._totals_by(86400, **filters)
+        return {(_EPOCH + timedelta(days=int(first + day))).isoformat(): float(totals[day]) / 100 for day in days}
+
+    def hourly_sales(self, **filters):
+        """
+        Returns:
+            dict: {"YYYY-MM-DD HH": total sales} in time order.
+        """
+        hours, first, totals = self._totals_by(3600, **filters)
+        start = datetime(1970, 1, 1)
+        return {(start + timedelta(hours=int(first + hour))).strftime("%Y-%m-%d %H"): float(totals[hour]) / 100 for hour in hours}
+
+    def top_products(self, n=10, **filters):
+        """
+        Returns the n best selling products by quantity as [(product, quantity), ...]. Ties
+        are ordered by when the product was first sold, like Counter.most_common.
+        """
+        mask = self.mask(**filters)
+        products = self.column("product", mask)
+        quantities = np.bincount(products, weights=self.column("amount", mask), minlength=len(self.products))
+        sold = np.flatnonzero(np.bincount(products, minlength=len(self.products)))
+        ranked = sold[np.lexsort((sold, -quantities[sold]))]
+        return [(self.products[code], int(quantities[code])) for code in ranked[:n]]
+
+    def total(self, **filters):
+        """
+        Returns the sales total of the rows passing the filters.
+        """
+        return int(self.column("cents", self.mask(**filters)).sum()) / 100
+
+def _load_meta(cache_dir):
+    """
+    Returns the meta.json of cache_dir, or None if there is none of this CACHE_FORMAT.
+    """
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), "r") as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("format") == CACHE_FORMAT else None
+
+def _save_meta(cache_dir, meta):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, "meta.json")
+    with open(path + ".tmp", "w") as file:
+        json.dump(dict(meta, format=CACHE_FORMAT), file)
+    os.replace(path + ".tmp", path)
+
+def _load_cache(cache_dir):
+    """
+    Returns (meta, arrays) from cache_dir with the arrays memory-mapped, or (None, None)
+    if there is no usable cache.
+    """
+    meta = _load_meta(cache_dir)
+    if meta is None:
+        return None, None
+    try:
+        arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+    except (OSError, ValueError):
+        return None, None
+    if any(len(array) != meta["rows"] for array in arrays.values()):
+        return None, None  # Interrupted while saving
+    return meta, arrays
+
+def _save_cache(cache_dir, meta, arrays):
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, array in arrays.items():
+        path = os.path.join(cache_dir, f"{name}.npy")
+        with open(path + ".tmp", "wb") as file:
+            np.save(file, array)
+        os.replace(path + ".tmp", path)
+    _save_meta(cache_dir, dict(meta, rows=len(arrays["index"])))  # Last, so it never describes arrays that aren't there yet
+
+def _load_rows(store, cache_dir, save, bad):
+    """
+    load_columns for the CSV and SQLite stores, one cache for the whole store. Returns
+    (arrays, products, customers, voids).
+    """
+    meta, cached = _load_cache(cache_dir)
+    if meta is not None and meta.get("store") != store.name:
+        meta, cached = None, None
+
+    if store.name == "csv":
+        offset = meta["offset"] if meta else 0
+        rows, end, voids, file_id = store.rows_after(offset)
+        if meta and (file_id != meta["file_id"] or end < offset):
+            meta, cached = None, None  # Rewritten, the offset is meaningless now
+            rows, end, voids, file_id = store.rows_after(0)
+        new_meta = {"store": store.name, "offset": end, "file_id": file_id}
+    else:
+        rows, voids, position = store.tail(meta["position"]) if meta else (None, None, None)
+        if rows is None:
+            meta, cached = None, None
+            rows, voids, position = store.tail([0, 0])  # Everything, in one read
+        # Deleted rows are gone from the store but not from the cache, so their voids are kept
+        voids = {tuple(pair) for pair in meta["voids"]} | set(voids) if meta else set(voids)
+        new_meta = {"store": store.name, "position": position, "voids": sorted(voids)}
+
+    products = meta["products"] if meta else []
+    customers = meta["customers"] if meta else []
+    product_codes = {name: code for code, name in enumerate(products)}
+    customer_codes = {name: code for code, name in enumerate(customers)}
+    arrays = cached
+    if rows or cached is None:
+        new = _parse_rows(rows, product_codes, customer_codes, bad)
+        arrays = new if cached is None else {name: np.concatenate([cached[name], new[name]]) for name in COLUMNS}
+        products = list(product_codes)
+        customers = list(customer_codes)
+        if save and (cached is None or len(rows) >= REFRESH_ROWS):
+            _save_cache(cache_dir, dict(new_meta, products=products, customers=customers), arrays)
+    return arrays, products, customers, voids
+
+def _load_months(store, cache_dir, save, bad):
+    """
+    load_columns for the partitioned store. Each month is cached in its own subdirectory
+    of cache_dir, so only the months written since are parsed, and of those only the
+    rows appended unless the month file was swapped for a new one (compaction, compressing,
+    unpacking). The product and customer names of all months are in cache_dir/meta.json.
+    Returns (arrays, products, customers, voids).
+    """
+    meta = _load_meta(cache_dir)
+    if meta is None or meta.get("store") != store.name:
+        # A new list of names, the months cached with the old one are parsed again
+        meta = {"store": store.name, "names": uuid.uuid4().hex, "products": [], "customers": []}
+    product_codes = {name: code for code, name in enumerate(meta["products"])}
+    customer_codes = {name: code for code, name in enumerate(meta["customers"])}
+    months, voids = store.months()
+    parts = []
+    saved = False
+    for key, entry in months:
+        month_dir = os.path.join(cache_dir, key)
+        month_meta, cached = _load_cache(month_dir)
+        offset = 0
+        if month_meta and month_meta["names"] == meta["names"] and month_meta["file_id"] == entry["file_id"] and month_meta["bytes"] <= entry["bytes"]:
+            offset = month_meta["bytes"]
+        else:
+            cached = None
+        if cached is not None and offset == entry["bytes"]:
+            parts.append(cached)
+            continue
+        rows = store.month_rows(key, entry, offset)
+        new = _parse_rows(rows, product_codes, customer_codes, bad)
+        arrays = new if cached is None else {name: np.concatenate([cached[name], new[name]]) for name in COLUMNS}
+        if save and (cached is None or len(rows) >= REFRESH_ROWS):
+            _save_cache(month_dir, {"names": meta["names"], "file_id": entry["file_id"], "bytes": entry["bytes"]}, arrays)
+            saved = True
+        parts.append(arrays)
+    products = list(product_codes)
+    customers = list(customer_codes)
+    if saved:
+        # After the months, the names only ever grow so the ones saved before still hold
+        _save_meta(cache_dir, dict(meta, products=products, customers=customers))
+    if not parts:
+        arrays = _parse_rows([], product_codes, customer_codes, bad)
+    else:
+        arrays = {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+    return arrays, products, customers, voids
+
+def load_columns(cache_dir="analytics_cache", save=True):
+    """
+    Returns the current transactions as TransactionColumns.
+
+    The cached columns are memory-mapped and only what was written since the cache was
+    saved is parsed: for the CSV store the rows appended to the file, for SQLite the rows
+    and deletes tail() returns, for the partitioned store the months that changed. If the
+    CSV was rewritten (compaction, timestamp migration) the whole store is parsed again,
+    the same for a rewritten month. The cache is saved again once REFRESH_ROWS new rows
+    were parsed on top of it. Rows that can't be read are skipped, with one line saying
+    how many.
+
+    Raises:
+        ImportError: If NumPy isn't installed.
+    """
+    if np is None:
+        raise ImportError("analytics needs NumPy, install it with: pip install numpy")
+    pos_core.flush_checkouts()
+    store = pos_core.get_transaction_store()
+    bad = []
+    if store.name == "partitioned":
+        arrays, products, customers, voids = _load_months(store, cache_dir, save, bad)
+    else:
+        arrays, products, customers, voids = _load_rows(store, cache_dir, save, bad)
+    if bad:
+        row, error = bad[0]
+        print(f"Skipped {len(bad)} rows that couldn't be read, the first: {row}. Error: {error}")
+
+    product_codes = {name: code for code, name in enumerate(products)}
+    live = None
+    voided = [(int(index), product_codes[product]) for index, product in voids if product in product_codes and index.isdigit()]
+    if voided:
+        # One int64 key per (index, product) pair, so the whole column is checked in one pass
+        keys = arrays["index"] * len(products) + arrays["product"]
+        live = ~np.isin(keys, [index * len(products) + code for index, code in voided])
+    return TransactionColumns(arrays, products, customers, live)
+
+def _parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar sales reports")
+    parser.add_argument("report", choices=["daily", "hourly", "top", "total"])
+    parser.add_argument("--start", type=_parse_day, help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", type=_parse_day, help="Last day, YYYY-MM-DD")
+    parser.add_argument("--product", action="append", help="Only this product (repeatable)")
+    parser.add_argument("--customer", action="append", help="Only this customer (repeatable)")
+    parser.add_argument("--n", type=int, default=10, help="Number of products for the top report")
+    parser.add_argument("--store", choices=sorted(pos_core.TRANSACTION_STORES), help="Transaction store backend (default: $POS_STORE or csv)")
+    args = parser.parse_args()
+    if args.store:
+        os.environ["POS_STORE"] = args.store
+
+    columns = load_columns()
+    filters = {"start": args.start, "end": args.end, "products": args.product, "customers": args.customer}
+    if args.report == "daily":
+        for day, total in columns.daily_sales(**filters).items():
+            print(f"{day}  {total:12.2f}")
+    elif args.report == "hourly":
+        for hour, total in columns.hourly_sales(**filters).items():
+            print(f"{hour}  {total:12.2f}")
+    elif args.report == "top":
+        for product, quantity in columns.top_products(args.n, **filters):
+            print(f"{product:30} {quantity:10}")
+    else:
+        print(f"{columns.total(**filters):.2f}")
@@ -0,0 +1,389 @@
+"""
+Benchmarks for the POS core on large synthetic data.
+
+    python bench.py generate --dir bench_data --products 10000 --rows 1000000
+    python bench.py run --dir bench_data --output before.json
+    python bench.py run --dir bench_data --store sqlite --output after.json
+    python bench.py compare before.json after.json
+    python bench.py stress --dir stress_data --sessions 8 --processes
+
+`generate` writes a products.csv and transactions.csv into the directory, with a share of
+the rows in the legacy '31/3/2025 22:58' timestamp format. `run` times the operations the
+app performs against that directory and writes the results as JSON; `compare` prints the
+change per operation and exits with status 1 if anything got slower than the threshold.
+
+The run changes the data (checkouts and product edits are real), so generate a fresh
+directory when comparing versions.
+
+`stress` runs several terminals against one directory at once, as threads of one process
+(Flet web sessions) or as separate processes, and checks that no sale was lost, recorded
+twice or given an index that was already taken.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import analytics
+import pos_core
+
+CUSTOMERS = 500  # Distinct customer names in generated histories
+
+def generate(directory, products=10000, rows=1000000, days=365, legacy_fraction=0.2, seed=1):
+    """
+    Writes a synthetic catalog and transaction history into `directory`.
+
+    Sales have 1-5 lines and are spread evenly over the last `days` days, oldest first, with
+    indices handed out the way record_transaction does. About `legacy_fraction` of the sales
+    use the legacy timestamp format.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    catalog = {f"Product {i:05d}": round(rng.uniform(0.2, 50), 2) for i in range(1, products + 1)}
+    names = list(catalog)
+    # A few products sell far more than the rest, like a real shop
+    weights = [1 / (rank + 1) for rank in range(len(names))]
+
+    with open(os.path.join(directory, "products.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Name", "Price"])
+        for name, price in catalog.items():
+            writer.writerow([name, price])
+
+    start = datetime.now() - timedelta(days=days)
+    step = timedelta(days=days) / max(rows, 1)
+    with open(os.path.join(directory, "transactions.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(pos_core.TRANSACTION_HEADER)
+        written = 0
+        while written < rows:
+            moment = start + step * written
+            if rng.random() < legacy_fraction:
+                timestamp = f"{moment.day}/{moment.month}/{moment.year} {moment.hour}:{moment.minute:02d}"
+            else:
+                timestamp = moment.strftime("%Y-%m-%d %H:%M:%S")
+            customer = rng.choice(["Unknown", f"Customer {rng.randrange(CUSTOMERS)}"])
+            lines = set(rng.choices(names, weights, k=min(rng.randint(1, 5), rows - written)))
+            index = written + 1
+            for product in lines:
+                amount = rng.randint(1, 3)
+                writer.writerow([index, customer, product, catalog[product], amount, round(catalog[product] * amount, 2), timestamp])
+            written += len(lines)
+
+def _time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"min_ms": min(timings), "median_ms": statistics.median(timings), "runs": repeat}
+
+def run(directory, store="csv", repeat=5):
+    """
+    Times the app's operations against the data in `directory`.
+
+    Returns:
+        dict: {"meta": {...}, "results": {operation: {"min_ms", "median_ms", "runs"}}}
+    """
+    os.environ["POS_STORE"] = store
+    os.chdir(directory)
+    pos_core.reset_state()
+    results = {}
+
+    if store == "sqlite" and not os.path.exists("transactions.db"):
+        results["migrate_sqlite"] = _time(pos_core.migrate_csv_to_sqlite, 1)
+    if store == "partitioned" and not os.path.exists(pos_core.PARTITION_DIR):
+        results["migrate_partitions"] = _time(pos_core.migrate_csv_to_partitions, 1)
+
+    # One-off work the first checkout after an upgrade or crash would pay for
+    results["counter_rebuild"] = _time(pos_core.rebuild_transaction_counter, 1)
+    results["rollup_rebuild"] = _time(lambda: pos_core.get_sales_rollup().rebuild(), 1)
+
+    products = pos_core.load_products()
+    names = list(products)
+    rows = pos_core.load_transactions()
+    newest = pos_core.parse_timestamp(rows[-1][6]) if rows else datetime.now()
+
+    def checkout():
+        cart = pos_core.Cart()
+        for name in random.sample(names, min(3, len(names))):
+            cart.add(name, products[name], amount=2)
+        pos_core.checkout(cart, "Benchmark")
+
+    def checkout_sync():
+        durability = os.environ.get("POS_DURABILITY")
+        os.environ["POS_DURABILITY"] = "sync"  # Store and rollup written before checkout() returns
+        try:
+            checkout()
+        finally:
+            if durability is None:
+                del os.environ["POS_DURABILITY"]
+            else:
+                os.environ["POS_DURABILITY"] = durability
+
+    def product_add():
+        pos_core.set_product("Benchmark product", 1.0)
+
+    def product_delete():
+        pos_core.remove_product("Benchmark product")
+
+    results["startup"] = _time(lambda: subprocess.run(
+        [sys.executable, "-c", "import pos_core; pos_core.load_products(); pos_core.load_transactions_page()"],
+        check=True, env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(pos_core.__file__))),
+    ), repeat)
+    results["catalog_load_cold"] = _time(lambda: (pos_core.reset_state(), pos_core.load_products()), repeat)
+    results["catalog_load_cached"] = _time(pos_core.load_products, repeat)
+    results["checkout"] = _time(checkout, repeat)
+    results["checkout_drain"] = _time(pos_core.flush_checkouts, 1)  # Write-behind catching up
+    results["checkout_sync"] = _time(checkout_sync, repeat)
+    results["rollup_snapshot"] = _time(lambda: pos_core.get_sales_rollup().save(), 1)  # Every ROLLUP_SNAPSHOT_ROWS logged rows
+    results["history_first_page"] = _time(pos_core.load_transactions_page, repeat)
+    results["history_filter_day_page"] = _time(lambda: pos_core.load_transactions_page(newest.year, newest.month, newest.day), repeat)
+    results["history_filter_month_full"] = _time(lambda: pos_core.load_transactions(newest.year, newest.month), repeat)
+    results["daily_sales"] = _time(pos_core.daily_sales, repeat)
+    results["daily_sales_scan"] = _time(lambda: pos_core.calculate_daily_sales_from_rows(pos_core.load_transactions()), repeat)
+    results["top10"] = _time(lambda: pos_core.top_products(10), repeat)
+    results["top10_week"] = _time(lambda: pos_core.top_products(10, start=newest.date() - timedelta(days=6)), repeat)
+    results["top10_scan"] = _time(lambda: pos_core.top_products_from_rows(pos_core.load_transactions(), 10), repeat)
+    results["scan_daily_sales"] = _time(pos_core.scan_daily_sales, repeat)
+    results["scan_top10"] = _time(lambda: pos_core.scan_top_products(10), repeat)
+    results["scan_filter_month"] = _time(lambda: pos_core.scan_transactions(newest.year, newest.month), repeat)
+    results["customer_index_build"] = _time(lambda: pos_core.CustomerIndex(pos_core.get_transaction_store(), load=False), 1)
+    results["customer_lookup"] = _time(lambda: pos_core.customer_history("Customer 1"), repeat)
+    results["customer_lookup_scan"] = _time(lambda: [row for row in pos_core.load_transactions() if row[1] == "Customer 1"], repeat)
+    if analytics.np is not None:
+        week = {"start": newest.date() - timedelta(days=6), "end": newest.date()}
+        results["analytics_build"] = _time(lambda: (shutil.rmtree("analytics_cache", ignore_errors=True), analytics.load_columns()), 1)
+        results["analytics_load"] = _time(analytics.load_columns, repeat)
+        columns = analytics.load_columns()
+        results["analytics_daily_sales"] = _time(columns.daily_sales, repeat)
+        results["analytics_top10"] = _time(lambda: columns.top_products(10), repeat)
+        results["analytics_top10_week"] = _time(lambda: columns.top_products(10, **week), repeat)
+        results["analytics_product_week_total"] = _time(lambda: columns.total(products=names[:5], **week), repeat)
+    results["product_add"] = _time(product_add, repeat)
+    results["product_delete"] = _time(product_delete, repeat)
+
+    # The parallel scans must give what the serial passes give, over the rows as they are now
+    current_rows = pos_core.load_transactions()
+    serial_daily = pos_core.calculate_daily_sales_from_rows(current_rows)
+    scan_daily = pos_core.scan_daily_sales()
+    scan_matches = {
+        "daily_sales": list(scan_daily) == list(serial_daily) and all(abs(scan_daily[day] - serial_daily[day]) < 0.005 for day in serial_daily),
+        "top10": pos_core.scan_top_products(10) == pos_core.top_products_from_rows(current_rows, 10),
+        "filter_month": pos_core.scan_transactions(newest.year, newest.month) == pos_core.load_transactions(newest.year, newest.month),
+    }
+    meta = {
+        "store": store,
+        "rows": len(rows),
+        "products": len(names),
+        "scan_workers": pos_core.SCAN_WORKERS,
+        "scan_matches_serial": scan_matches,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    try:
+        meta["revision"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        pass
+    return {"meta": meta, "results": results}
+
+def _stress_session(session, checkouts, seed):
+    """
+    One terminal of the stress test: rings up sales, deletes some of their rows, edits the
+    catalog and pages through the history, checking every row it reads.
+
+    Returns:
+        dict: {"sales": [[index, [product, ...]], ...], "deleted": [[index, product], ...], "bad_rows": int}
+    """
+    rng = random.Random(seed)
+    names = list(pos_core.load_products())
+    customer = f"Stress {session}"
+    result = {"sales": [], "deleted": [], "bad_rows": 0}
+    for i in range(1, checkouts + 1):
+        cart = pos_core.Cart()
+        for name in rng.sample(names, rng.randint(1, 3)):
+            cart.add(name, 1.0, amount=rng.randint(1, 3))
+        receipt = pos_core.checkout(cart, customer)
+        result["sales"].append([receipt["index"], list(receipt["lines"])])
+        if i % 5 == 0:
+            index, products = rng.choice(result["sales"])
+            product = rng.choice(products)
+            if [index, product] not in result["deleted"] and pos_core.delete_transaction(index, product) is not None:
+                result["deleted"].append([index, product])
+        if i % 10 == 0:
+            pos_core.set_product(f"{customer} product", i)
+        if i % 7 == 0:
+            rows, cursor = pos_core.load_transactions_page()
+            for row in rows:
+                try:
+                    int(row[0]), float(row[5]), pos_core.parse_timestamp(row[6])
+                    if len(row) != len(pos_core.TRANSACTION_HEADER):
+                        raise ValueError(row)
+                except (ValueError, IndexError):
+                    result["bad_rows"] += 1
+    pos_core.flush_checkouts()
+    return result
+
+def _stress_process(directory, store, session, checkouts, seed):
+    os.environ["POS_STORE"] = store
+    os.chdir(directory)
+    try:
+        return _stress_session(session, checkouts, seed)
+    finally:
+        pos_core.reset_state()  # Drains the checkout writer before the process exits
+
+def stress(directory, sessions=8, checkouts=200, processes=False, store="csv", seed=1):
+    """
+    Runs `sessions` terminals against `directory` at once and checks the store afterwards.
+    A small history is generated first if the directory has none.
+
+    Returns:
+        list: Descriptions of everything that went wrong, empty if the run was clean.
+    """
+    if not os.path.exists(os.path.join(directory, "transactions.csv")):
+        generate(directory, products=200, rows=5000, days=30, seed=seed)
+    directory = os.path.abspath(directory)
+    os.environ["POS_STORE"] = store
+    os.chdir(directory)
+    pos_core.reset_state()
+    if store == "sqlite" and not os.path.exists("transactions.db"):
+        pos_core.migrate_csv_to_sqlite()
+    if store == "partitioned" and not os.path.exists(pos_core.PARTITION_DIR):
+        pos_core.migrate_csv_to_partitions()
+    existing = {int(row[0]) for row in pos_core.load_transactions()}
+    pos_core.reset_state()
+
+    started = time.perf_counter()
+    if processes:
+        executor = ProcessPoolExecutor(sessions, mp_context=multiprocessing.get_context("spawn"))
+        submit = lambda session: executor.submit(_stress_process, directory, store, session, checkouts, seed + session)
+    else:
+        executor = ThreadPoolExecutor(sessions)
+        submit = lambda session: executor.submit(_stress_session, session, checkouts, seed + session)
+    with executor:
+        results = [future.result() for future in [submit(session) for session in range(sessions)]]
+    pos_core.reset_state()
+    elapsed = time.perf_counter() - started
+
+    problems = []
+    indices = Counter(index for result in results for index, products in result["sales"])
+    problems += [f"Index {index} handed out {count} times" for index, count in indices.items() if count > 1]
+    problems += [f"Index {index} was already taken" for index in indices if index in existing]
+
+    expected = {(index, product) for result in results for index, products in result["sales"] for product in products}
+    expected -= {(index, product) for result in results for index, product in result["deleted"]}
+    stored = Counter((int(row[0]), row[2]) for row in pos_core.load_transactions() if row[1].startswith("Stress "))
+    problems += [f"Sale {index} {product} stored {count} times" for (index, product), count in stored.items() if count > 1]
+    problems += [f"Sale {index} {product} lost" for index, product in sorted(expected - set(stored))]
+    problems += [f"Sale {index} {product} not expected" for index, product in sorted(set(stored) - expected)]
+    problems += [f"Session {session} read {result['bad_rows']} malformed rows" for session, result in enumerate(results) if result["bad_rows"]]
+
+    products = pos_core.load_products()
+    problems += [f"Catalog edit of session {session} lost" for session in range(sessions)
+                 if products.get(f"Stress {session} product") != float(checkouts - checkouts % 10)]
+    if store == "csv":
+        stored_index, rebuilt_index = pos_core.check_transaction_counter()
+        if stored_index != rebuilt_index:
+            problems.append(f"Transaction counter was {stored_index}, rebuilt {rebuilt_index}")
+    problems += [f"Rollup {key} was {stored_value}, transactions say {raw}" for key, stored_value, raw in pos_core.check_sales_rollup()]
+
+    sales = sum(indices.values())
+    print(f"{sessions} {'processes' if processes else 'threads'} rang up {sales} sales in {elapsed:.1f} s ({sales / elapsed:.0f}/s), "
+          f"{len(expected)} rows expected, {sum(stored.values())} stored")
+    return problems
+
+def compare(before, after, threshold=0.10, noise_ms=0.1):
+    """
+    Prints the median time per operation of two result files side by side.
+
+    Returns:
+        list: The operations that got slower by more than `threshold` (0.10 = 10%) and by
+            more than `noise_ms`, so sub-millisecond jitter isn't reported.
+    """
+    regressions = []
+    print(f"{'operation':28} {'before ms':>12} {'after ms':>12} {'change':>8}")
+    for name, result in after["results"].items():
+        if name not in before["results"]:
+            print(f"{name:28} {'-':>12} {result['median_ms']:12.2f}")
+            continue
+        old = before["results"][name]["median_ms"]
+        new = result["median_ms"]
+        change = (new - old) / old if old else 0.0
+        flag = "  SLOWER" if change > threshold and new - old > noise_ms else ""
+        print(f"{name:28} {old:12.2f} {new:12.2f} {change:+8.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="POS benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", help="Write synthetic products.csv and transactions.csv")
+    generate_parser.add_argument("--dir", default="bench_data")
+    generate_parser.add_argument("--products", type=int, default=10000)
+    generate_parser.add_argument("--rows", type=int, default=1000000)
+    generate_parser.add_argument("--days", type=int, default=365)
+    generate_parser.add_argument("--legacy-fraction", type=float, default=0.2)
+    generate_parser.add_argument("--seed", type=int, default=1)
+
+    run_parser = commands.add_parser("run", help="Time the app's operations on a generated directory")
+    run_parser.add_argument("--dir", default="bench_data")
+    run_parser.add_argument("--store", choices=sorted(pos_core.TRANSACTION_STORES), default="csv")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--output", help="Write the results to this JSON file (default: print them)")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown reported as a regression")
+
+    stress_parser = commands.add_parser("stress", help="Run several terminals at once and check nothing was lost or duplicated")
+    stress_parser.add_argument("--dir", default="stress_data")
+    stress_parser.add_argument("--store", choices=sorted(pos_core.TRANSACTION_STORES), default="csv")
+    stress_parser.add_argument("--sessions", type=int, default=8)
+    stress_parser.add_argument("--checkouts", type=int, default=200, help="Checkouts per session")
+    stress_parser.add_argument("--processes", action="store_true", help="One process per session instead of one thread")
+    stress_parser.add_argument("--seed", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        started = time.perf_counter()
+        generate(args.dir, args.products, args.rows, args.days, args.legacy_fraction, args.seed)
+        print(f"Generated {args.rows} rows and {args.products} products in {args.dir} ({time.perf_counter() - started:.1f} s)")
+    elif args.command == "run":
+        output = os.path.abspath(args.output) if args.output else None
+        results = run(args.dir, args.store, args.repeat)
+        if output:
+            with open(output, "w") as file:
+                json.dump(results, file, indent=2)
+            print(f"Results written to {output}")
+        else:
+            print(json.dumps(results, indent=2))
+    elif args.command == "compare":
+        with open(args.before) as file:
+            before = json.load(file)
+        with open(args.after) as file:
+            after = json.load(file)
+        if compare(before, after, args.threshold):
+            sys.exit(1)
+    elif args.command == "stress":
+        problems = stress(args.dir, args.sessions, args.checkouts, args.processes, args.store, args.seed)
+        for problem in problems:
+            print(problem)
+        print("FAILED" if problems else "OK")
+        if problems:
+            sys.exit(1)
@@ -0,0 +1,324 @@
+"""
+Streaming bulk import and export of the product catalog and the transactions.
+
+    python bulk.py import-products supplier_prices.csv
+    python bulk.py import-transactions history.jsonl
+    python bulk.py export-products catalog.csv
+    python bulk.py export-transactions - --format jsonl --year 2025
+
+Files are CSV with a header row or JSON Lines (one object per line), chosen by the file
+extension or --format; "-" is stdin or stdout. Column names are the ones the app writes
+(Name, Price for products, see pos_core.TRANSACTION_HEADER for transactions) in any case.
+
+Input is read and written BATCH_ROWS rows at a time, so memory use doesn't grow with the
+file, and the search index and sales rollups are updated once per batch. Rows that fail
+validation are skipped and listed, with their line number and the reason, in an error
+report next to the input (<input>.errors.csv).
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+
+import pos_core
+
+BATCH_ROWS = 5000
+FORMATS = ("csv", "jsonl")
+PRODUCT_FIELDS = ["Name", "Price"]
+
+def file_format(path, format=None):
+    """
+    Returns the format of `path`: `format` if given, else "jsonl" for .jsonl, .ndjson and
+    .json files and "csv" for everything else.
+    """
+    if format:
+        return format
+    return "jsonl" if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson", ".json") else "csv"
+
+def _open(path, mode):
+    encoding = "utf-8-sig" if mode == "r" else "utf-8"  # Files saved by Excel start with a byte order mark
+    if path == "-":
+        return os.fdopen(os.dup((sys.stdin if mode == "r" else sys.stdout).fileno()), mode, newline="", encoding=encoding)
+    return open(path, mode, newline="", encoding=encoding)
+
+class RejectedLine(ValueError):
+    """
+    A line that couldn't be parsed into a record, the line itself is in `text`.
+    """
+
+    def __init__(self, message, text):
+        super().__init__(message)
+        self.text = text
+
+def read_records(file, format):
+    """
+    Yields (line number, record) for every row of `file`. Records are dicts keyed by the
+    casefolded column names; a line that isn't a JSON object is yielded as a RejectedLine.
+    """
+    if format == "csv":
+        reader = csv.reader(file)
+        header = [name.strip().casefold() for name in next(reader, [])]
+        for row in reader:
+            if row:
+                yield reader.line_num, dict(zip(header, row))
+        return
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield line_number, RejectedLine(str(e), line.rstrip("\r\n"))
+            continue
+        yield line_number, {str(key).casefold(): value for key, value in record.items()}
+
+class ErrorReport:
+    """
+    CSV of rejected rows (line, error, record), only created once there is one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.writer = None
+        self.count = 0
+
+    def add(self, line_number, error, record):
+        if self.file is None:
+            self.file = open(self.path, "w", newline="", encoding="utf-8")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(["Line", "Error", "Record"])
+        self.writer.writerow([line_number, error, record.text if isinstance(record, RejectedLine) else json.dumps(record)])
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def _number(record, field, convert=float, default=None):
+    value = record.get(field)
+    if value is None or value == "":
+        if default is not None:
+            return default
+        raise ValueError(f"missing {field}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} is not a number: {value!r}")
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"{field} must be zero or more: {value!r}")
+    if convert is int:
+        if not number.is_integer():
+            raise ValueError(f"{field} must be a whole number: {value!r}")
+        return int(number)
+    return number
+
+def _text(record, field, default=None):
+    value = str(record.get(field) or "").strip()
+    if not value:
+        if default is not None:
+            return default
+        raise ValueError(f"missing {field}")
+    if "\n" in value or "\r" in value:
+        raise ValueError(f"{field} contains a line break")
+    return value
+
+def validate_product(record):
+    """
+    Returns (name, price) for a product record.
+
+    Raises:
+        ValueError: If the name is missing or the price isn't a number of zero or more.
+    """
+    return _text(record, "name"), _number(record, "price")
+
+def validate_transaction(record):
+    """
+    Returns a transaction record as a dict with a normalized timestamp. The total defaults
+    to price x amount, the customer to "Unknown"; the index is kept only to group the rows
+    of one sale.
+
+    Raises:
+        ValueError: If a field is missing or invalid.
+    """
+    price = _number(record, "price")
+    amount = _number(record, "amount", int)
+    if amount == 0:
+        raise ValueError("amount must be at least 1")
+    timestamp = _text(record, "timestamp")
+    try:
+        timestamp = pos_core.normalize_timestamp(timestamp)
+    except ValueError:
+        raise ValueError(f"unrecognized timestamp: {timestamp!r}")
+    return {
+        "index": str(record.get("index") or "").strip() or None,
+        "customer": _text(record, "customer", "Unknown"),
+        "product": _text(record, "product"),
+        "price": price,
+        "amount": amount,
+        "total": _number(record, "total", default=round(price * amount, 2)),
+        "timestamp": timestamp,
+    }
+
+def _default_errors_path(path):
+    return "import.errors.csv" if path == "-" else f"{path}.errors.csv"
+
+def import_products(path, format=None, errors_path=None, batch_rows=BATCH_ROWS):
+    """
+    Adds or reprices the products in `path`, BATCH_ROWS per catalog write.
+
+    Returns:
+        tuple: (imported, rejected) row counts.
+    """
+    format = file_format(path, format)
+    imported = 0
+    batch = []
+    with _open(path, "r") as file, ErrorReport(errors_path or _default_errors_path(path)) as errors:
+        for line_number, record in read_records(file, format):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(validate_product(record))
+            except ValueError as e:
+                errors.add(line_number, str(e), record)
+                continue
+            if len(batch) >= batch_rows:
+                pos_core.set_products(batch)
+                imported += len(batch)
+                batch = []
+        pos_core.set_products(batch)
+        return imported + len(batch), errors.count
+
+def import_transactions(path, format=None, errors_path=None, batch_rows=BATCH_ROWS):
+    """
+    Records the transactions in `path` as new sales, about BATCH_ROWS rows per store write.
+
+    Consecutive rows with the same index (or, without one, the same customer and
+    timestamp) become one sale; the sales get new indices. A product sold twice in a sale
+    becomes one line with the amounts and totals added up.
+
+    Returns:
+        tuple: (imported, rejected) row counts.
+    """
+    format = file_format(path, format)
+    imported = 0
+    sales = []
+    batch_size = 0  # Lines in `sales`
+    sale_key = None
+    with _open(path, "r") as file, ErrorReport(errors_path or _default_errors_path(path)) as errors:
+        for line_number, record in read_records(file, format):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                row = validate_transaction(record)
+            except ValueError as e:
+                errors.add(line_number, str(e), record)
+                continue
+            key = row["index"] or (row["customer"], row["timestamp"])
+            if key != sale_key:
+                if batch_size >= batch_rows:
+                    pos_core.import_sales(sales)
+                    sales = []
+                    batch_size = 0
+                sales.append({"customer": row["customer"], "lines": {}, "timestamp": row["timestamp"]})
+                sale_key = key
+            imported += 1
+            lines = sales[-1]["lines"]
+            if row["product"] in lines:
+                lines[row["product"]]["amount"] += row["amount"]
+                lines[row["product"]]["total"] = round(lines[row["product"]]["total"] + row["total"], 2)
+            else:
+                lines[row["product"]] = {"price": row["price"], "amount": row["amount"], "total": row["total"]}
+                batch_size += 1
+        if sales:
+            pos_core.import_sales(sales)
+        return imported, errors.count
+
+def export_products(path, format=None):
+    """
+    Writes the catalog to `path`.
+
+    Returns:
+        int: The number of products written.
+    """
+    format = file_format(path, format)
+    products = pos_core.load_products()
+    with _open(path, "w") as file:
+        if format == "csv":
+            writer = csv.writer(file)
+            writer.writerow(PRODUCT_FIELDS)
+            writer.writerows(products.items())
+        else:
+            for name, price in products.items():
+                file.write(json.dumps({"name": name, "price": price}) + "\n")
+    return len(products)
+
+def _typed(value, convert):
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        return value  # Exported as found, a malformed row isn't the export's to fix
+
+def export_transactions(path, format=None, year=None, month=None, day=None):
+    """
+    Streams the transactions (optionally of one year, month or day) to `path`.
+
+    Returns:
+        int: The number of rows written.
+    """
+    format = file_format(path, format)
+    count = 0
+    with _open(path, "w") as file:
+        writer = csv.writer(file)
+        if format == "csv":
+            writer.writerow(pos_core.TRANSACTION_HEADER)
+        for row in pos_core.iter_transactions(year, month, day):
+            if format == "csv":
+                writer.writerow(row)
+            else:
+                index, customer, product, price, amount, total, timestamp = row
+                file.write(json.dumps({
+                    "index": _typed(index, int), "customer": customer, "product": product,
+                    "price": _typed(price, float), "amount": _typed(amount, int),
+                    "total": _typed(total, float), "timestamp": timestamp,
+                }) + "\n")
+            count += 1
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import and export of products and transactions")
+    parser.add_argument("command", choices=["import-products", "import-transactions", "export-products", "export-transactions"])
+    parser.add_argument("path", help='CSV or JSON Lines file, "-" for stdin/stdout')
+    parser.add_argument("--format", choices=FORMATS, help="File format (default: from the file extension)")
+    parser.add_argument("--errors", help="Error report for rejected rows (default: <path>.errors.csv)")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="Rows written to the store at a time")
+    parser.add_argument("--year", help="Only export transactions of this year")
+    parser.add_argument("--month", help="Only export transactions of this month")
+    parser.add_argument("--day", help="Only export transactions of this day")
+    parser.add_argument("--store", choices=sorted(pos_core.TRANSACTION_STORES), help="Transaction store backend (default: $POS_STORE or csv)")
+    args = parser.parse_args()
+    if args.store:
+        os.environ["POS_STORE"] = args.store
+    os.environ.setdefault("POS_DURABILITY", "sync")  # A one-off run has no checkouts to batch
+
+    log = sys.stderr if args.path == "-" else sys.stdout
+    if args.command.startswith("import-"):
+        run = import_products if args.command == "import-products" else import_transactions
+        imported, rejected = run(args.path, args.format, args.errors, args.batch_rows)
+        print(f"Imported {imported} rows, rejected {rejected}"
+              + (f" (see {args.errors or _default_errors_path(args.path)})" if rejected else ""), file=log)
+    elif args.command == "export-products":
+        print(f"Exported {export_products(args.path, args.format)} products", file=log)
+    else:
+        print(f"Exported {export_transactions(args.path, args.format, args.year, args.month, args.day)} transactions", file=log)
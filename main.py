@@ -1,190 +1,238 @@
 import flet as ft
-import csv
 import os
+import threading
 import time
-from collections import defaultdict, Counter
 #import qrcode  # Import the qrcode library
 from datetime import datetime  # Import datetime for date manipulation
 
-def load_products():
-    products = {}
-    if os.path.exists("products.csv"):
-        with open("products.csv", "r") as file:
-            reader = csv.reader(file)
-            header = next(reader)  # Skip the header row
-            for row in reader:
-                if row:  # Check if the row is not empty
-                    products[row[0]] = float(row[1])
-    else:
-        products = {"Apple": 1.00, "Banana": 0.50, "Orange": 0.75, "Milk": 2.50, "Bread": 1.80}
-        save_products(products)
-    return products
-
-def save_products(products):
+import metrics
+import pos_core
+
+TRANSACTION_PAGE_SIZE = 50  # Rows fetched per "Load more" in the Transaction tab
+PRODUCT_MATCHES = 10  # Products listed under the search box of the POS tab
+CUSTOMER_RECENT_SALES = 5  # Latest sales shown in the POS tab's customer panel
+CUSTOMER_MATCHES = 5  # Known customers suggested while a name is typed
+PRODUCT_LIST_LIMIT = 200  # Products listed in the Products tab
+EVENT_FLUSH_DELAY = 0.05  # Seconds pos_core events are collected before the views are updated in one go
+PRODUCT_EVENTS = ["product_added", "product_repriced", "product_removed"]
+SALE_EVENTS = ["sale_recorded", "sale_voided", "sales_resynced"]
+CHECKOUT_EVENTS = ["checkouts_failed", "checkouts_recovered"]
+REPORT_LINES_LIMIT = 400  # Lines listed in the Sales tab, the most recent ones
+# Sales tab comparisons: period -> (this period, the one before), see pos_core.compare_sales
+COMPARISONS = {"today": ("Today", "yesterday"), "week": ("This week", "last week"), "month": ("This month", "last month")}
+
+def parse_day(field):
     """
-    Saves the products to the products.csv file, preserving the header row.
+    Returns the date typed in a "YYYY-MM-DD" text field, or None if it is empty.
 
-    Args:
-        products (dict): A dictionary of products and their prices.
+    Raises:
+        ValueError: If the field holds something else.
     """
-    header = ["Name", "Price"]
-    file_exists = os.path.exists("products.csv")
+    value = (field.value or "").strip()
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
 
-    with open("products.csv", "w", newline="") as file:
-        writer = csv.writer(file)
-        if file_exists:
-            #  The file exists, so don't write the header again if it's already there.
-            try:
-                with open("products.csv", "r") as check_file:
-                    reader = csv.reader(check_file)
-                    existing_header = next(reader)
-                    if existing_header != header:
-                        writer.writerow(header) # Write header if it doesn't match
-            except StopIteration:
-                writer.writerow(header) # Write header if the file is empty
-        else:
-            # The file does not exist, write the header.
-            writer.writerow(header)
-
-        # Write (or overwrite) all product data.
-        for name, price in products.items():
-            writer.writerow([name, price])
+def instrument_updates(page):
+    """
+    Wraps page.update so its time and the number of controls passed to it are added to
+    the metrics of the operation that called it. The trees under those controls aren't
+    walked, that would cost more than many of the updates it measures: views that append
+    or replace rows in a list they pass count them with metrics.add_controls. A
+    whole-page update() counts no controls of its own, there is nothing to count it by.
+    """
+    update = page.update
 
+    def timed_update(*controls):
+        sent = len(controls)
+        started = time.perf_counter()
+        update(*controls)
+        metrics.record_update(time.perf_counter() - started, sent)
 
+    page.update = timed_update
 
-def record_transaction(cart, customer_name):
-    if not os.path.exists("transactions.csv"):
-        with open("transactions.csv", "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["Index", "Customer", "Product", "Price", "Amount", "Total", "Timestamp"])
+class EventBatcher:
+    """
+    Hands pos_core events (see pos_core.EVENTS) to the views in batches. Events arriving
+    within `delay` of each other are collected, every view gets the ones it asked for in
+    a single call, and the controls the views changed are sent in one page.update().
 
-    with open("transactions.csv", "a", newline="") as file:
-        writer = csv.writer(file)
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        index = sum(1 for _ in open("transactions.csv"))  # Unique index
-        cart_summary = {}
+    A view registers with on(topics, handler). The handler is called with the list of
+    (topic, payload) of the batch and returns the controls it changed.
 
-        for item in cart:
-            if item[0] in cart_summary:
-                cart_summary[item[0]]["amount"] += 1
-                cart_summary[item[0]]["total"] += item[1]
-            else:
-                cart_summary[item[0]] = {"price": item[1], "amount": 1, "total": item[1]}
+    The subscriptions are process-wide, so close() has to be called when the session's
+    page goes away; open() subscribes again.
+    """
 
-        for product, details in cart_summary.items():
-            writer.writerow([index, customer_name, product, details["price"], details["amount"], details["total"], timestamp])
+    def __init__(self, page, delay=EVENT_FLUSH_DELAY):
+        self.page = page
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.pending = []
+        self.handlers = []
+        self.timer = None
+        self.closed = True
+        self.open()
+
+    def open(self):
+        with self.lock:
+            if not self.closed:
+                return
+            self.closed = False
+        for topic in pos_core.EVENTS:
+            pos_core.subscribe(topic, self.queue)
+
+    def on(self, topics, handler):
+        self.handlers.append((set(topics), handler))
+
+    def queue(self, topic, payload):
+        # Called by pos_core, possibly with the store lock held: only note the event
+        with self.lock:
+            self.pending.append((topic, payload))
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    @metrics.timed("event_flush")
+    def flush(self):
+        with self.lock:
+            events, self.pending, self.timer = self.pending, [], None
+            if self.closed:
+                return
+        changed = {}
+        for topics, handler in self.handlers:
+            wanted = [(topic, payload) for topic, payload in events if topic in topics]
+            if not wanted:
+                continue
+            try:
+                for control in handler(wanted) or ():
+                    changed[id(control)] = control
+            except Exception as e:
+                print(f"Error updating view {handler.__name__}: {e}")
+        if changed:
+            self.page.update(*changed.values())
+
+    def close(self):
+        for topic in pos_core.EVENTS:
+            pos_core.unsubscribe(topic, self.queue)
+        with self.lock:
+            self.closed = True
+            self.pending = []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
 
 def pos_system_content(page: ft.Page):
-    products = load_products()
-    cart = []
+    cart = pos_core.Cart()
+    cart_rows = {}  # product -> (row control, its text) for the lines shown in cart_list
     total_price = ft.Text("Total: $0.00", size=16, weight=ft.FontWeight.BOLD)
     cart_list = ft.Column()
     # product_list = ft.Column()  # Removed product_list
     feedback_text = ft.Text("", size=14, color=ft.Colors.GREEN)
     receipt_content = ft.Column()  # To store receipt
     customer_name_field = ft.TextField(label="Customer Name", width=250)
+    customer_panel = ft.Column(spacing=0)  # The typed customer's history, see show_customer
     customer_name = "Unknown" # default
 
-    def update_cart():
-        cart_list.controls.clear()
-        total = 0
-        cart_summary = {}
-        for item in cart:
-            if item[0] in cart_summary:
-                cart_summary[item[0]]["amount"] += 1
+    def cart_row(name):
+        def increase_quantity(e):
+            update_cart(name, cart.add(name, cart.lines[name]["price"]))
+
+        def decrease_quantity(e):
+            update_cart(name, cart.remove(name, 1))
+
+        remove_button = ft.IconButton(ft.Icons.DELETE, style=ft.ButtonStyle(padding=ft.padding.all(0),shape=ft.RoundedRectangleBorder(radius=2)), on_click=lambda e: remove_from_cart(name))
+        increase_button = ft.IconButton(ft.Icons.ADD, style=ft.ButtonStyle(padding=ft.padding.all(0),shape=ft.RoundedRectangleBorder(radius=2)), on_click=increase_quantity)
+        decrease_button = ft.IconButton(ft.Icons.REMOVE, style=ft.ButtonStyle(padding=ft.padding.all(0),shape=ft.RoundedRectangleBorder(radius=2)), on_click=decrease_quantity)
+        text = ft.Text(color=ft.Colors.BLUE, weight=ft.FontWeight.BOLD)
+        row = ft.Container(
+            content=ft.Row(
+                [
+                    text,
+                    decrease_button,
+                    increase_button,
+                    remove_button
+                ],
+                spacing=1,
+                tight=True
+            ),
+            padding=ft.padding.symmetric(vertical=-4)
+        )
+        return row, text
+
+    @metrics.timed("update_cart")
+    def update_cart(name=None, line=None, *extra_controls):
+        """
+        Patches the row of one cart line (None if it was removed) and the total. Only the
+        changed controls are sent to the client. With no name, the whole list is cleared.
+        """
+        changed = [total_price, *extra_controls]
+        if name is None:
+            cart_list.controls.clear()
+            cart_rows.clear()
+            changed.append(cart_list)
+        elif line is None:
+            row, text = cart_rows.pop(name, (None, None))
+            if row is not None:
+                cart_list.controls.remove(row)
+                changed.append(cart_list)
+        else:
+            if name not in cart_rows:
+                cart_rows[name] = cart_row(name)
+                cart_list.controls.append(cart_rows[name][0])
+                changed.append(cart_list)
             else:
-                cart_summary[item[0]] = {"price": item[1], "amount": 1}
-
-        for index, (name, details) in enumerate(cart_summary.items()):
-            def increase_quantity(e, product_name=name):
-                for item in cart:
-                    if item[0] == product_name:
-                        cart.append(item)  # Just add another item.
-                        break
-                update_cart()
-
-            def decrease_quantity(e, product_name=name):
-                for i, item in enumerate(cart):
-                    if item[0] == product_name:
-                        del cart[i] # Delete one matching item
-                        break
-                update_cart()
-
-            remove_button = ft.IconButton(ft.Icons.DELETE, style=ft.ButtonStyle(padding=ft.padding.all(0),shape=ft.RoundedRectangleBorder(radius=2)), on_click=lambda e, i=index: remove_from_cart(i))
-            increase_button = ft.IconButton(ft.Icons.ADD, style=ft.ButtonStyle(padding=ft.padding.all(0),shape=ft.RoundedRectangleBorder(radius=2)), on_click=increase_quantity)
-            decrease_button = ft.IconButton(ft.Icons.REMOVE, style=ft.ButtonStyle(padding=ft.padding.all(0),shape=ft.RoundedRectangleBorder(radius=2)), on_click=decrease_quantity)
-
-            cart_list.controls.append(
-                ft.Container(
-                    content=ft.Row(
-                        [
-                            ft.Text(f"{name} x{details['amount']} - ${details['price']:.2f}", color=ft.Colors.BLUE, weight=ft.FontWeight.BOLD),
-                            decrease_button,
-                            increase_button,
-                            remove_button
-                        ],
-                        spacing=1,
-                        tight=True
-                    ),
-                    padding=ft.padding.symmetric(vertical=-4)
-                )
-            )
-            total += details["price"] * details["amount"]
-        total_price.value = f"Total: ${total:.2f}"
-        page.update()
-
-    def add_to_cart(e):
-        item_name = product_dropdown.value
-        # ***Important change:*** Reload products *every time* an item is added.
-        products = load_products()
-        # Check if the selected item_name is in the products dictionary
-        if item_name in products:
-            item_price = products[item_name]
-            cart.append((item_name, item_price))
-            update_cart()
+                changed.append(cart_rows[name][1])
+            cart_rows[name][1].value = f"{name} x{line['amount']} - ${line['price']:.2f}"
+        total_price.value = f"Total: ${cart.total:.2f}"
+        page.update(*changed)
+
+    @metrics.timed("add_to_cart")
+    def add_to_cart(item_name):
+        # Look up the latest price, the catalog cache only re-reads products.csv if it changed.
+        item_price = pos_core.product_price(item_name)
+        if item_price is not None:
             feedback_text.value = "" # clear
+            update_cart(item_name, cart.add(item_name, item_price), feedback_text)
         else:
             print(f"Product {item_name} not found in products dictionary.") # error handling
             feedback_text.value = f"Product {item_name} not found!"
             page.update()
 
-    def remove_from_cart(index):
-        del cart[index]
-        update_cart()
+    def remove_from_cart(name):
+        update_cart(name, cart.remove(name))
 
+    @metrics.timed("checkout")
     def checkout(e):
         if cart:
-            customer_name = customer_name_field.value.strip()
-            if not customer_name:
-                customer_name = "Unknown"
-            record_transaction(cart, customer_name)
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-            total = 0
+            try:
+                receipt = pos_core.checkout(cart, customer_name_field.value)
+            except Exception as error:  # The store can't be written, keep the cart for another try
+                print(f"Checkout failed: {error}")
+                feedback_text.value = f"Checkout failed, the sale was not recorded: {error}"
+                feedback_text.color = ft.Colors.RED
+                page.update(feedback_text)
+                return
+            customer_name = receipt["customer"]
+            timestamp = receipt["timestamp"]
             receipt_content.controls.clear() # Clear previous receipt
             #receipt_content.controls.append(ft.Text("Receipt", size=20, weight=ft.FontWeight.BOLD, text_align=ft.TextAlign.CENTER))
             #receipt_content.controls.append(ft.Divider())
             receipt_content.controls.append(ft.Text(f"Customer Name: {customer_name}", text_align=ft.TextAlign.CENTER))
 
-            cart_summary = {} # Calculate the summary.
-            for item in cart:
-                if item[0] in cart_summary:
-                    cart_summary[item[0]]["amount"] += 1
-                    cart_summary[item[0]]["total"] += item[1]
-                else:
-                    cart_summary[item[0]] = {"price": item[1], "amount": 1, "total": item[1]}
-
-            for product, details in cart_summary.items():
+            for product, details in receipt["lines"].items():
                 receipt_content.controls.append(ft.Text(f"{product} x{details['amount']} - ${details['total']:.2f}"))
-                total += details["total"]
+            total = receipt["total"]
 
             receipt_content.controls.append(ft.Divider())
             receipt_content.controls.append(ft.Text(f"Total: ${total:.2f}", weight=ft.FontWeight.BOLD, text_align=ft.TextAlign.CENTER))
             receipt_content.controls.append(ft.Text(f"Date: {timestamp}", text_align=ft.TextAlign.CENTER)) # add time
             page.go("/receipt")  # Navigate to the receipt tab
             cart.clear()
-            update_cart()
             feedback_text.value = f"Checkout successful! Total: ${total:.2f}  {timestamp}"
+            feedback_text.color = ft.Colors.GREEN
             customer_name_field.value = ""  # Clear the customer name field
+            customer_panel.controls.clear()
+            update_cart()
             page.update()
 
         else:
@@ -193,46 +241,93 @@ def pos_system_content(page: ft.Page):
             page.dialog.open = True
             page.update()
 
-    def update_product_list():
-        products = load_products()  # Reload products.
-        product_dropdown.options.clear()
-        if not products:
-            product_dropdown.options.append(ft.dropdown.Option(text="No products available", key=""))
-            product_dropdown.value = ""
-            product_dropdown.disabled = True
+    def show_checkout_status(events):
+        """
+        Tells the cashier when rung up sales couldn't be saved yet, and when they were.
+        """
+        topic, payload = events[-1]
+        if topic == "checkouts_failed":
+            feedback_text.value = f"{payload['sales']} sales could not be saved yet and will be retried: {payload['error']}"
+            feedback_text.color = ft.Colors.RED
         else:
-            product_dropdown.disabled = False
-            for name, price in products.items():
-                product_dropdown.options.append(ft.dropdown.Option(text=f"{name} - ${price:.2f}", key=name))
-            product_dropdown.value = product_dropdown.options[0].key if product_dropdown.options else None # set default
-        page.update()
+            feedback_text.value = f"{payload['sales']} delayed sales were saved"
+            feedback_text.color = ft.Colors.GREEN
+        return [feedback_text]
+
+    def show_product_matches(events=None):
+        product_matches.controls = [
+            ft.TextButton(f"{name} - ${price:.2f}", on_click=lambda e, name=name: add_to_cart(name))
+            for name, price in pos_core.search_products(product_search.value or "", PRODUCT_MATCHES)
+        ]
+        return [product_matches]
+
+    @metrics.timed("update_product_matches")
+    def update_product_matches(e=None):
+        """
+        Lists the best matches for the search text, only those are sent to the client.
+        """
+        page.update(*show_product_matches())
+
+    @metrics.timed("show_customer")
+    def show_customer(e=None):
+        """
+        Shows the typed customer's visits, spend and latest sales under the name field, or
+        the known customers starting with what was typed so far.
+        """
+        name = customer_name_field.value or ""
+        history = pos_core.customer_history(name, CUSTOMER_RECENT_SALES) if name.strip() else None
+        if history is not None:
+            controls = [ft.Text(f"{history['name']}: {history['visits']} visits, ${history['spend']:.2f} spent, "
+                                f"last visit {history['last']}", weight=ft.FontWeight.BOLD)]
+            for sale in history["recent"]:
+                items = ", ".join(f"{product} x{amount}" for product, amount, total in sale["lines"])
+                controls.append(ft.Text(f"#{sale['index']} {sale['timestamp']}  ${sale['total']:.2f}  {items}", size=12))
+        elif name.strip():
+            controls = [ft.TextButton(match, on_click=lambda e, match=match: pick_customer(match))
+                        for match in pos_core.find_customers(name, CUSTOMER_MATCHES)]
+        else:
+            controls = []
+        customer_panel.controls = controls
+        page.update(customer_panel)
 
-    def refresh_products(e): # new function
-        products = load_products() # re-load
-        update_product_list() # re-populate the dropdown
-        page.update()
+    def pick_customer(name):
+        customer_name_field.value = name
+        page.update(customer_name_field)
+        show_customer()
 
-    # Create the input field and dropdown
-    product_dropdown = ft.Dropdown(
-        options=[],
-        on_change=add_to_cart,
-        label="Select a product",
-        width=250,  # increased width to accommodate price
-        disabled=True,
+    def add_first_match(e):
+        matches = pos_core.search_products(product_search.value or "", 1)
+        if matches:
+            add_to_cart(matches[0][0])
+
+    def refresh_products(e): # new function
+        update_product_matches() # re-run the search against the latest catalog
+
+    # Type-ahead search instead of a dropdown holding the whole catalog
+    product_search = ft.TextField(
+        label="Search products",
+        width=250,
+        on_change=update_product_matches,
+        on_submit=add_first_match,  # Enter adds the best match
     )
-    update_product_list()  # Initialize the dropdown options
+    product_matches = ft.Column(spacing=0)
+    customer_name_field.on_change = show_customer
     refresh_button = ft.ElevatedButton("Refresh", on_click=refresh_products)
     checkout_button = ft.ElevatedButton("Checkout", on_click=checkout, bgcolor=ft.Colors.GREEN)
 
-    # Store the dropdown and receipt in page.window
-    page.window.product_dropdown = product_dropdown
+    # Re-run the search when the catalog is edited in the Products tab
+    page.window.events.on(PRODUCT_EVENTS, show_product_matches)
+    page.window.events.on(CHECKOUT_EVENTS, show_checkout_status)
+    # Store the receipt in page.window
     page.window.receipt_content = receipt_content # store
 
     return ft.Column(
         [
             ft.Container(height=7),
             customer_name_field, # add customer name input
-            ft.Row([product_dropdown, refresh_button]),
+            customer_panel,
+            ft.Row([product_search, refresh_button]),
+            product_matches,
             ft.Text("Cart:", size=16, weight=ft.FontWeight.BOLD),
             cart_list,
             total_price,
@@ -242,7 +337,11 @@ def pos_system_content(page: ft.Page):
     )
 
 def transaction_history_content(page: ft.Page):
-    transactions_list = ft.Column()
+    # Only the rows that were fetched are in the list, more pages are loaded on demand.
+    transactions_list = ft.ListView(expand=True, spacing=0)
+    load_more_button = ft.TextButton("Load more", visible=False)
+    page_state = {"cursor": None}
+    shown_rows = {}  # (index, product) -> row control, for applying voids
 
     # Create the year, month, and day dropdowns
     year_dropdown = ft.Dropdown(
@@ -260,159 +359,188 @@ def transaction_history_content(page: ft.Page):
         label="Day",
         width=100,
     )
-
-    def load_transactions():
-        transactions = []
-        # Create transactions.csv if it doesn't exist
-        if not os.path.exists("transactions.csv"):
-            with open("transactions.csv", "w", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(["Index", "Customer", "Product", "Price", "Amount", "Total", "Timestamp"])
-
-        if os.path.exists("transactions.csv"):
-            with open("transactions.csv", "r") as file:
-                reader = csv.reader(file)
-                header = next(reader)  # Skip header row
-                for row in reader:
-                    transactions.append(row)
-        return transactions
-
-    def delete_transaction(e, index_to_delete):
-        transactions = load_transactions()
-        if 0 <= index_to_delete < len(transactions):
-            del transactions[index_to_delete]
-            # Rewrite the CSV without the deleted row
-            with open("transactions.csv", "w", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(["Index", "Customer", "Product", "Price", "Amount", "Total", "Timestamp"])  # Write header
-                for i, row in enumerate(transactions):
-                    writer.writerow([i + 1] + row[1:])  # Re-index and write data
-            update_transactions_list()
-        else:
-            print(f"Index {index_to_delete} out of range.  Transactions length: {len(transactions)}")
-
-    def update_transactions_list(_=None):
+    start_field = ft.TextField(label="From (YYYY-MM-DD)", width=170)
+    end_field = ft.TextField(label="To (YYYY-MM-DD)", width=170)
+    filter_note = ft.Text("", size=12, italic=True)
+    date_range = {"start": None, "end": None}  # Parsed from start_field and end_field by show_first_page
+
+    def delete_transaction_row(e, index, product):
+        pos_core.delete_transaction(index, product)  # The row is removed by apply_sale_events
+
+    def transaction_row(row):
+        index, customer, product, price, amount, total, timestamp = row # include customer
+        delete_button = ft.IconButton(ft.Icons.DELETE, on_click=lambda e, index=index, product=product: delete_transaction_row(e, index, product))
+        shown_rows[int(index), product] = ft.Container(
+            content=ft.Row(
+                [
+                    ft.Text(f"#{int(index)}"),
+                    ft.Text(f"Customer: {customer}"), # display customer name
+                    ft.Text(f"Product: {product}"), # Display Product
+                    ft.Text(f"Price: ${float(price):.2f}"),
+                    ft.Text(f"Amount: x{amount}"), # Display Amount
+                    ft.Text(f"Total: ${float(total):.2f}"),
+                    ft.Text(timestamp),
+                    delete_button
+                ],
+                spacing=1,
+                tight=True
+            ),
+            padding=ft.padding.symmetric(vertical=-2)
+        )
+        return shown_rows[int(index), product]
+
+    def matches_filter(timestamp):
+        when = pos_core.parse_timestamp(timestamp)
+        return (all(not value or int(value) == part for value, part in
+                    ((year_dropdown.value, when.year), (month_dropdown.value, when.month), (day_dropdown.value, when.day)))
+                and (date_range["start"] is None or when.date() >= date_range["start"])
+                and (date_range["end"] is None or when.date() <= date_range["end"]))
+
+    def apply_sale_events(events):
+        """
+        Adds new sales to the top of the list and removes voided rows, leaving the rest.
+        After a rewrite of the store the first page is loaded again.
+        """
+        if any(topic == "sales_resynced" for topic, payload in events):
+            show_first_page()
+            return [transactions_list, load_more_button]
+        for topic, payload in events:
+            if topic == "sale_recorded":
+                if matches_filter(payload["timestamp"]):
+                    # A sale can be seen both as it is rung up and by the follower, list it once
+                    new_rows = [row for row in payload["rows"] if (int(row[0]), row[2]) not in shown_rows]
+                    transactions_list.controls[0:0] = [transaction_row(row) for row in new_rows]
+                    metrics.add_controls(len(new_rows))
+            else:
+                row = shown_rows.pop((payload["index"], payload["product"]), None)
+                if row is not None:
+                    transactions_list.controls.remove(row)
+        return [transactions_list]
+
+    def fetch_page():
+        """
+        Appends the next page of rows to the list and returns how many there were.
+        """
+        # Newest first, the store only reads as far back as this page needs
+        page_rows, page_state["cursor"] = pos_core.load_transactions_page(
+            year_dropdown.value, month_dropdown.value, day_dropdown.value,
+            before=page_state["cursor"], limit=TRANSACTION_PAGE_SIZE,
+            start=date_range["start"], end=date_range["end"],
+        )
+        transactions_list.controls.extend(transaction_row(row) for row in page_rows)
+        load_more_button.visible = page_state["cursor"] is not None
+        return len(page_rows)
+
+    def show_first_page():
         transactions_list.controls.clear()
-        transactions = load_transactions()
-        filtered_transactions = []
-
-        # Get filter values
-        selected_year = year_dropdown.value
-        selected_month = month_dropdown.value
-        selected_day = day_dropdown.value
-
-        # Apply filters
-        for row in transactions:
-            try:
-                timestamp_str = row[6]  # Timestamp is in the 7th column (index 6)
-                # Attempt to parse the date with the format '2/4/2025 10:33'
-                try:
-                    transaction_date = datetime.strptime(timestamp_str, "%d/%m/%Y %H:%M")
-                except ValueError:
-                    # If the first format fails, try the original format '%Y-%m-%d %H:%M:%S'
-                    transaction_date = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-
-                year_match = not selected_year or transaction_date.year == int(selected_year)
-                month_match = not selected_month or transaction_date.month == int(selected_month)
-                day_match = not selected_day or transaction_date.day == int(selected_day)
-
-                if year_match and month_match and day_match:
-                    filtered_transactions.append(row)
-            except ValueError as e:
-                print(f"Error parsing date: {e}, for row: {row}") # handle parsing issue
-
-        # Reverse the order of filtered transactions before displaying
-        for i, row in reversed(list(enumerate(filtered_transactions))):
-            index, customer, product, price, amount, total, timestamp = row # include customer
-            delete_button = ft.IconButton(ft.Icons.DELETE, on_click=lambda e, i=i: delete_transaction(e, i))
-            transactions_list.controls.append(
-                ft.Container(
-                    content=ft.Row(
-                        [
-                            ft.Text(f"#{int(index)}"),
-                            ft.Text(f"Customer: {customer}"), # display customer name
-                            ft.Text(f"Product: {product}"), # Display Product
-                            ft.Text(f"Price: ${float(price):.2f}"),
-                            ft.Text(f"Amount: x{amount}"), # Display Amount
-                            ft.Text(f"Total: ${float(total):.2f}"),
-                            ft.Text(timestamp),
-                            delete_button
-                        ],
-                        spacing=1,
-                        tight=True
-                    ),
-                    padding=ft.padding.symmetric(vertical=-2)
-                )
-            )
-
-        page.update()
+        shown_rows.clear()
+        page_state["cursor"] = None
+        try:
+            date_range["start"], date_range["end"] = parse_day(start_field), parse_day(end_field)
+        except ValueError:
+            filter_note.value = "Enter dates as YYYY-MM-DD"
+            load_more_button.visible = False
+            return 0
+        filter_note.value = ""
+        return fetch_page()
+
+    @metrics.timed("load_more_transactions")
+    def load_more(_=None):
+        metrics.add_controls(fetch_page())
+        page.update(transactions_list, load_more_button)
+
+    @metrics.timed("update_transactions_list")
+    def update_transactions_list(_=None):
+        metrics.add_controls(show_first_page())
+        page.update(transactions_list, load_more_button, filter_note)
 
+    load_more_button.on_click = load_more
+    start_field.on_submit = update_transactions_list
+    end_field.on_submit = update_transactions_list
     refresh_button = ft.ElevatedButton("Refresh", on_click=lambda _: update_transactions_list())
+    page.window.events.on(SALE_EVENTS, apply_sale_events)
 
-    # Initial update
-    update_transactions_list()
+    # Initial page, sent with the tab
+    show_first_page()
 
     return ft.Column(
         [
             ft.Text("Transaction History", size=20, weight=ft.FontWeight.BOLD),
             ft.Row([year_dropdown, month_dropdown, day_dropdown]), # add the dropdowns
-            refresh_button,
-            transactions_list
-        ]
+            ft.Row([start_field, end_field, refresh_button]),
+            filter_note,
+            transactions_list,
+            load_more_button,
+        ],
+        expand=True,
     )
 
 def products_tab_content(page: ft.Page):
-    products = load_products()
     products_list = ft.Column()
 
-    def load_products_data():
-        products_data = []
-        if os.path.exists("products.csv"):
-            with open("products.csv", "r") as file:
-                reader = csv.reader(file)
-                header = next(reader)  # Skip the header row.  Added in response to user query.
-                for row in reader:
-                    if row:
-                        products_data.append(row)
-        return products_data
+    list_note = ft.Text("", size=12, italic=True)
+    shown = {}  # name -> (row, price text) of the products in products_list
+    list_state = {"total": 0}  # Products matching the search, shown or not
 
-    def update_products_list(e=None): # Make e optional
+    def load_products_data():
+        query = search_field.value or ""
+        if query:
+            return pos_core.search_products(query, PRODUCT_LIST_LIMIT)
+        return list(pos_core.load_products().items())  # Served from the shared catalog cache
+
+    def product_row(name, price):
+        price_text = ft.Text(f"${float(price):.2f}")
+        delete_button = ft.IconButton(ft.Icons.DELETE, on_click=lambda e, product_name=name: delete_product(e, product_name), data=name)
+        shown[name] = (ft.Row([ft.Text(name), price_text, delete_button]), price_text)
+        return shown[name][0]
+
+    def show_note():
+        # Only a screenful is sent to the client, the search narrows it down
+        total = list_state["total"]
+        list_note.value = f"Showing {len(shown)} of {total}, search to narrow down" if total > len(shown) else ""
+
+    def show_products():
         products_list.controls.clear()
+        shown.clear()
         products_data = load_products_data()
-        for name, price in products_data:
-            delete_button = ft.IconButton(ft.Icons.DELETE, on_click=lambda e, product_name=name: delete_product(e, product_name), data=name)
-            products_list.controls.append(
-                ft.Row([
-                    ft.Text(name),
-                    ft.Text(f"${float(price):.2f}"),
-                    delete_button
-                ])
-            )
-        # Update the product dropdown in the POS tab.
-        if page.window.product_dropdown:
-            product_dropdown = page.window.product_dropdown
-            product_dropdown.options.clear()
-            products_dict = load_products() # get latest
-            if not products_dict:
-                product_dropdown.options.append(ft.dropdown.Option(text="No products available", key=""))
-                product_dropdown.value = ""
-                product_dropdown.disabled = True
-            else:
-                product_dropdown.disabled = False
-                for name, price in products_dict.items():
-                    product_dropdown.options.append(ft.dropdown.Option(text=f"{name} - ${price:.2f}", key=name))
-                product_dropdown.value = product_dropdown.options[0].key if product_dropdown.options else None
-            # Find the POS tab and update.
-            for control in page.controls:
-                if isinstance(control, ft.Tabs):
-                    for tab in control.tabs:
-                        if tab.text == "POS System":
-                            # Force update of the POS tab.
-                            tab.content.update()
-                            break
-                    break
-        page.update()
+        list_state["total"] = len(products_data)
+        products_list.controls.extend(product_row(name, price) for name, price in products_data[:PRODUCT_LIST_LIMIT])
+        show_note()
 
+    @metrics.timed("update_products_list")
+    def update_products_list(e=None): # Make e optional
+        show_products()
+        metrics.add_controls(len(shown))
+        page.update(products_list, list_note)
+
+    def apply_product_events(events):
+        """
+        Adds, reprices and removes only the rows of the products that changed.
+        """
+        query = search_field.value or ""
+        matches = None  # Names matching the query, searched once per batch (an import adds thousands)
+        for topic, payload in events:
+            name = payload["name"]
+            if topic == "product_repriced":
+                if name in shown:
+                    shown[name][1].value = f"${payload['price']:.2f}"
+            elif topic == "product_added":
+                if query and matches is None:
+                    matches = {match for match, price in pos_core.search_products(query, PRODUCT_LIST_LIMIT)}
+                if query and name not in matches:
+                    continue
+                list_state["total"] += 1
+                if len(shown) < PRODUCT_LIST_LIMIT:
+                    products_list.controls.append(product_row(name, payload["price"]))
+            elif name in shown:
+                products_list.controls.remove(shown.pop(name)[0])
+                list_state["total"] -= 1
+            elif not query:
+                list_state["total"] -= 1  # Matched, but wasn't shown
+        show_note()
+        return [products_list, list_note]
+
+    search_field = ft.TextField(label="Search", width=200, on_change=update_products_list)
     product_name_field = ft.TextField(label="Product Name", width=200)
     product_price_field = ft.TextField(label="Price", keyboard_type=ft.KeyboardType.NUMBER, width=100)
 
@@ -422,9 +550,7 @@ def products_tab_content(page: ft.Page):
         if new_product_name and new_product_price:
             try:
                 new_product_price = float(new_product_price)
-                products[new_product_name] = new_product_price
-                save_products(products)
-                update_products_list()  # Update the product list after adding a new product
+                pos_core.set_product(new_product_name, new_product_price)  # Keeps edits made at other terminals, the list follows through apply_product_events
                 product_name_field.value = ""
                 product_price_field.value = ""
                 page.update()
@@ -434,15 +560,11 @@ def products_tab_content(page: ft.Page):
                 page.update()
 
     def delete_product(e, product_name):
-        if product_name in products:
-            del products[product_name]
-            save_products(products)
-            update_products_list()
-            page.update()
-        else:
+        if not pos_core.remove_product(product_name):  # The row is removed by apply_product_events
             print(f"Product {product_name} not found.")
 
-    update_products_list()
+    show_products()  # Sent with the tab
+    page.window.events.on(PRODUCT_EVENTS, apply_product_events)
 
     add_product_button = ft.ElevatedButton("Add Product", on_click=add_product, bgcolor=ft.Colors.BLUE)
     refresh_button = ft.ElevatedButton("Refresh", on_click=lambda _: update_products_list())
@@ -451,6 +573,8 @@ def products_tab_content(page: ft.Page):
         [
             ft.Text("Products", size=20, weight=ft.FontWeight.BOLD),
             ft.Row([product_name_field, product_price_field, add_product_button, refresh_button]),
+            search_field,
+            list_note,
             products_list,
         ]
     )
@@ -458,43 +582,85 @@ def products_tab_content(page: ft.Page):
 def hello_world_content(page: ft.Page):
     sales_data_text = ft.Text("Sales Data", size=20, weight=ft.FontWeight.BOLD)
     sales_display_area = ft.Column()
+    bucket_texts = {}  # report bucket -> its line in sales_display_area
+    no_sales_text = ft.Text("No sales data available.")
+    report_note = ft.Text("", size=12, italic=True)
+    comparison_text = ft.Text("", weight=ft.FontWeight.BOLD)
 
+    @metrics.timed("calculate_daily_sales")
     def calculate_daily_sales():
-        daily_sales = defaultdict(float)
-        if os.path.exists("transactions.csv"):
-            with open("transactions.csv", "r") as file:
-                reader = csv.reader(file)
-                header = next(reader)  # Skip header
-                for row in reader:
-                    try:
-                        timestamp = row[6]  # Timestamp is in the 7th column (index 6) now
-                        date = timestamp.split()[0]  # Extract date part
-                        total = float(row[5])      # Total price is in 6th column now
-                        daily_sales[date] += total
-                    except (ValueError, IndexError) as e:
-                        print(f"Error processing row: {row}. Error: {e}") #handle errors
-
-        return daily_sales
-
+        # Range sums come from the rollup's cumulative day index, nothing is rescanned
+        report = pos_core.sales_report(parse_day(start_field), parse_day(end_field), granularity_dropdown.value)
+        return {bucket: total for bucket, total in report.items() if total}
+
+    def show_comparison():
+        this_period, last_period = COMPARISONS[comparison_dropdown.value]
+        comparison = pos_core.compare_sales(comparison_dropdown.value)
+        change = "" if comparison["change"] is None else f" ({comparison['change']:+.1%})"
+        comparison_text.value = f"{this_period}: ${comparison['current'][2]:.2f} vs {last_period}: ${comparison['previous'][2]:.2f}{change}"
+
+    def show_daily_sales(events=None):
+        """
+        Updates the lines of the buckets whose total changed and returns them. The whole
+        list is only returned when buckets were added or removed.
+        """
+        try:
+            report = calculate_daily_sales()
+        except ValueError:
+            report_note.value = "Enter dates as YYYY-MM-DD"
+            return [report_note]
+        show_comparison()
+        changed = [comparison_text, report_note]
+        shown = list(report)[-REPORT_LINES_LIMIT:]  # The most recent ones
+        report_note.value = f"Showing the last {len(shown)} of {len(report)}, narrow the range to see the rest" if len(shown) < len(report) else ""
+        label = granularity_dropdown.value.capitalize()
+        for bucket in shown:
+            line = f"{label}: {bucket}, Total Sales: ${report[bucket]:.2f}"
+            if bucket not in bucket_texts:
+                bucket_texts[bucket] = ft.Text(line)
+            elif bucket_texts[bucket].value != line:
+                bucket_texts[bucket].value = line
+                changed.append(bucket_texts[bucket])
+        for bucket in set(bucket_texts) - set(shown):
+            del bucket_texts[bucket]
+        controls = [bucket_texts[bucket] for bucket in shown] or [no_sales_text]
+        if controls != sales_display_area.controls:
+            sales_display_area.controls = controls
+            changed.append(sales_display_area)
+        return changed
+
+    @metrics.timed("update_sales_display")
     def update_sales_display(e=None): # Add e as an optional parameter.
-        sales_display_area.controls.clear()
-        daily_sales = calculate_daily_sales()
-        if not daily_sales:
-            sales_display_area.controls.append(ft.Text("No sales data available."))
-        else:
-            for date, total_sales in daily_sales.items():
-                sales_display_area.controls.append(ft.Text(f"Date: {date}, Total Sales: ${total_sales:.2f}"))
-        page.update()
-
+        page.update(*show_daily_sales())
+
+    start_field = ft.TextField(label="From (YYYY-MM-DD)", width=170, on_submit=update_sales_display)
+    end_field = ft.TextField(label="To (YYYY-MM-DD)", width=170, on_submit=update_sales_display)
+    granularity_dropdown = ft.Dropdown(
+        options=[ft.dropdown.Option(key=granularity, text=granularity.capitalize()) for granularity in pos_core.SALES_GRANULARITIES],
+        value="day",
+        label="Per",
+        width=120,
+        on_change=update_sales_display,
+    )
+    comparison_dropdown = ft.Dropdown(
+        options=[ft.dropdown.Option(key=period, text=f"{this_period} vs {last_period}") for period, (this_period, last_period) in COMPARISONS.items()],
+        value="week",
+        label="Compare",
+        width=250,
+        on_change=update_sales_display,
+    )
     refresh_button = ft.ElevatedButton("Refresh Sales Data", on_click=update_sales_display)
 
-    # Initial update
-    update_sales_display()
+    # Initial update, then the totals follow every checkout and void
+    show_daily_sales()
+    page.window.events.on(SALE_EVENTS, show_daily_sales)
 
     return ft.Column(
         [
             sales_data_text,
-            refresh_button,
+            ft.Row([comparison_dropdown, comparison_text]),
+            ft.Row([start_field, end_field, granularity_dropdown, refresh_button]),
+            report_note,
             sales_display_area,
         ]
     )
@@ -503,43 +669,57 @@ def hello_4_content(page: ft.Page):
     def quit_app(e):
         page.window.close()
 
+    @metrics.timed("get_top_10_sales")
     def get_top_10_sales():
-        product_quantities = Counter()
-        if os.path.exists("transactions.csv"):
-            with open("transactions.csv", "r") as file:
-                reader = csv.reader(file)
-                header = next(reader)
-                for row in reader:
-                    try:
-                        product = row[2]  # Product name is now in the 3rd column
-                        amount = int(row[4]) # Amount sold is now in the 5th column
-                        product_quantities[product] += amount
-                    except (ValueError, IndexError) as e:
-                        print(f"Error processing row: {row}. Error: {e}")
-        # Get the top 10 products
-        top_10 = product_quantities.most_common(10)
-        return top_10
-
+        # Get the top 10 products from the maintained product quantities
+        return pos_core.top_products(10, period=window_dropdown.value)
+
+    def show_top_10(events=None):
+        """
+        Rewrites the lines that changed, reusing the Text controls, and returns them.
+        """
+        lines = [f"Product: {product}, Quantity Sold: {quantity}" for product, quantity in get_top_10_sales()]
+        lines = lines or ["No sales data available."]
+        controls = top_10_sales_list.controls
+        changed = [top_10_sales_list] if len(controls) != len(lines) else []
+        del controls[len(lines):]
+        for position, line in enumerate(lines):
+            if position == len(controls):
+                controls.append(ft.Text(line))
+            elif controls[position].value != line:
+                controls[position].value = line
+                changed.append(controls[position])
+        return changed
+
+    @metrics.timed("update_top_10_list")
     def update_top_10_list(e=None): # Add e as an optional parameter.
-        top_10_sales_list.controls.clear()
-        top_10_products = get_top_10_sales()
-        if not top_10_products:
-            top_10_sales_list.controls.append(ft.Text("No sales data available."))
-        else:
-            for product, quantity in top_10_products:
-                top_10_sales_list.controls.append(ft.Text(f"Product: {product}, Quantity Sold: {quantity}"))
-        page.update()
+        changed = show_top_10()
+        if changed:
+            page.update(*changed)
 
     top_10_sales_title = ft.Text("Top 10 Sales", size=20, weight=ft.FontWeight.BOLD)
     top_10_sales_list = ft.Column()
-    update_top_10_list() # Initial update
+    window_dropdown = ft.Dropdown(
+        options=[
+            ft.dropdown.Option(key="all", text="All time"),
+            ft.dropdown.Option(key="month", text="This month"),
+            ft.dropdown.Option(key="week", text="This week"),
+            ft.dropdown.Option(key="today", text="Today"),
+        ],
+        value="all",
+        label="Period",
+        width=150,
+        on_change=update_top_10_list,
+    )
+    show_top_10() # Initial update
+    page.window.events.on(SALE_EVENTS, show_top_10)
 
     refresh_button = ft.ElevatedButton("Refresh Top 10 Sales", on_click=update_top_10_list)
 
     return ft.Column(
         [
             top_10_sales_title, # Title
-            refresh_button,
+            ft.Row([window_dropdown, refresh_button]),
             top_10_sales_list,
             ft.Divider(),
             ft.ElevatedButton("Quit", on_click=quit_app),
@@ -598,37 +778,79 @@ def qr_code_tab_content(page: ft.Page):
         alignment=ft.MainAxisAlignment.CENTER
     )
 
+# Tab titles and the functions that build their content, in display order.
+TABS = [
+    ("POS System", pos_system_content),
+    ("Transaction", transaction_history_content),
+    ("Products", products_tab_content),
+    ("Sales", hello_world_content),
+    ("Top", hello_4_content),
+    ("Receipt", receipt_tab_content),
+    ("QR Code", qr_code_tab_content),
+]
+
 def main(page: ft.Page):
+    startup_started = time.perf_counter()
     page.title = "My POS App"
+    instrument_updates(page)
 
-    # Store the page in page.window
+    # Store the page and the event batcher the tabs register with in page.window
     page.window.main_page = page
+    page.window.events = EventBatcher(page)
+
+    def disconnected(e):
+        page.window.events.close()  # The session may be gone for good, stop updating its page
+
+    def reconnected(e):
+        page.window.events.open()
+        page.window.events.queue("sales_resynced", {})  # Sales were missed meanwhile, reload those views
+
+    page.on_disconnect = disconnected
+    page.on_close = disconnected
+    page.on_connect = reconnected
+    # Sales rung up at other tills reach the views as events too, from the one follower of
+    # this process, see pos_core.SalesFollower
+    pos_core.get_sales_follower()
+
+    # Build times in ms per tab index. A tab is only built (and its data loaded) when it is
+    # first shown, so startup only pays for the POS tab.
+    build_times = {}
+
+    def build_tab(index):
+        if index not in build_times:
+            started = time.perf_counter()
+            title, builder = TABS[index]
+            tabs.tabs[index].content = builder(page)
+            build_times[index] = (time.perf_counter() - started) * 1000
+            print(f"Built {title} tab in {build_times[index]:.1f} ms")
+
+    def select_tab(index):
+        build_tab(index)
+        tabs.selected_index = index
+
+    def tab_changed(e):
+        build_tab(tabs.selected_index)
+        page.update()
 
     tabs = ft.Tabs(
         expand=True,
-        tabs=[
-            ft.Tab(text="POS System", content=pos_system_content(page)),
-            ft.Tab(text="Transaction", content=transaction_history_content(page)),
-            ft.Tab(text="Products", content=products_tab_content(page)),
-            ft.Tab(text="Sales", content=hello_world_content(page)),
-            ft.Tab(text="Top", content=hello_4_content(page)),
-            ft.Tab(text="Receipt", content=receipt_tab_content(page)),
-            ft.Tab(text="QR Code", content=qr_code_tab_content(page)),
-        ],
+        tabs=[ft.Tab(text=title) for title, builder in TABS],
+        on_change=tab_changed,
         #animate_selected_content=True, # causes error
         label_color=ft.Colors.RED,  # Set label color
         overlay_color=ft.Colors.TRANSPARENT,  # Remove overlay color
         indicator_color=ft.Colors.BLUE,  # Set indicator color
     )
+    build_tab(0)  # The POS tab is needed right away, and the Products and Receipt tabs use its controls
 
     # Add a function to handle route changes for navigation
     def route_change(route):
         if page.route == "/receipt":
-            tabs.selected_index = 5
+            select_tab(5)
         elif page.route == "/qr":
-            tabs.selected_index = 6
+            select_tab(6)
         else:
-            tabs.selected_index = 0
+            select_tab(0)
         page.update()
 
     page.on_route_change = route_change
@@ -636,6 +858,16 @@ def main(page: ft.Page):
 
     page.add(ft.Text("", size=20, weight=ft.FontWeight.BOLD, text_align=ft.TextAlign.CENTER),
             tabs)
+    print(f"Startup took {(time.perf_counter() - startup_started) * 1000:.1f} ms "
+          f"({', '.join(f'{TABS[index][0]} {ms:.1f} ms' for index, ms in build_times.items())})")
 
 if __name__ == "__main__":
-    ft.app(target=main)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="My POS App")
+    pos_core.add_command_arguments(parser)
+    if not pos_core.run_command(parser.parse_args()):
+        if os.environ.get("POS_METRICS_PORT"):
+            # Diagnostics: curl http://127.0.0.1:$POS_METRICS_PORT/metrics for p50/p95/p99 per operation
+            metrics.serve(int(os.environ["POS_METRICS_PORT"]))
+        ft.app(target=main)
@@ -0,0 +1,228 @@
+"""
+Latency instrumentation for UI handlers and storage calls.
+
+Every timed operation gets a histogram of its durations. Time spent in page.update()
+while an operation runs, and the number of controls passed to those updates (plus the
+rows noted with add_controls), are added to the operation (and to every operation it
+was called from):
+
+    @metrics.timed("add_to_cart")
+    def add_to_cart(item_name):
+        ...
+
+    with metrics.timed("update_cart"):
+        ...
+
+Operations slower than SLOW_OPERATION_MS ($POS_SLOW_MS) are appended to
+slow_operations.jsonl. snapshot() returns p50/p95/p99 per operation; with
+$POS_METRICS_PORT set the app serves it as JSON on http://127.0.0.1:<port>/metrics.
+"""
+import functools
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SLOW_OPERATION_MS = float(os.environ.get("POS_SLOW_MS", "100"))
+SLOW_LOG = "slow_operations.jsonl"
+BUCKETS_PER_DOUBLING = 8  # Bucket width is 2 ** (1 / 8), about 9%
+
+class LatencyHistogram:
+    """
+    Durations counted in logarithmic buckets, so percentiles cost the same after a
+    million samples as after ten. A percentile is the upper bound of its bucket, at most
+    9% above the true value and never above the slowest sample.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.update_seconds = 0.0
+        self.controls = 0
+        self.max_controls = 0
+
+    @staticmethod
+    def _bucket(seconds):
+        microseconds = seconds * 1e6
+        return int(math.log2(microseconds) * BUCKETS_PER_DOUBLING) if microseconds > 1 else 0
+
+    def add(self, seconds, update_seconds=0.0, controls=0):
+        bucket = self._bucket(seconds)
+        with self.lock:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self.update_seconds += update_seconds
+            self.controls += controls
+            self.max_controls = max(self.max_controls, controls)
+
+    def percentile(self, fraction):
+        """
+        Returns the duration in seconds that `fraction` (0.95 for p95) of the samples
+        didn't exceed, or 0.0 without samples.
+        """
+        with self.lock:
+            rank = fraction * self.count
+            seen = 0
+            for bucket in sorted(self.buckets):
+                seen += self.buckets[bucket]
+                if seen >= rank:
+                    return min(2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING) / 1e6, self.max)
+        return 0.0
+
+    def summary(self):
+        """
+        Returns:
+            dict: Sample count, p50/p95/p99/max/mean in ms, the mean ms spent in
+                page.update() and the mean and max number of controls passed to it.
+        """
+        count = self.count or 1
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p95_ms": round(self.percentile(0.95) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "mean_ms": round(self.total / count * 1000, 3),
+            "update_mean_ms": round(self.update_seconds / count * 1000, 3),
+            "controls_mean": round(self.controls / count, 1),
+            "controls_max": self.max_controls,
+        }
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_active = threading.local()  # .stack: [operation name, started, update seconds, controls] per running operation
+_slow_log_lock = threading.Lock()
+
+def histogram(name):
+    """
+    Returns the histogram of operation `name`, creating it on first use.
+    """
+    found = _histograms.get(name)
+    if found is None:
+        with _histograms_lock:
+            found = _histograms.setdefault(name, LatencyHistogram())
+    return found
+
+def _stack():
+    stack = getattr(_active, "stack", None)
+    if stack is None:
+        stack = _active.stack = []
+    return stack
+
+def _log_slow(name, seconds, update_seconds, controls):
+    entry = {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "operation": name,
+        "ms": round(seconds * 1000, 3),
+        "update_ms": round(update_seconds * 1000, 3),
+        "controls": controls,
+    }
+    try:
+        with _slow_log_lock, open(SLOW_LOG, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        print(f"Error writing to {SLOW_LOG}: {e}")
+
+class Timer:
+    """
+    Times an operation into histogram(name), as a context manager or a decorator.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _stack().append([self.name, time.perf_counter(), 0.0, 0])
+        return self
+
+    def __exit__(self, *exc_info):
+        name, started, update_seconds, controls = _stack().pop()
+        seconds = time.perf_counter() - started
+        histogram(name).add(seconds, update_seconds, controls)
+        if seconds * 1000 >= SLOW_OPERATION_MS:
+            _log_slow(name, seconds, update_seconds, controls)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Timer(self.name):
+                return function(*args, **kwargs)
+        return wrapper
+
+def timed(name):
+    """
+    Returns a Timer for operation `name`, see Timer.
+    """
+    return Timer(name)
+
+def record_update(seconds, controls):
+    """
+    Adds a page.update() that took `seconds` and was passed `controls` controls to the
+    "page.update" histogram and to every operation running on this thread.
+    """
+    histogram("page.update").add(seconds, seconds, controls)
+    for frame in _stack():
+        frame[2] += seconds
+        frame[3] += controls
+
+def add_controls(count):
+    """
+    Adds `count` controls to every operation running on this thread: rows an operation
+    appended to or replaced in a list, which the page.update() of the list sends without
+    them being passed to it.
+    """
+    for frame in _stack():
+        frame[3] += count
+
+def snapshot():
+    """
+    Returns:
+        dict: {operation: LatencyHistogram.summary()} sorted by operation name.
+    """
+    with _histograms_lock:
+        names = sorted(_histograms)
+    return {name: _histograms[name].summary() for name in names}
+
+def reset():
+    """
+    Forgets every histogram.
+    """
+    with _histograms_lock:
+        _histograms.clear()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = json.dumps(snapshot(), indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Polling would flood the console
+
+def serve(port, host="127.0.0.1"):
+    """
+    Serves snapshot() as JSON on http://host:port/metrics from a daemon thread. Only
+    listens on localhost unless another host is given.
+
+    Returns:
+        ThreadingHTTPServer: The running server, call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,3797 @@
+"""
+Everything the POS app does that isn't drawing the UI: the product catalog, the cart,
+checkout, the transaction stores and the sales reports.
+
+Nothing here imports flet, so it can be used from scripts, CLI tools and benchmarks:
+
+    import pos_core
+    cart = pos_core.Cart()
+    cart.add("Milk", 2.50, amount=2)
+    receipt = pos_core.checkout(cart, "Alice")
+    pos_core.top_products(10, period="week")
+
+The maintenance commands are available as `python pos_core.py --help`.
+"""
+import csv
+import os
+import queue
+import atexit
+import time
+import json
+import heapq
+import locale
+import functools
+import concurrent.futures
+import multiprocessing
+import gzip
+import contextlib
+import io
+import re
+import bisect
+import shutil
+import sqlite3
+import threading
+from collections import defaultdict, Counter
+from datetime import date, datetime, timedelta
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+TRANSACTION_HEADER = ["Index", "Customer", "Product", "Price", "Amount", "Total", "Timestamp"]
+
+def _lock_file(file):
+    """
+    Blocks until this process has an exclusive lock on the open `file`.
+    """
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        return
+    file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass  # LK_LOCK gives up after 10 seconds, keep waiting
+
+def _unlock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+class StoreLock:
+    """
+    Lock around the data files, shared by the threads of this process (Flet web sessions)
+    and the processes on this host (terminals started side by side, the maintenance CLI).
+
+    As a context manager it is a reentrant thread lock plus an exclusive lock on the lock
+    file. The file lock is taken when the first holder in this process enters and dropped
+    when the last one leaves. hold() and release() keep the file lock without keeping the
+    thread lock, so the checkout writer can own the files while its queue drains.
+
+    on_acquire, if set, is called every time this process takes the file lock, with the
+    lock held, to finish the work of a process that died while it had the lock.
+    """
+
+    def __init__(self, path="pos.lock"):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.on_acquire = None
+        self._mutex = threading.Lock()  # Guards _holds and _file
+        self._holds = 0
+        self._file = None
+
+    def hold(self):
+        """
+        Takes the file lock for this process, or adds a hold to it.
+
+        Returns:
+            bool: True if this call took the file lock.
+        """
+        with self._mutex:
+            self._holds += 1
+            if self._holds > 1:
+                return False
+            try:
+                file = open(self.path, "a")
+                _lock_file(file)
+            except BaseException:
+                self._holds -= 1
+                raise
+            self._file = file
+            return True
+
+    def release(self):
+        """
+        Drops a hold, and the file lock with the last one.
+        """
+        with self._mutex:
+            self._holds -= 1
+            if self._holds == 0:
+                _unlock_file(self._file)
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            if self.hold() and self.on_acquire is not None:
+                self.on_acquire()
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        self.thread_lock.release()
+
+# Held by everything that writes the data files or needs a consistent view of them.
+_write_lock = StoreLock()
+
+# Changes made through this module, published to subscribers as (topic, payload):
+#   product_added     {"name", "price"}
+#   product_repriced  {"name", "price", "previous"}
+#   product_removed   {"name", "price"}
+#   sale_recorded     {"index", "customer", "lines", "timestamp", "rows"}
+#   sale_voided       {"index", "product", "row"}
+#   sales_resynced    {}  the store was rewritten, views should reload
+#   checkouts_failed     {"sales", "error"}  sales couldn't be written to the store, they
+#                        wait in the checkout journal and are retried
+#   checkouts_recovered  {"sales"}  the sales of checkouts_failed are in the store now
+# Catalog changes made by other processes are not published. Their sales and voids are, by
+# a running SalesFollower, with "remote": True added to the payload (and "row" None for voids).
+EVENTS = ("product_added", "product_repriced", "product_removed", "sale_recorded", "sale_voided", "sales_resynced",
+          "checkouts_failed", "checkouts_recovered")
+_subscribers = defaultdict(list)
+_subscribers_lock = threading.Lock()
+
+def subscribe(topic, callback):
+    """
+    Calls callback(topic, payload) whenever `topic` is published, see EVENTS.
+
+    Callbacks run on the publishing thread, possibly with the store lock held, so they
+    should only note the change and leave the work (and calls back into pos_core) to
+    another thread. Payloads are shared with the store, subscribers must not modify them.
+
+    Raises:
+        ValueError: If `topic` isn't one of EVENTS.
+    """
+    if topic not in EVENTS:
+        raise ValueError(f"Unknown event: {topic}")
+    with _subscribers_lock:
+        _subscribers[topic].append(callback)
+
+def unsubscribe(topic, callback):
+    """
+    Stops calling `callback` for `topic`. Does nothing if it wasn't subscribed.
+    """
+    with _subscribers_lock:
+        if callback in _subscribers[topic]:
+            _subscribers[topic].remove(callback)
+
+def publish(topic, **payload):
+    """
+    Calls every subscriber of `topic`. A failing subscriber is reported and skipped.
+    """
+    with _subscribers_lock:
+        callbacks = list(_subscribers[topic])
+    for callback in callbacks:
+        try:
+            callback(topic, payload)
+        except Exception as e:
+            print(f"Error in {topic} subscriber {callback!r}: {e}")
+
+CATALOG_HEADER = ["Name", "Price"]
+CATALOG_LOG_HEADER = ["Op", "Name", "Price"]
+CATALOG_COMPACT_ROWS = 1000  # Shortest catalog log worth folding into products.csv
+PRODUCT_INDEX_PATCH_LIMIT = 1000  # Larger catalog edits rebuild the search index instead of patching it
+
+# The catalog is products.csv (a snapshot) plus products_log.csv, the edits made since as
+# "set" and "delete" rows that are replayed onto the snapshot. An edit appends one row
+# instead of rewriting every product; compact_catalog() folds the log into a new snapshot.
+#
+# The parsed catalog is shared by every tab, keyed by the (size, mtime) of both files so
+# edits made outside the app are still picked up. log_offset is how far the log was read.
+_catalog_cache = {"key": None, "products": {}, "hits": 0, "misses": 0, "log_offset": 0, "log_rows": 0}
+
+def _file_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def _catalog_key():
+    return _file_key("products.csv"), _file_key("products_log.csv")
+
+def catalog_cache_stats():
+    """
+    Returns the product catalog cache counters.
+
+    Returns:
+        dict: {"hits": int, "misses": int, "size": int} where size is the number of cached products.
+    """
+    return {"hits": _catalog_cache["hits"], "misses": _catalog_cache["misses"], "size": len(_catalog_cache["products"])}
+
+def _read_catalog_log(offset, products):
+    """
+    Replays products_log.csv from byte `offset` onto the `products` dict. A last line
+    without its line break (an append cut short by a crash) is left for later.
+
+    Returns:
+        tuple: (offset, rows), how far the log was read and how many changes were replayed.
+    """
+    try:
+        with open("products_log.csv", "rb") as file:
+            file.seek(offset)
+            data = file.read()
+    except OSError:
+        return 0, 0
+    end = data.rfind(b"\n") + 1
+    rows = 0
+    for row in csv.reader(data[:end].decode(locale.getpreferredencoding(False)).splitlines()):
+        if not row or row == CATALOG_LOG_HEADER:
+            continue
+        try:
+            if row[0] == "set":
+                products[row[1]] = float(row[2])
+            elif row[0] == "delete":
+                products.pop(row[1], None)
+            else:
+                raise ValueError(f"unknown operation {row[0]!r}")
+        except (ValueError, IndexError) as e:
+            print(f"Error replaying catalog change: {row}. Error: {e}")
+            continue
+        rows += 1
+    return offset + end, rows
+
+def _write_catalog_snapshot(products):
+    """
+    Writes products.csv next to the old one and swaps it in with os.replace, so a crash
+    leaves the old snapshot or the new one, never an empty or half-written catalog.
+    """
+    with open("products.csv.tmp", "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(CATALOG_HEADER)
+        for name, price in products.items():
+            writer.writerow([name, price])
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace("products.csv.tmp", "products.csv")
+
+def _load_catalog():
+    """
+    Returns the cached catalog itself, re-reading the files only if they changed. If only
+    the log grew (edits from another process), only the new log rows are replayed.
+
+    The dict is shared and must not be modified, the cache replaces it on every change.
+    """
+    key = _catalog_key()
+    if _catalog_cache["key"] == key and key[0] is not None:
+        _catalog_cache["hits"] += 1
+        return _catalog_cache["products"]
+    with _write_lock:  # The snapshot and the log are read as one, never across a compaction
+        if not os.path.exists("products.csv"):
+            _write_catalog_snapshot({"Apple": 1.00, "Banana": 0.50, "Orange": 0.75, "Milk": 2.50, "Bread": 1.80})
+        key = _catalog_key()
+        cached_key = _catalog_cache["key"]
+        if cached_key == key:
+            _catalog_cache["hits"] += 1
+            return _catalog_cache["products"]
+        _catalog_cache["misses"] += 1
+        if cached_key is not None and cached_key[0] == key[0] and cached_key[1] is not None and key[1] is not None and key[1][0] >= cached_key[1][0]:
+            products = dict(_catalog_cache["products"])
+            offset, rows = _catalog_cache["log_offset"], _catalog_cache["log_rows"]
+        else:
+            products = {}
+            offset = rows = 0
+            with open("products.csv", "r") as file:
+                reader = csv.reader(file)
+                next(reader, None)  # Skip the header row
+                for row in reader:
+                    if row:  # Check if the row is not empty
+                        products[row[0]] = float(row[1])
+        offset, replayed = _read_catalog_log(offset, products)
+        # One update, so another thread never sees the key of one version with the products of another
+        _catalog_cache.update({"key": key, "products": products, "log_offset": offset, "log_rows": rows + replayed})
+    return products
+
+def load_products():
+    """
+    Returns the products and their prices, re-reading the catalog only if it changed.
+
+    The returned dict is a copy, callers may modify it freely.
+    """
+    return dict(_load_catalog())
+
+def product_price(name):
+    """
+    Returns the price of product `name`, or None if there is no such product.
+    """
+    return _load_catalog().get(name)
+
+def _append_catalog_log(changes):
+    """
+    Appends [op, name, price] rows to products_log.csv, first cutting off a half-written
+    last row left by a crash.
+    """
+    new_file = not os.path.exists("products_log.csv")
+    lines = io.StringIO()
+    writer = csv.writer(lines)
+    if new_file:
+        writer.writerow(CATALOG_LOG_HEADER)
+    writer.writerows(changes)
+    with open("products_log.csv", "a+b") as file:
+        end = file.seek(0, os.SEEK_END)
+        if end:
+            file.seek(max(end - 65536, 0))
+            tail = file.read()
+            if not tail.endswith(b"\n"):
+                file.truncate(end - (len(tail) - tail.rfind(b"\n") - 1))
+        file.write(lines.getvalue().encode(locale.getpreferredencoding(False)))
+
+def _change_catalog(changes):
+    """
+    Logs catalog changes ([op, name, price] rows) and applies them to the cache and the
+    search index. Folds the log into products.csv once it has as many rows as the catalog
+    has products, so loading never replays more than twice the catalog.
+    """
+    with _write_lock:
+        products = dict(_load_catalog())
+        previous_key = _catalog_cache["key"]
+        _append_catalog_log(changes)
+        added = []
+        removed = []
+        events = []
+        for op, name, price in changes:
+            previous = products.get(name)
+            if op == "set":
+                products[name] = float(price)
+                added.append(name)
+                if previous is None:
+                    events.append(("product_added", {"name": name, "price": float(price)}))
+                elif previous != float(price):
+                    events.append(("product_repriced", {"name": name, "price": float(price), "previous": previous}))
+            else:
+                products.pop(name, None)
+                removed.append(name)
+                if previous is not None:
+                    events.append(("product_removed", {"name": name, "price": previous}))
+        key = _catalog_key()
+        log_rows = _catalog_cache["log_rows"] + len(changes)
+        _catalog_cache.update({"key": key, "products": products, "log_offset": key[1][0], "log_rows": log_rows})
+        _update_product_index(previous_key, added, removed)
+        if log_rows >= max(CATALOG_COMPACT_ROWS, len(products)):
+            compact_catalog()
+    for topic, payload in events:
+        publish(topic, **payload)
+
+def compact_catalog():
+    """
+    Folds products_log.csv into a new products.csv snapshot and removes the log.
+
+    The log is only removed after the new snapshot is in place. If a crash comes in
+    between, the log is replayed onto a snapshot that already has its changes, which
+    gives the same catalog again.
+
+    Returns:
+        int: The number of log rows folded in.
+    """
+    with _write_lock:
+        products = _load_catalog()
+        if not os.path.exists("products_log.csv"):
+            return 0
+        previous_key = _catalog_cache["key"]
+        log_rows = _catalog_cache["log_rows"]
+        _write_catalog_snapshot(products)
+        os.remove("products_log.csv")
+        _catalog_cache.update({"key": _catalog_key(), "products": products, "log_offset": 0, "log_rows": 0})
+        _update_product_index(previous_key)  # Same products, the index only needs the new key
+    return log_rows
+
+def save_products(products):
+    """
+    Makes the catalog equal to `products`, logging only the products that were added,
+    changed or removed.
+
+    Args:
+        products (dict): A dictionary of products and their prices.
+    """
+    with _write_lock:
+        current = _load_catalog()
+        changes = [["delete", name, ""] for name in current if name not in products]
+        changes += [["set", name, float(price)] for name, price in products.items() if current.get(name) != float(price)]
+        if changes:
+            _change_catalog(changes)
+
+def set_product(name, price):
+    """
+    Adds a product or changes its price, keeping every other session's edits.
+    """
+    _change_catalog([["set", name, float(price)]])
+
+def set_products(items):
+    """
+    Adds or reprices many products with one log append and one search index update,
+    for bulk imports.
+
+    Args:
+        items (iterable): (name, price) pairs.
+    """
+    changes = [["set", name, float(price)] for name, price in items]
+    if changes:
+        _change_catalog(changes)
+
+def remove_product(name):
+    """
+    Removes a product, keeping every other session's edits.
+
+    Returns:
+        bool: False if there was no such product.
+    """
+    with _write_lock:
+        if name not in _load_catalog():
+            return False
+        _change_catalog([["delete", name, ""]])
+    return True
+
+class ProductIndex:
+    """
+    Type-ahead search over product names.
+
+    Every name is indexed under its whole lower-cased name and under each word in it, in
+    one sorted list, so a prefix search is a bisect plus a short walk. Names are also
+    indexed by their three-letter substrings (trigrams), so a substring search only checks
+    the names sharing all of the query's trigrams. add() and remove() keep it current
+    without rebuilding.
+    """
+
+    def __init__(self, names=()):
+        self.lock = threading.Lock()  # Searches run on Flet worker threads while edits come in
+        self.names = set(names)
+        self.keys = sorted((key, name) for name in self.names for key in self._keys(name))  # [(key, name)]
+        self.trigrams = defaultdict(set)  # trigram -> {name}
+        for name in self.names:
+            for trigram in self._trigrams(name):
+                self.trigrams[trigram].add(name)
+
+    @staticmethod
+    def _keys(name):
+        folded = name.casefold()
+        return {folded, *re.findall(r"\w+", folded)}
+
+    @staticmethod
+    def _trigrams(text):
+        folded = text.casefold()
+        return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+    def add(self, name):
+        with self.lock:
+            if name in self.names:
+                return
+            self.names.add(name)
+            for key in self._keys(name):
+                bisect.insort(self.keys, (key, name))
+            for trigram in self._trigrams(name):
+                self.trigrams[trigram].add(name)
+
+    def remove(self, name):
+        with self.lock:
+            if name not in self.names:
+                return
+            self.names.discard(name)
+            for key in self._keys(name):
+                position = bisect.bisect_left(self.keys, (key, name))
+                if position < len(self.keys) and self.keys[position] == (key, name):
+                    del self.keys[position]
+            for trigram in self._trigrams(name):
+                self.trigrams[trigram].discard(name)
+                if not self.trigrams[trigram]:
+                    del self.trigrams[trigram]
+
+    def search(self, query, limit=20):
+        """
+        Returns up to `limit` product names matching `query`, ignoring case: first the names
+        that start with it or have a word starting with it, in alphabetical order of that
+        word, then the names containing it anywhere (for queries of 3 or more characters).
+        """
+        query = query.strip().casefold()
+        if not query:
+            return []
+        matches = {}  # Used as an ordered set
+        with self.lock:
+            position = bisect.bisect_left(self.keys, (query,))
+            while position < len(self.keys) and len(matches) < limit:
+                key, name = self.keys[position]
+                if not key.startswith(query):
+                    break
+                matches[name] = None
+                position += 1
+            if len(matches) < limit and len(query) >= 3:
+                candidates = sorted((self.trigrams.get(trigram, set()) for trigram in self._trigrams(query)), key=len)
+                candidates = set.intersection(*candidates)
+                found = (name for name in candidates if name not in matches and query in name.casefold())
+                matches.update(dict.fromkeys(heapq.nsmallest(limit - len(matches), found, key=str.casefold)))
+        return list(matches)
+
+# Search index over the catalog, for the catalog cache key it was built from.
+_product_index = {"key": None, "index": None}
+
+def _update_product_index(previous_key, added=(), removed=()):
+    """
+    Applies a catalog edit made here to the search index, if the index was built from the
+    catalog as it was before the edit. Otherwise search_products rebuilds it.
+    """
+    index = _product_index["index"]
+    if index is None or _product_index["key"] != previous_key:
+        return
+    if len(added) + len(removed) > PRODUCT_INDEX_PATCH_LIMIT:
+        _product_index.update({"key": None, "index": None})  # Rebuilt in one go by the next search
+        return
+    for name in removed:
+        index.remove(name)
+    for name in added:
+        index.add(name)
+    _product_index["key"] = _catalog_cache["key"]
+
+@metrics.timed("pos_core.search_products")
+def search_products(query, limit=20):
+    """
+    Returns up to `limit` products matching `query` as [(name, price), ...], see
+    ProductIndex.search. The index is rebuilt only when the catalog was changed by
+    something other than set_product and remove_product.
+    """
+    catalog = _load_catalog()
+    key = _catalog_cache["key"]
+    if _product_index["key"] != key:
+        _product_index.update({"key": key, "index": ProductIndex(catalog)})
+    prices = _catalog_cache["products"]
+    return [(name, prices[name]) for name in _product_index["index"].search(query, limit) if name in prices]
+
+def _read_transaction_counter():
+    """
+    Reads the transactions.seq sidecar.
+
+    Returns:
+        tuple: (next_index, csv_size, csv_mtime_ns), or None if the sidecar is missing or unreadable.
+    """
+    try:
+        with open("transactions.seq", "r") as file:
+            next_index, csv_size, csv_mtime_ns = file.read().split(",")
+            return int(next_index), int(csv_size), int(csv_mtime_ns)
+    except (OSError, ValueError):
+        return None
+
+def _write_transaction_counter(next_index):
+    """
+    Writes the transactions.seq sidecar together with the current size and mtime of
+    transactions.csv, so a later read can tell whether the CSV changed behind its back.
+    """
+    stat = os.stat("transactions.csv")
+    with open("transactions.seq.tmp", "w") as file:
+        file.write(f"{next_index},{stat.st_size},{stat.st_mtime_ns}")
+    os.replace("transactions.seq.tmp", "transactions.seq")  # Atomic, a crash never leaves half a counter
+
+def _read_high_water_mark():
+    """
+    Returns the next index recorded by the last rewrite of transactions.csv (compaction,
+    timestamp migration) in transactions.hwm, or 0 if there is none.
+    """
+    try:
+        with open("transactions.hwm", "r") as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return 0
+
+def rebuild_transaction_counter():
+    """
+    Recomputes the next transaction index from transactions.csv and rewrites transactions.seq.
+
+    The next index is one past both the row count (how indices have always been handed out)
+    and the highest index already in the file, so it can never collide with an existing sale.
+    It never goes below the counter already stored, or the high-water mark the last rewrite
+    of the file left in transactions.hwm, either: compaction drops voided rows, and their
+    indices must not be handed out again.
+
+    Returns:
+        int: The next free transaction index.
+    """
+    counter = _read_transaction_counter()
+    rows = 0
+    max_index = 0
+    with open("transactions.csv", "r") as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Skip header
+        for row in reader:
+            if row:
+                rows += 1
+                try:
+                    max_index = max(max_index, int(row[0]))
+                except ValueError:
+                    pass
+    next_index = max(rows + 1, max_index + 1, counter[0] if counter else 0, _read_high_water_mark())
+    _write_transaction_counter(next_index)
+    return next_index
+
+def check_transaction_counter():
+    """
+    Compares the stored counter with a full scan of transactions.csv and repairs it if it
+    is behind the file. A counter ahead of the file is kept, see rebuild_transaction_counter.
+
+    Returns:
+        tuple: (stored_index, rebuilt_index). stored_index is None if the sidecar was missing.
+    """
+    counter = _read_transaction_counter()
+    stored_index = counter[0] if counter else None
+    return stored_index, rebuild_transaction_counter()
+
+def next_transaction_index():
+    """
+    Returns the next free transaction index in O(1) from the transactions.seq sidecar.
+
+    If the CSV was changed since the counter was written (crash between the append and the
+    counter update, a delete that rewrote the file, a manual edit) the counter is rebuilt.
+    """
+    counter = _read_transaction_counter()
+    stat = os.stat("transactions.csv")
+    if counter is None or counter[1:] != (stat.st_size, stat.st_mtime_ns):
+        return rebuild_transaction_counter()
+    return counter[0]
+
+@functools.lru_cache(maxsize=65536)
+def _parse_legacy_timestamp(value):
+    # Legacy values repeat a lot (minute resolution, one per cart line), so they are memoized.
+    return datetime.strptime(value, "%d/%m/%Y %H:%M")
+
+@functools.lru_cache(maxsize=65536)
+def _normalize_legacy_timestamp(value):
+    return _parse_legacy_timestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_timestamp(value):
+    """
+    Parses a transaction timestamp.
+
+    Accepts the current '%Y-%m-%d %H:%M:%S' format and the legacy '31/3/2025 22:58'
+    ('%d/%m/%Y %H:%M') format found in older rows. Use this (or normalize_timestamp) for
+    every timestamp read from the store.
+
+    Raises:
+        ValueError: If the value is in neither format.
+    """
+    try:
+        return datetime.fromisoformat(value)  # The current format, parsed in C
+    except ValueError:
+        return _parse_legacy_timestamp(value)
+
+def normalize_timestamp(value):
+    """
+    Returns a transaction timestamp in the '%Y-%m-%d %H:%M:%S' format records are written
+    in, so [:10] is the date and [:13] the date and hour.
+
+    Raises:
+        ValueError: If the value is in neither format.
+    """
+    if len(value) == 19 and value[4] == "-" and value[10] == " ":
+        return value  # Already normalized, the common case
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return _normalize_legacy_timestamp(value)
+
+def summarize_cart(cart):
+    """
+    Groups a cart of (name, price) items per product.
+
+    Returns:
+        dict: {product: {"price": float, "amount": int, "total": float}} in the order products were added.
+    """
+    cart_summary = {}
+    for item in cart:
+        if item[0] in cart_summary:
+            cart_summary[item[0]]["amount"] += 1
+            cart_summary[item[0]]["total"] += item[1]
+        else:
+            cart_summary[item[0]] = {"price": item[1], "amount": 1, "total": item[1]}
+    return cart_summary
+
+class Cart:
+    """
+    The POS cart: quantity, price and line total per product, plus a running total.
+
+    Every change is O(1). The line dicts have the same shape summarize_cart returns, so a
+    Cart can be passed anywhere a cart summary is expected.
+    """
+
+    def __init__(self):
+        self.lines = {}  # product -> {"price": float, "amount": int, "total": float}
+        self.total_cents = 0
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    @property
+    def total(self):
+        return self.total_cents / 100
+
+    def add(self, product, price, amount=1):
+        """
+        Adds `amount` of a product. A product already in the cart keeps its first price.
+
+        Returns:
+            dict: The product's line.
+        """
+        line = self.lines.get(product)
+        if line is None:
+            line = self.lines[product] = {"price": price, "amount": 0, "total": 0.0}
+        line["amount"] += amount
+        line["total"] = line["price"] * line["amount"]
+        self.total_cents += round(line["price"] * 100) * amount
+        return line
+
+    def remove(self, product, amount=None):
+        """
+        Removes `amount` of a product, or all of it if amount is None.
+
+        Returns:
+            dict: The product's line, or None if the product is no longer in the cart.
+        """
+        line = self.lines.get(product)
+        if line is None:
+            return None
+        amount = line["amount"] if amount is None else min(amount, line["amount"])
+        line["amount"] -= amount
+        line["total"] = line["price"] * line["amount"]
+        self.total_cents -= round(line["price"] * 100) * amount
+        if line["amount"] == 0:
+            del self.lines[product]
+            return None
+        return line
+
+    def clear(self):
+        self.lines = {}
+        self.total_cents = 0
+
+    def summary(self):
+        return self.lines
+
+def sale_rows(sale):
+    """
+    Returns the transaction rows of a sale dict
+    {"index": int, "customer": str, "lines": {product: line}, "timestamp": str}.
+    """
+    return [[sale["index"], sale["customer"], product, details["price"], details["amount"], details["total"], sale["timestamp"]]
+            for product, details in sale["lines"].items()]
+
+def _read_lines(file, size):
+    """
+    Yields the lines of a binary file up to byte `size` as text, the way open() would decode them.
+    """
+    encoding = locale.getpreferredencoding(False)
+    position = file.tell()
+    for line in file:
+        position += len(line)
+        if position > size:
+            break  # Appended after the snapshot was taken
+        yield line.decode(encoding)
+
+def _iter_rows_reverse(file, size, before=None):
+    """
+    Yields (offset, row) from byte `size` of a transactions file towards the header, reading
+    the file backwards in blocks. offset is the byte position the row starts at; rows at
+    or after `before` are skipped. Voided rows are included.
+    """
+    encoding = locale.getpreferredencoding(False)  # What open() used to write the rows
+    file.seek(0)
+    header_end = len(file.readline())
+    position = size if before is None else min(before, size)
+    tail = b""  # Start of a line whose beginning is still in an earlier block
+    while position > header_end:
+        read_size = min(65536, position - header_end)
+        position -= read_size
+        file.seek(position)
+        lines = (file.read(read_size) + tail).split(b"\n")
+        line_start = position
+        if position > header_end:
+            tail = lines.pop(0)
+            line_start += len(tail) + 1
+        starts = []
+        for line in lines:
+            starts.append(line_start)
+            line_start += len(line) + 1
+        for start, line in zip(reversed(starts), reversed(lines)):
+            line = line.rstrip(b"\r")
+            if line:
+                yield start, next(csv.reader([line.decode(encoding)]))
+
+def _repair_tail(path):
+    """
+    Cuts a half-written last row off a transactions file, or gives a complete last row
+    that only lacks its line break one. Call with the store lock held.
+
+    Returns:
+        bool: True if the file was changed.
+    """
+    with open(path, "rb+") as file:
+        end = file.seek(0, os.SEEK_END)
+        file.seek(max(end - 65536, 0))
+        tail = file.read()
+        if not tail or tail.endswith(b"\n") or b"\n" not in tail:
+            return False
+        last_line = tail[tail.rindex(b"\n") + 1:]
+        row = next(csv.reader([last_line.decode(locale.getpreferredencoding(False), "replace")]), [])
+        try:
+            int(row[0])
+            float(row[5])
+            normalize_timestamp(row[6])
+            complete = len(row) == len(TRANSACTION_HEADER)
+        except (ValueError, IndexError):
+            complete = False
+        if complete:
+            file.write(b"\r\n")
+        else:
+            file.truncate(end - len(last_line))
+            print(f"Removed a half-written row from the end of {path}: {row}")
+    return True
+
+def _read_voids_after(path, offset, size):
+    """
+    Returns the (index, product) tombstones of a void log from byte `offset` to `size`.
+    """
+    if size <= offset:
+        return []
+    with open(path, "rb") as file:
+        file.seek(offset)
+        reader = csv.reader(file.read(size - offset).decode(locale.getpreferredencoding(False)).splitlines())
+        if not offset:
+            next(reader, None)  # Skip header
+        return [(row[0], row[1]) for row in reader if len(row) >= 2]
+
+def _matches_date(transaction_date, year, month, day):
+    year_match = not year or transaction_date.year == int(year)
+    month_match = not month or transaction_date.month == int(month)
+    day_match = not day or transaction_date.day == int(day)
+    return year_match and month_match and day_match
+
+def _in_range(transaction_date, start, end):
+    return (start is None or transaction_date >= start) and (end is None or transaction_date <= end)
+
+class CsvTransactionStore:
+    """
+    Transactions kept in transactions.csv, one row per product per sale.
+
+    Rows are lists of strings: [index, customer, product, price, amount, total, timestamp].
+    A row is identified by its transaction index and product, which never change.
+
+    Deleting a row doesn't touch transactions.csv, it appends a tombstone to
+    transactions_void.csv and every reader skips voided rows. compact() physically drops them.
+
+    Writers hold the shared StoreLock. Readers take it only to open the file and note its
+    size, then read up to that size without it, so they never see a half-appended row.
+    """
+    name = "csv"
+
+    def __init__(self):
+        self.lock = _write_lock  # Serializes writers across threads and processes
+        self._voids_key = None
+        self._voids = set()
+
+    def _snapshot(self):
+        """
+        Opens transactions.csv for reading.
+
+        Returns:
+            tuple: (binary file, size, voids) as of one moment between writes.
+        """
+        with self.lock:
+            self._ensure_file()
+            file = open("transactions.csv", "rb")
+            return file, file.seek(0, os.SEEK_END), self.voids()
+
+    def _ensure_file(self):
+        if not os.path.exists("transactions.csv"):
+            with open("transactions.csv", "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(TRANSACTION_HEADER)
+
+    def voids(self):
+        """
+        Returns the set of voided (index, product) pairs, re-reading the void log only if it changed.
+        """
+        try:
+            stat = os.stat("transactions_void.csv")
+        except OSError:
+            return set()
+        if self._voids_key != (stat.st_size, stat.st_mtime_ns):
+            with open("transactions_void.csv", "r") as file:
+                reader = csv.reader(file)
+                next(reader, None)  # Skip header
+                self._voids = {(row[0], row[1]) for row in reader if len(row) >= 2}
+            self._voids_key = (stat.st_size, stat.st_mtime_ns)
+        return self._voids
+
+    def next_index(self):
+        with self.lock:
+            self._ensure_file()
+            return next_transaction_index()
+
+    def record(self, customer_name, cart_summary, timestamp):
+        """
+        Appends one sale and returns the index it was given.
+        """
+        with self.lock:
+            index = self.next_index()  # Unique index
+            self.record_many([{"index": index, "customer": customer_name, "lines": cart_summary, "timestamp": timestamp}])
+        return index
+
+    def record_many(self, sales, fsync=False):
+        """
+        Appends sales whose indices were already handed out, with one write for all of them.
+
+        Args:
+            sales (list): Sale dicts, see sale_rows.
+            fsync (bool): Force the rows to disk before returning.
+        """
+        with self.lock:
+            self._ensure_file()
+            # Every written row used up one index, the same as counting lines did.
+            next_index = max([next_transaction_index()] + [sale["index"] + len(sale["lines"]) for sale in sales])
+            with open("transactions.csv", "a", newline="") as file:
+                writer = csv.writer(file)
+                for sale in sales:
+                    writer.writerows(sale_rows(sale))
+                if fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            _write_transaction_counter(next_index)
+
+    def sale_products(self, index):
+        """
+        Returns the set of products recorded for sale `index`, voided or not.
+        """
+        products = set()
+        file, size, voids = self._snapshot()
+        with file:
+            for offset, row in _iter_rows_reverse(file, size):
+                try:
+                    row_index = int(row[0])
+                except ValueError:
+                    continue
+                if row_index == index:
+                    products.add(row[2])
+                elif row_index < index:
+                    break
+        return products
+
+    def repair(self):
+        """
+        Cuts a half-written last row (from a crash in the middle of an append) off
+        transactions.csv. A complete last row that only lacks its line break gets one.
+
+        Returns:
+            bool: True if the file was changed.
+        """
+        with self.lock:
+            self._ensure_file()
+            return _repair_tail("transactions.csv")
+
+    def signature(self):
+        """
+        Returns a value that changes whenever transactions.csv or the void log is written,
+        used to spot derived data (rollups, indexes) that fell behind the store.
+        """
+        self._ensure_file()
+        stat = os.stat("transactions.csv")
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if os.path.exists("transactions_void.csv"):
+            void_stat = os.stat("transactions_void.csv")
+            signature += [void_stat.st_size, void_stat.st_mtime_ns]
+        return signature
+
+    def load(self, year=None, month=None, day=None):
+        """
+        Returns the transaction rows in file order, optionally filtered by year, month and day.
+        """
+        return list(self.iter_rows(year, month, day))
+
+    def iter_rows(self, year=None, month=None, day=None):
+        """
+        Yields the rows load() would return one at a time, reading the file as it goes.
+        Rows appended after the first one was yielded are not included.
+        """
+        filtered = year or month or day
+        file, size, voids = self._snapshot()
+        with file:
+            file.seek(0)
+            reader = csv.reader(_read_lines(file, size))
+            next(reader, None)  # Skip header row
+            for row in reader:
+                if not row or (voids and (row[0], row[2]) in voids):
+                    continue
+                if filtered:
+                    try:
+                        if not _matches_date(parse_timestamp(row[6]), year, month, day):
+                            continue
+                    except (ValueError, IndexError) as e:
+                        print(f"Error parsing date: {e}, for row: {row}") # handle parsing issue
+                        continue
+                yield row
+
+    def rows_after(self, offset=0):
+        """
+        Returns the rows from byte `offset` to the end of transactions.csv, voided or not, for
+        readers that keep their own copy of the rows and only need what was appended since.
+
+        Returns:
+            tuple: (rows, end_offset, voids, file_id). Pass end_offset in next time, as long as
+                file_id is the same; it changes when the file is rewritten (compact(),
+                normalize_timestamps()) and offsets into the old file mean nothing.
+        """
+        file, size, voids = self._snapshot()
+        with file:
+            stat = os.fstat(file.fileno())
+            file.seek(offset)
+            if not offset:
+                file.readline()  # Skip header
+            rows = [row for row in csv.reader(_read_lines(file, size)) if row]
+        return rows, size, voids, [stat.st_dev, stat.st_ino]
+
+    def tail(self, position=None):
+        """
+        Returns what was appended to the store since `position`, for readers that follow it.
+
+        Returns:
+            tuple: (rows, voids, position). rows are the rows appended since (voided or not),
+                voids the (index, product) pairs voided since. Without a position both are
+                empty and position is the current end. If the store was rewritten since
+                (compact(), normalize_timestamps()) rows and voids are None: start over.
+        """
+        with self.lock:
+            self._ensure_file()
+            file = open("transactions.csv", "rb")
+            size = file.seek(0, os.SEEK_END)
+            void_size = os.path.getsize("transactions_void.csv") if os.path.exists("transactions_void.csv") else 0
+        with file:
+            stat = os.fstat(file.fileno())
+            current = [stat.st_dev, stat.st_ino, size, void_size]
+            if position is None:
+                return [], [], current
+            if position[:2] != current[:2] or size < position[2] or void_size < position[3]:
+                return None, None, current
+            file.seek(position[2])
+            if not position[2]:
+                file.readline()  # Skip header
+            rows = [row for row in csv.reader(_read_lines(file, size)) if row]
+        return rows, _read_voids_after("transactions_void.csv", position[3], void_size), current
+
+    def load_page(self, year=None, month=None, day=None, before=None, limit=50, start=None, end=None):
+        """
+        Returns one page of rows, newest first, without reading the rest of the file.
+
+        Args:
+            before: The cursor returned with the previous page, or None for the newest rows.
+            limit (int): Maximum number of rows to return.
+            start, end (date): Only rows from the start to the end date, both inclusive and
+                both optional, on top of the year/month/day filter.
+
+        Returns:
+            tuple: ([row, ...], cursor). cursor is None once there are no older rows.
+        """
+        filtered = year or month or day or start or end
+        page_rows = []
+        file, size, voids = self._snapshot()
+        with file:
+            for offset, row in _iter_rows_reverse(file, size, before):
+                if voids and (row[0], row[2]) in voids:
+                    continue
+                if filtered:
+                    try:
+                        when = parse_timestamp(row[6])
+                        if not (_matches_date(when, year, month, day) and _in_range(when.date(), start, end)):
+                            continue
+                    except (ValueError, IndexError) as e:
+                        print(f"Error parsing date: {e}, for row: {row}") # handle parsing issue
+                        continue
+                page_rows.append(row)
+                if len(page_rows) == limit:
+                    return page_rows, offset
+        return page_rows, None
+
+    def delete(self, index, product):
+        """
+        Voids the row of sale `index` for `product` by appending a tombstone to the void log.
+
+        Indices only grow through the file, so the row is searched from the end and the search
+        stops as soon as it passes the index.
+
+        Returns:
+            list: The deleted row, or None if there is no such (non-voided) row.
+        """
+        index = str(index)
+        with self.lock:
+            file, size, voids = self._snapshot()
+            deleted = None
+            with file:
+                for offset, row in _iter_rows_reverse(file, size):
+                    if row[0] == index and row[2] == product and (index, product) not in voids:
+                        deleted = row
+                        break
+                    try:
+                        if int(row[0]) < int(index):
+                            break
+                    except ValueError:
+                        pass
+            if deleted is None:
+                print(f"Transaction #{index} {product} not found.")
+                return None
+
+            new_file = not os.path.exists("transactions_void.csv")
+            with open("transactions_void.csv", "a", newline="") as file:
+                writer = csv.writer(file)
+                if new_file:
+                    writer.writerow(["Index", "Product"])
+                writer.writerow([index, product])
+        return deleted
+
+    def _rewrite(self, transform):
+        """
+        Rewrites transactions.csv passing every row through transform(row), which returns the
+        row to write or None to drop it.
+
+        The new file is written next to the old one and swapped in with os.replace, so a crash
+        leaves either the old or the new file. Indices are kept. The counter is written past
+        the highest index read, dropped rows included, and so is the high-water mark in
+        transactions.hwm, which outlives a lost counter: dropped indices are never handed
+        out again, even by a counter rebuilt from the new file. Call with self.lock held.
+        """
+        next_index = next_transaction_index()
+        with open("transactions.csv", "r") as source, open("transactions.csv.tmp", "w", newline="") as target:
+            reader = csv.reader(source)
+            writer = csv.writer(target)
+            writer.writerow(next(reader, TRANSACTION_HEADER))
+            for row in reader:
+                if row:
+                    try:
+                        next_index = max(next_index, int(row[0]) + 1)
+                    except ValueError:
+                        pass
+                    row = transform(row)
+                    if row is not None:
+                        writer.writerow(row)
+            target.flush()
+            os.fsync(target.fileno())
+        with open("transactions.hwm.tmp", "w") as file:
+            file.write(str(next_index))
+        os.replace("transactions.hwm.tmp", "transactions.hwm")  # Before the rows are gone
+        os.replace("transactions.csv.tmp", "transactions.csv")
+        _write_transaction_counter(next_index)
+
+    def compact(self):
+        """
+        Rewrites transactions.csv without the voided rows and empties the void log.
+
+        Returns:
+            int: The number of rows removed.
+        """
+        removed = 0
+
+        def drop_voided(row):
+            nonlocal removed
+            if (row[0], row[2]) in voids:
+                removed += 1
+                return None
+            return row
+
+        with self.lock:
+            self._ensure_file()
+            voids = self.voids()
+            if not voids:
+                return 0
+            self._rewrite(drop_voided)
+            os.remove("transactions_void.csv")
+        return removed
+
+    def normalize_timestamps(self):
+        """
+        Rewrites legacy '31/3/2025 22:58' timestamps in transactions.csv to '%Y-%m-%d %H:%M:%S'.
+
+        Returns:
+            int: The number of rows rewritten.
+        """
+        rewritten = 0
+
+        def normalize(row):
+            nonlocal rewritten
+            try:
+                timestamp = normalize_timestamp(row[6])
+            except (ValueError, IndexError) as e:
+                print(f"Error parsing date: {e}, for row: {row}") # Left as it is
+                return row
+            if timestamp != row[6]:
+                rewritten += 1
+                row[6] = timestamp
+            return row
+
+        with self.lock:
+            self._ensure_file()
+            self._rewrite(normalize)
+        return rewritten
+
+class SqliteTransactionStore:
+    """
+    Transactions kept in an SQLite database (transactions.db by default).
+
+    Timestamps are stored normalized to '%Y-%m-%d %H:%M:%S' so they sort as text, and the
+    timestamp, product and customer columns are indexed. A year/month/day filter becomes a
+    range scan on the timestamp index.
+    """
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            transaction_index INTEGER NOT NULL,
+            customer TEXT NOT NULL,
+            product TEXT NOT NULL,
+            price REAL NOT NULL,
+            amount INTEGER NOT NULL,
+            total REAL NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transactions_timestamp ON transactions (timestamp);
+        CREATE INDEX IF NOT EXISTS transactions_product ON transactions (product);
+        CREATE INDEX IF NOT EXISTS transactions_customer ON transactions (customer);
+        CREATE INDEX IF NOT EXISTS transactions_index ON transactions (transaction_index);
+        CREATE TABLE IF NOT EXISTS sequence (next_index INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS version (value INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS deleted (id INTEGER PRIMARY KEY, transaction_index INTEGER NOT NULL, product TEXT NOT NULL);
+    """
+
+    def __init__(self, path="transactions.db"):
+        self.path = path
+        # Flet runs event handlers on worker threads, so the connection is shared behind a lock.
+        # Writes also hold the shared StoreLock, which orders them with other processes.
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        # Readers in other processes keep reading their snapshot while a write commits
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+
+    def _next_index(self):
+        row = self.connection.execute("SELECT next_index FROM sequence").fetchone()
+        if row:
+            return row[0]
+        count, max_index = self.connection.execute("SELECT COUNT(*), COALESCE(MAX(transaction_index), 0) FROM transactions").fetchone()
+        next_index = max(count + 1, max_index + 1)
+        self.connection.execute("INSERT INTO sequence (next_index) VALUES (?)", (next_index,))
+        return next_index
+
+    def next_index(self):
+        with self.lock, self.connection:
+            return self._next_index()
+
+    def record(self, customer_name, cart_summary, timestamp):
+        """
+        Inserts one sale and returns the index it was given.
+        """
+        with _write_lock, self.lock, self.connection:
+            index = self._next_index()
+            self._insert_sales([{"index": index, "customer": customer_name, "lines": cart_summary, "timestamp": timestamp}])
+        return index
+
+    def record_many(self, sales, fsync=False):
+        """
+        Inserts sales whose indices were already handed out, in one database transaction.
+        SQLite makes the commit durable by itself, `fsync` is accepted for symmetry.
+        """
+        with _write_lock, self.lock, self.connection:
+            self._insert_sales(sales)
+
+    def _insert_sales(self, sales):
+        rows = []
+        for sale in sales:
+            for row in sale_rows(sale):
+                row[6] = normalize_timestamp(row[6])
+                rows.append(row)
+        self.connection.executemany(
+            "INSERT INTO transactions (transaction_index, customer, product, price, amount, total, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        next_index = max([self._next_index()] + [sale["index"] + len(sale["lines"]) for sale in sales])
+        self.connection.execute("UPDATE sequence SET next_index = ?", (next_index,))
+        self._bump_version()
+
+    def sale_products(self, index):
+        """
+        Returns the set of products recorded for sale `index`.
+        """
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT product FROM transactions WHERE transaction_index = ?", (index,))}
+
+    def repair(self):
+        """
+        Returns:
+            bool: Always False, SQLite rolls back half-finished writes by itself.
+        """
+        return False
+
+    def _bump_version(self):
+        if self.connection.execute("UPDATE version SET value = value + 1").rowcount == 0:
+            self.connection.execute("INSERT INTO version (value) VALUES (1)")
+
+    def signature(self):
+        """
+        Returns a value that changes with every write, bumped in the same database transaction.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM version").fetchone()
+        return [row[0] if row else 0]
+
+    def tail(self, position=None):
+        """
+        Returns what was written since `position`, see CsvTransactionStore.tail. New rows are
+        found by index, which only grows, and deletes through the deleted log.
+        """
+        with self.lock, self.connection:
+            # Both bounds first, so rows committed while reading wait for the next call
+            current = [self._next_index(), self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM deleted").fetchone()[0]]
+            if position is None:
+                return [], [], current
+            if current[0] < position[0] or current[1] < position[1]:
+                return None, None, current
+            rows = self.connection.execute(
+                "SELECT transaction_index, customer, product, price, amount, total, timestamp FROM transactions "
+                "WHERE transaction_index >= ? AND transaction_index < ? ORDER BY id", (position[0], current[0])).fetchall()
+            voids = self.connection.execute(
+                "SELECT transaction_index, product FROM deleted WHERE id > ? AND id <= ? ORDER BY id", (position[1], current[1])).fetchall()
+        return [list(row) for row in rows], [(str(index), product) for index, product in voids], current
+
+    @staticmethod
+    def _date_conditions(year, month, day):
+        """
+        Returns (conditions, params) for a year/month/day filter, or None if it can't match.
+        """
+        conditions = []
+        params = []
+        if year:
+            # Narrow to the tightest [start, end) timestamp range, the rest is checked on the index entries.
+            try:
+                if month and day:
+                    start = datetime(int(year), int(month), int(day))
+                    end = start + timedelta(days=1)
+                elif month:
+                    start = datetime(int(year), int(month), 1)
+                    end = datetime(int(year) + (int(month) == 12), int(month) % 12 + 1, 1)
+                else:
+                    start = datetime(int(year), 1, 1)
+                    end = datetime(int(year) + 1, 1, 1)
+            except ValueError:
+                return None  # A date like 31/02 matches nothing
+            conditions.append("timestamp >= ? AND timestamp < ?")
+            params += [start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")]
+        if month and not year:
+            conditions.append("substr(timestamp, 6, 2) = ?")
+            params.append(str(month).zfill(2))
+        if day and not (year and month):
+            conditions.append("substr(timestamp, 9, 2) = ?")
+            params.append(str(day).zfill(2))
+        return conditions, params
+
+    def load(self, year=None, month=None, day=None):
+        """
+        Returns the transaction rows in insertion order, optionally filtered by year, month and day.
+        """
+        date_filter = self._date_conditions(year, month, day)
+        if date_filter is None:
+            return []
+        conditions, params = date_filter
+        query = "SELECT transaction_index, customer, product, price, amount, total, timestamp FROM transactions"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id"
+        with self.lock:
+            return [list(row) for row in self.connection.execute(query, params)]
+
+    def iter_rows(self, year=None, month=None, day=None, chunk=5000):
+        """
+        Yields the rows load() would return, fetching `chunk` rows per query so the lock
+        is never held while the caller works on them.
+        """
+        date_filter = self._date_conditions(year, month, day)
+        if date_filter is None:
+            return
+        conditions, params = date_filter
+        query = "SELECT id, transaction_index, customer, product, price, amount, total, timestamp FROM transactions WHERE id > ?"
+        if conditions:
+            query += " AND " + " AND ".join(conditions)
+        query += " ORDER BY id LIMIT ?"
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(query, [last_id, *params, chunk]).fetchall()
+            for row in rows:
+                yield list(row[1:])
+            if len(rows) < chunk:
+                return
+            last_id = rows[-1][0]
+
+    def load_page(self, year=None, month=None, day=None, before=None, limit=50, start=None, end=None):
+        """
+        Returns one page of rows, newest first. See CsvTransactionStore.load_page.
+        """
+        date_filter = self._date_conditions(year, month, day)
+        if date_filter is None:
+            return [], None
+        conditions, params = date_filter
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start.isoformat())
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append((end + timedelta(days=1)).isoformat())
+        if before is not None:
+            conditions.append("id < ?")
+            params.append(before)
+        query = "SELECT id, transaction_index, customer, product, price, amount, total, timestamp FROM transactions"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id DESC LIMIT ?"
+        with self.lock:
+            rows = self.connection.execute(query, params + [limit]).fetchall()
+        return [list(row[1:]) for row in rows], rows[-1][0] if len(rows) == limit else None
+
+    def delete(self, index, product):
+        """
+        Deletes the row of sale `index` for `product`. SQLite removes it in place, the other
+        rows keep their index.
+
+        Returns:
+            list: The deleted row, or None if there is no such row.
+        """
+        with _write_lock, self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT id, transaction_index, customer, product, price, amount, total, timestamp FROM transactions "
+                "WHERE transaction_index = ? AND product = ? ORDER BY id LIMIT 1",
+                (int(index), product),
+            ).fetchone()
+            if row is None:
+                print(f"Transaction #{index} {product} not found.")
+                return None
+            self.connection.execute("DELETE FROM transactions WHERE id = ?", (row[0],))
+            self.connection.execute("INSERT INTO deleted (transaction_index, product) VALUES (?, ?)", (row[1], row[3]))  # For tail()
+            self._bump_version()
+        return list(row[1:])
+
+    def compact(self):
+        """
+        Returns the space freed by deletes to the file system (VACUUM).
+
+        Returns:
+            int: Always 0, deleted rows are already gone from the table.
+        """
+        with _write_lock, self.lock:
+            self.connection.execute("VACUUM")
+        return 0
+
+    def normalize_timestamps(self):
+        """
+        Returns:
+            int: Always 0, the SQLite store normalizes timestamps as they are written.
+        """
+        return 0
+
+PARTITION_DIR = "transactions"
+PARTITION_COLD_MONTHS = int(os.environ.get("POS_COLD_MONTHS", "3"))  # Older months are gzipped
+_PARTITION_NAME = re.compile(r"(\d{4}-\d{2})\.csv(\.gz)?$")
+
+class PartitionedTransactionStore:
+    """
+    Transactions split by month into transactions/YYYY-MM.csv, in the same row format as
+    transactions.csv, with transactions/manifest.json holding per month the live row count,
+    the total in cents, the first and last timestamp and the index range. Timestamps are
+    normalized on the way in, so a row's month is its timestamp[:7].
+
+    Readers filtering by year or month open only the months that can match, and
+    sale_products and delete only the months whose index range holds the sale.
+
+    Months older than PARTITION_COLD_MONTHS ($POS_COLD_MONTHS) are gzipped to
+    YYYY-MM.csv.gz when a new month starts (or by compress_partitions()). They read like the
+    others; writing to one (a backdated import) first unpacks it again.
+
+    The manifest also remembers each file's size. Whenever the lock is taken the files are
+    checked against it and a month written without the manifest being updated (a crash in
+    between) is scanned again, so counts, indices and signature() never fall behind.
+    Deleting appends a tombstone to transactions/voids.csv, like the CSV store.
+    """
+    name = "partitioned"
+    MANIFEST_FORMAT = 1
+
+    def __init__(self, directory=PARTITION_DIR):
+        self.directory = directory
+        self.lock = _write_lock  # Serializes writers across threads and processes
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.voids_path = os.path.join(directory, "voids.csv")
+        self._manifest = None
+        self._manifest_key = None
+        self._voids_key = None
+        self._voids = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, compressed=False):
+        return os.path.join(self.directory, f"{key}.csv" + (".gz" if compressed else ""))
+
+    def _open(self, key, compressed):
+        """
+        Opens a month for reading as a binary file. Falls back to the other form if it was
+        compressed or unpacked since the manifest was read; the contents are the same.
+        """
+        for gz in (compressed, not compressed):
+            try:
+                return gzip.open(self._path(key, True), "rb") if gz else open(self._path(key), "rb")
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(self._path(key))
+
+    def voids(self):
+        """
+        Returns the set of voided (index, product) pairs, re-reading the void log only if it changed.
+        """
+        key = _file_key(self.voids_path)
+        if key is None:
+            return set()
+        if self._voids_key != key:
+            with open(self.voids_path, "r") as file:
+                reader = csv.reader(file)
+                next(reader, None)  # Skip header
+                self._voids = {(row[0], row[1]) for row in reader if len(row) >= 2}
+            self._voids_key = key
+        return self._voids
+
+    def _load_manifest(self):
+        key = _file_key(self.manifest_path)
+        if key is None or key != self._manifest_key:
+            manifest = None
+            if key is not None:
+                try:
+                    with open(self.manifest_path, "r") as file:
+                        manifest = json.load(file)
+                except (OSError, ValueError) as e:
+                    print(f"Error reading {self.manifest_path}, rebuilding it: {e}")
+            if not manifest or manifest.get("format") != self.MANIFEST_FORMAT:
+                manifest = {"format": self.MANIFEST_FORMAT, "version": 0, "rewrites": 0, "next_index": 1, "voids": None, "partitions": {}}
+            self._manifest = manifest
+            self._manifest_key = key
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        manifest["version"] += 1
+        with open(self.manifest_path + ".tmp", "w") as file:
+            file.write(json.dumps(manifest))
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+        self._manifest = manifest
+        self._manifest_key = _file_key(self.manifest_path)
+
+    def _scan(self, key, compressed, voids):
+        """
+        Returns the manifest entry of one month, from a full read of it.
+        """
+        entry = {"rows": 0, "cents": 0, "first": None, "last": None, "min_index": None, "max_index": None, "compressed": compressed}
+        with self._open(key, compressed) as file:
+            data = file.read()
+        for row in csv.reader(data.decode(locale.getpreferredencoding(False)).splitlines()[1:]):
+            if row:
+                self._count(entry, row, voids)
+        entry["bytes"] = len(data)
+        entry["stored"] = os.path.getsize(self._path(key, compressed))
+        return entry
+
+    @staticmethod
+    def _count(entry, row, voids=()):
+        try:
+            index = int(row[0])
+            cents = round(float(row[5]) * 100)
+            timestamp = row[6]
+        except (ValueError, IndexError) as e:
+            print(f"Error processing row: {row}. Error: {e}")
+            return
+        entry["min_index"] = index if entry["min_index"] is None else min(entry["min_index"], index)
+        entry["max_index"] = index if entry["max_index"] is None else max(entry["max_index"], index)
+        if (str(index), row[2]) in voids:
+            return
+        entry["rows"] += 1
+        entry["cents"] += cents
+        entry["first"] = timestamp if entry["first"] is None else min(entry["first"], timestamp)
+        entry["last"] = timestamp if entry["last"] is None else max(entry["last"], timestamp)
+
+    def _refresh(self):
+        """
+        Returns the manifest after checking it against the month files, scanning again the
+        ones that changed behind its back. Call with self.lock held.
+        """
+        manifest = self._load_manifest()
+        partitions = manifest["partitions"]
+        found = {}  # {key: (compressed, size)}
+        for entry in os.scandir(self.directory):
+            match = _PARTITION_NAME.match(entry.name)
+            if match is None:
+                continue
+            key, compressed = match.group(1), bool(match.group(2))
+            if key in found:
+                # Interrupted while compressing or unpacking, both hold the same rows
+                os.remove(self._path(key, True))
+                compressed = False
+            found[key] = (compressed, os.path.getsize(self._path(key, compressed)))
+        voids = self.voids()
+        voids_key = list(_file_key(self.voids_path) or [])
+        rescan_all = manifest["voids"] != voids_key
+        changed = rescan_all
+        for key, (compressed, size) in found.items():
+            entry = partitions.get(key)
+            if rescan_all or entry is None or entry["compressed"] != compressed or entry["stored"] != size:
+                partitions[key] = self._scan(key, compressed, voids)
+                changed = True
+        for key in set(partitions) - set(found):
+            del partitions[key]
+            changed = True
+        if changed:
+            manifest["voids"] = voids_key
+            manifest["next_index"] = max([manifest["next_index"]] + [entry["max_index"] + 1 for entry in partitions.values() if entry["max_index"] is not None])
+            self._save_manifest(manifest)
+        return manifest
+
+    def _snapshot(self, year=None, month=None):
+        """
+        Returns ([(key, entry), ...] of the months that can match the filter, oldest first,
+        and the voids) as of one moment between writes.
+        """
+        with self.lock:
+            manifest = self._refresh()
+            voids = self.voids()
+            selected = [(key, dict(entry)) for key, entry in sorted(manifest["partitions"].items())
+                        if (not year or int(key[:4]) == int(year)) and (not month or int(key[5:7]) == int(month))]
+        return selected, voids
+
+    def months(self):
+        """
+        Returns ([(key, entry), ...] of every month, oldest first, and the voids) like
+        _snapshot, with a "file_id" added to each entry. It changes when the month file is
+        swapped for a new one (compaction, compressing, unpacking), for readers that keep
+        their own copy of a month and read only what was appended since (analytics.py).
+        """
+        with self.lock:
+            selected, voids = self._snapshot()
+            for key, entry in selected:
+                stat = os.stat(self._path(key, entry["compressed"]))
+                entry["file_id"] = [stat.st_dev, stat.st_ino]
+        return selected, voids
+
+    def month_rows(self, key, entry, offset=0):
+        """
+        Returns the rows of a month from byte `offset` of the unpacked file up to
+        entry["bytes"], voided or not. `entry` comes from _snapshot() or months().
+        """
+        with self._open(key, entry["compressed"]) as file:
+            file.seek(offset)  # gzip seeks by decompressing, fine for the rare append to a cold month
+            if not offset:
+                file.readline()  # Skip header
+            return [row for row in csv.reader(_read_lines(file, entry["bytes"])) if row]
+
+    def partitions(self):
+        """
+        Returns:
+            dict: {"YYYY-MM": {"rows", "total", "first", "last", "compressed", "stored"}} from the manifest.
+        """
+        with self.lock:
+            manifest = self._refresh()
+        return {key: {"rows": entry["rows"], "total": entry["cents"] / 100, "first": entry["first"], "last": entry["last"],
+                      "compressed": entry["compressed"], "stored": entry["stored"]}
+                for key, entry in sorted(manifest["partitions"].items())}
+
+    def next_index(self):
+        with self.lock:
+            return self._refresh()["next_index"]
+
+    def record(self, customer_name, cart_summary, timestamp):
+        """
+        Appends one sale and returns the index it was given.
+        """
+        with self.lock:
+            index = self.next_index()
+            self.record_many([{"index": index, "customer": customer_name, "lines": cart_summary, "timestamp": timestamp}])
+        return index
+
+    def record_many(self, sales, fsync=False):
+        """
+        Appends sales whose indices were already handed out, one write per month they fall in.
+
+        Args:
+            sales (list): Sale dicts, see sale_rows.
+            fsync (bool): Force the rows to disk before returning.
+        """
+        rows = [row for sale in sales for row in sale_rows(sale)]
+        self._append(rows, fsync, max([0] + [sale["index"] + len(sale["lines"]) for sale in sales]))
+
+    def _append(self, rows, fsync=False, next_index=0):
+        by_month = defaultdict(list)
+        for row in rows:
+            row = list(row)
+            row[6] = normalize_timestamp(row[6])
+            by_month[row[6][:7]].append(row)
+        with self.lock:
+            manifest = self._refresh()
+            partitions = manifest["partitions"]
+            new_month = False
+            for key, month_rows in sorted(by_month.items()):
+                entry = partitions.get(key)
+                if entry is not None and entry["compressed"]:
+                    self._decompress(key, entry)
+                path = self._path(key)
+                new_file = not os.path.exists(path)
+                with open(path, "a", newline="") as file:
+                    writer = csv.writer(file)
+                    if new_file:
+                        writer.writerow(TRANSACTION_HEADER)
+                    writer.writerows(month_rows)
+                    file.flush()
+                    if fsync:
+                        os.fsync(file.fileno())
+                if entry is None:
+                    entry = partitions[key] = {"rows": 0, "cents": 0, "first": None, "last": None, "min_index": None, "max_index": None, "compressed": False}
+                    new_month = True
+                for row in month_rows:
+                    self._count(entry, row)
+                entry["bytes"] = entry["stored"] = os.path.getsize(path)
+            manifest["next_index"] = max([manifest["next_index"], next_index] + [entry["max_index"] + 1 for entry in partitions.values() if entry["max_index"] is not None])
+            self._save_manifest(manifest)
+            if new_month:
+                self.compress_partitions()
+
+    def _decompress(self, key, entry):
+        """
+        Turns a gzipped month back into a plain file so rows can be appended. Call with
+        self.lock held.
+        """
+        with gzip.open(self._path(key, True), "rb") as source, open(self._path(key) + ".tmp", "wb") as target:
+            shutil.copyfileobj(source, target)
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(self._path(key) + ".tmp", self._path(key))
+        os.remove(self._path(key, True))
+        entry["compressed"] = False
+        entry["stored"] = os.path.getsize(self._path(key))
+
+    def compress_partitions(self, months=PARTITION_COLD_MONTHS, today=None):
+        """
+        Gzips the plain months more than `months` months before today's. Each file is compressed
+        next to the plain one and swapped in, so a crash leaves one or the other.
+
+        Returns:
+            int: The number of months compressed.
+        """
+        today = today or datetime.now().date()
+        year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+        cutoff = f"{year:04d}-{month + 1:02d}"
+        compressed = 0
+        with self.lock:
+            manifest = self._refresh()
+            for key, entry in sorted(manifest["partitions"].items()):
+                if key >= cutoff or entry["compressed"]:
+                    continue
+                with open(self._path(key), "rb") as source, gzip.open(self._path(key, True) + ".tmp", "wb") as target:
+                    shutil.copyfileobj(source, target)
+                with open(self._path(key, True) + ".tmp", "rb") as file:
+                    os.fsync(file.fileno())
+                os.replace(self._path(key, True) + ".tmp", self._path(key, True))
+                os.remove(self._path(key))
+                entry["compressed"] = True
+                entry["stored"] = os.path.getsize(self._path(key, True))
+                compressed += 1
+            if compressed:
+                self._save_manifest(manifest)
+        return compressed
+
+    def _candidates(self, partitions, index):
+        return [(key, entry) for key, entry in partitions if entry["min_index"] is not None and entry["min_index"] <= index <= entry["max_index"]]
+
+    def _rows_reverse(self, key, entry, before=None):
+        """
+        Yields (offset, row) of one month from its end towards the start, see _iter_rows_reverse.
+        """
+        with self._open(key, entry["compressed"]) as file:
+            if entry["compressed"]:
+                file = io.BytesIO(file.read(entry["bytes"]))  # gzip can't seek backwards cheaply
+            yield from _iter_rows_reverse(file, entry["bytes"], before)
+
+    def sale_products(self, index):
+        """
+        Returns the set of products recorded for sale `index`, voided or not.
+        """
+        selected, voids = self._snapshot()
+        products = set()
+        for key, entry in self._candidates(selected, index):
+            for offset, row in self._rows_reverse(key, entry):
+                if row[0] == str(index):
+                    products.add(row[2])
+        return products
+
+    def tail(self, position=None):
+        """
+        Returns what was written since `position`, see CsvTransactionStore.tail. Only the
+        months that grew are read, from where the last call stopped.
+        """
+        with self.lock:
+            manifest = self._refresh()
+            void_size = os.path.getsize(self.voids_path) if os.path.exists(self.voids_path) else 0
+            current = {"rewrites": manifest.get("rewrites", 0), "voids": void_size,
+                       "months": {key: entry["bytes"] for key, entry in manifest["partitions"].items()}}
+            selected = [(key, dict(entry)) for key, entry in sorted(manifest["partitions"].items())]
+        if position is None:
+            return [], [], current
+        if (position["rewrites"] != current["rewrites"] or void_size < position["voids"]
+                or any(current["months"].get(key, -1) < size for key, size in position["months"].items())):
+            return None, None, current
+        rows = []
+        for key, entry in selected:
+            offset = position["months"].get(key, 0)
+            if entry["bytes"] != offset:
+                rows += self.month_rows(key, entry, offset)
+        return rows, _read_voids_after(self.voids_path, position["voids"], void_size), current
+
+    def repair(self):
+        """
+        Cuts a half-written last row off the plain month files, see _repair_tail.
+
+        Returns:
+            bool: True if a file was changed.
+        """
+        changed = False
+        with self.lock:
+            for entry in os.scandir(self.directory):
+                match = _PARTITION_NAME.match(entry.name)
+                if match and not match.group(2):
+                    changed = _repair_tail(entry.path) or changed
+            self._refresh()
+        return changed
+
+    def signature(self):
+        """
+        Returns a value that changes with every write, the manifest version.
+        """
+        with self.lock:
+            return [self._refresh()["version"]]
+
+    def load(self, year=None, month=None, day=None):
+        """
+        Returns the transaction rows month by month, optionally filtered by year, month and day.
+        """
+        return list(self.iter_rows(year, month, day))
+
+    def iter_rows(self, year=None, month=None, day=None):
+        """
+        Yields the rows load() would return one at a time, reading only the months that can
+        match. Rows appended after the first one was yielded are not included.
+        """
+        selected, voids = self._snapshot(year, month)
+        for key, entry in selected:
+            with self._open(key, entry["compressed"]) as file:
+                reader = csv.reader(_read_lines(file, entry["bytes"]))
+                next(reader, None)  # Skip header row
+                for row in reader:
+                    if not row or (voids and (row[0], row[2]) in voids):
+                        continue
+                    if day and row[6][8:10] != str(day).zfill(2):
+                        continue
+                    yield row
+
+    def load_page(self, year=None, month=None, day=None, before=None, limit=50, start=None, end=None):
+        """
+        Returns one page of rows, newest first, reading months from the newest back only as
+        far as the page needs. Months outside the start to end range aren't opened.
+
+        Returns:
+            tuple: ([row, ...], cursor). cursor is None once there are no older rows.
+        """
+        selected, voids = self._snapshot(year, month)
+        first = start.isoformat() if start else ""
+        last = end.isoformat() if end else "9999"
+        page_rows = []
+        for key, entry in reversed(selected):
+            if key < first[:7] or key > last[:7]:
+                continue
+            offset_before = None
+            if before is not None:
+                if key > before[0]:
+                    continue
+                if key == before[0]:
+                    offset_before = before[1]
+            for offset, row in self._rows_reverse(key, entry, offset_before):
+                if voids and (row[0], row[2]) in voids:
+                    continue
+                if day and row[6][8:10] != str(day).zfill(2):
+                    continue
+                if not first <= row[6][:10] <= last:
+                    continue
+                page_rows.append(row)
+                if len(page_rows) == limit:
+                    return page_rows, [key, offset]
+        return page_rows, None
+
+    def delete(self, index, product):
+        """
+        Voids the row of sale `index` for `product` by appending a tombstone to the void log,
+        searching only the months whose index range holds the sale.
+
+        Returns:
+            list: The deleted row, or None if there is no such (non-voided) row.
+        """
+        index = str(index)
+        with self.lock:
+            manifest = self._refresh()
+            voids = self.voids()
+            deleted = None
+            for key, entry in self._candidates(sorted(manifest["partitions"].items()), int(index)):
+                for offset, row in self._rows_reverse(key, entry):
+                    if row[0] == index and row[2] == product and (index, product) not in voids:
+                        deleted = row
+                        break
+                if deleted is not None:
+                    break
+            if deleted is None:
+                print(f"Transaction #{index} {product} not found.")
+                return None
+
+            new_file = not os.path.exists(self.voids_path)
+            with open(self.voids_path, "a", newline="") as file:
+                writer = csv.writer(file)
+                if new_file:
+                    writer.writerow(["Index", "Product"])
+                writer.writerow([index, product])
+            entry = manifest["partitions"][deleted[6][:7]]
+            entry["rows"] -= 1
+            entry["cents"] -= round(float(deleted[5]) * 100)
+            manifest["voids"] = list(_file_key(self.voids_path))
+            self._save_manifest(manifest)
+        return deleted
+
+    def compact(self):
+        """
+        Rewrites the months holding voided rows without them and empties the void log.
+
+        Returns:
+            int: The number of rows removed.
+        """
+        removed = 0
+        with self.lock:
+            manifest = self._refresh()
+            voids = self.voids()
+            if not voids:
+                return 0
+            voided_indices = {int(index) for index, product in voids if index.isdigit()}
+            for key, entry in sorted(manifest["partitions"].items()):
+                if not any(entry["min_index"] is not None and entry["min_index"] <= index <= entry["max_index"] for index in voided_indices):
+                    continue
+                with self._open(key, entry["compressed"]) as file:
+                    lines = file.read().decode(locale.getpreferredencoding(False)).splitlines()
+                kept = [row for row in csv.reader(lines[1:]) if row and (row[0], row[2]) not in voids]
+                removed += len(lines) - 1 - len(kept)
+                path = self._path(key, entry["compressed"])
+                with (gzip.open(path + ".tmp", "wt", newline="") if entry["compressed"] else open(path + ".tmp", "w", newline="")) as file:
+                    writer = csv.writer(file)
+                    writer.writerow(TRANSACTION_HEADER)
+                    writer.writerows(kept)
+                os.replace(path + ".tmp", path)
+            os.remove(self.voids_path)
+            manifest["rewrites"] = manifest.get("rewrites", 0) + 1  # Tells tail() readers to start over
+            self._refresh()  # Scans the rewritten months again
+        return removed
+
+    def normalize_timestamps(self):
+        """
+        Timestamps are normalized when rows are written, so there is nothing to rewrite.
+
+        Returns:
+            int: 0
+        """
+        return 0
+
+TRANSACTION_STORES = {"csv": CsvTransactionStore, "sqlite": SqliteTransactionStore, "partitioned": PartitionedTransactionStore}
+_transaction_store = None
+_shared_state_lock = threading.RLock()  # So sessions starting together create one store and one writer
+
+def get_transaction_store():
+    """
+    Returns the shared transaction store, picked with the POS_STORE environment variable
+    ("csv", the default, "sqlite" or "partitioned").
+    """
+    global _transaction_store
+    with _shared_state_lock:
+        if _transaction_store is None:
+            backend = os.environ.get("POS_STORE", "csv")
+            if backend not in TRANSACTION_STORES:
+                raise ValueError(f"Unknown POS_STORE {backend!r}, expected one of {', '.join(TRANSACTION_STORES)}")
+            _transaction_store = TRANSACTION_STORES[backend]()
+        return _transaction_store
+
+def migrate_csv_to_sqlite(db_path="transactions.db"):
+    """
+    Copies every row of transactions.csv into a new SQLite store, normalizing legacy
+    '31/3/2025 22:58' timestamps on the way.
+
+    Returns:
+        tuple: (migrated_rows, skipped_rows). Rows whose timestamp or numbers can't be parsed are skipped.
+
+    Raises:
+        ValueError: If the database already holds transactions.
+    """
+    store = SqliteTransactionStore(db_path)
+    if store.connection.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]:
+        raise ValueError(f"{db_path} already contains transactions, not migrating again")
+
+    rows = []
+    skipped = 0
+    for row in CsvTransactionStore().load():
+        try:
+            index, customer, product, price, amount, total, timestamp = row
+            rows.append((int(index), customer, product, float(price), int(amount), float(total),
+                         normalize_timestamp(timestamp)))
+        except ValueError as e:
+            print(f"Skipping row: {row}. Error: {e}")
+            skipped += 1
+
+    with store.connection:
+        store.connection.executemany(
+            "INSERT INTO transactions (transaction_index, customer, product, price, amount, total, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        store.connection.execute("DELETE FROM sequence")
+        # Seed the sequence past the migrated rows and past indices voided and compacted away
+        store.connection.execute("INSERT INTO sequence (next_index) VALUES (?)", (CsvTransactionStore().next_index(),))
+    store.connection.close()
+    return len(rows), skipped
+
+def migrate_csv_to_partitions(directory=PARTITION_DIR, chunk=50000):
+    """
+    Copies every row of transactions.csv into month partitions, normalizing legacy
+    '31/3/2025 22:58' timestamps on the way, then compresses the cold months. Voided rows
+    are left out.
+
+    Returns:
+        tuple: (migrated_rows, skipped_rows). Rows whose timestamp or numbers can't be parsed are skipped.
+
+    Raises:
+        ValueError: If the directory already holds transactions.
+    """
+    store = PartitionedTransactionStore(directory)
+    if store.partitions():
+        raise ValueError(f"{directory}/ already contains transactions, not migrating again")
+
+    rows = []
+    migrated = 0
+    skipped = 0
+    for row in CsvTransactionStore().iter_rows():
+        try:
+            index, customer, product, price, amount, total, timestamp = row
+            int(index)
+            float(total)
+            rows.append([index, customer, product, price, amount, total, normalize_timestamp(timestamp)])
+        except ValueError as e:
+            print(f"Skipping row: {row}. Error: {e}")
+            skipped += 1
+            continue
+        if len(rows) >= chunk:
+            store._append(rows)
+            migrated += len(rows)
+            rows = []
+    store._append(rows, next_index=next_transaction_index())
+    store.compress_partitions()
+    return migrated + len(rows), skipped
+
+SCAN_WORKERS = int(os.environ.get("POS_SCAN_WORKERS", "0")) or os.cpu_count() or 1
+SCAN_PARALLEL_BYTES = 32 * 1024 * 1024  # Smaller stores are scanned in this process, starting workers costs more
+SCAN_CHUNK_BYTES = 16 * 1024 * 1024  # Largest byte range one worker parses at a time
+_scan_voids = set()  # Set in each worker by _scan_init
+
+def _split_range(path, start, end, chunk_bytes):
+    """
+    Returns [(start, end), ...] covering bytes start..end of `path` in pieces of about
+    `chunk_bytes`, each starting right after a line break so no row is cut in two.
+    """
+    bounds = [start]
+    with open(path, "rb") as file:
+        while bounds[-1] + chunk_bytes < end:
+            file.seek(bounds[-1] + chunk_bytes)
+            file.readline()
+            if file.tell() >= end:
+                break
+            bounds.append(file.tell())
+    return list(zip(bounds, bounds[1:] + [end]))
+
+def _scan_tasks(store, year=None, month=None, chunk_bytes=SCAN_CHUNK_BYTES):
+    """
+    Cuts the rows of a file based store into scan tasks, as of one moment between writes.
+
+    Returns:
+        tuple: ([(path, start, end, compressed), ...] in store order, voids, total bytes),
+            or None for stores that aren't files (SQLite). A task starting at 0 starts
+            with the header. Gzipped months are one task each.
+    """
+    if store.name == "csv":
+        file, size, voids = store._snapshot()
+        file.close()
+        files = [("transactions.csv", size, False)]
+    elif store.name == "partitioned":
+        selected, voids = store._snapshot(year, month)
+        files = [(store._path(key, entry["compressed"]), entry["bytes"], entry["compressed"]) for key, entry in selected]
+    else:
+        return None
+    tasks = []
+    for path, size, compressed in files:
+        if compressed:
+            tasks.append((path, 0, size, True))
+        else:
+            tasks += [(path, start, end, False) for start, end in _split_range(path, 0, size, chunk_bytes)]
+    return tasks, voids, sum(size for path, size, compressed in files)
+
+def _scan_init(voids):
+    global _scan_voids
+    _scan_voids = voids
+
+def _scan_rows(task, voids, year, month, day):
+    path, start, end, compressed = task
+    with (gzip.open(path, "rb") if compressed else open(path, "rb")) as file:
+        file.seek(start)
+        data = file.read(end - start)
+    reader = csv.reader(io.StringIO(data.decode(locale.getpreferredencoding(False)), newline=""))
+    if start == 0:
+        next(reader, None)  # Skip header row
+    filtered = year or month or day
+    for row in reader:
+        if not row or (voids and (row[0], row[2]) in voids):
+            continue
+        if filtered:
+            try:
+                if not _matches_date(parse_timestamp(row[6]), year, month, day):
+                    continue
+            except (ValueError, IndexError) as e:
+                print(f"Error parsing date: {e}, for row: {row}") # handle parsing issue
+                continue
+        yield row
+
+def _scan_chunk(task, kind, filters, voids=None):
+    """
+    Parses one scan task. Returns its rows (kind "rows") or the (daily, hourly, products,
+    daily_products) totals of a SalesRollup over them (kind "rollup").
+    """
+    rows = _scan_rows(task, _scan_voids if voids is None else voids, *filters)
+    if kind == "rows":
+        return list(rows)
+    rollup = SalesRollup(None)
+    rollup.apply(rows)
+    return rollup.daily, rollup.hourly, rollup.products, rollup.daily_products
+
+def _scan(store, kind, year=None, month=None, day=None, workers=None):
+    """
+    Runs `kind` (see _scan_chunk) over the store's rows, yielding the result of each task
+    in store order. Stores above SCAN_PARALLEL_BYTES are split into newline aligned byte
+    ranges parsed by `workers` processes; smaller ones are parsed here, by the same code.
+    """
+    workers = workers or SCAN_WORKERS
+    filters = (year, month, day)
+    planned = _scan_tasks(store, year, month)
+    if planned is None:
+        if kind == "rows":
+            yield store.load(year, month, day)
+        else:
+            rollup = SalesRollup(None)
+            rollup.apply(store.iter_rows(year, month, day))
+            yield rollup.daily, rollup.hourly, rollup.products, rollup.daily_products
+        return
+    tasks, voids, size = planned
+    if workers == 1 or size < SCAN_PARALLEL_BYTES:
+        for task in tasks:
+            yield _scan_chunk(task, kind, filters, voids)
+        return
+    if len(tasks) < workers * 2:  # Keep every worker busy
+        tasks, voids, size = _scan_tasks(store, year, month, max(size // (workers * 2), 65536))
+    # spawn, not fork: the app's threads may hold locks a forked child would inherit taken
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=_scan_init, initargs=(voids,)) as executor:
+        yield from executor.map(functools.partial(_scan_chunk, kind=kind, filters=filters), tasks)
+
+@metrics.timed("pos_core.scan_sales_rollup")
+def scan_sales_rollup(store=None, workers=None):
+    """
+    Computes the sales rollup totals with a parallel scan of the store, see _scan. Totals
+    are integer cents and partial results are merged in store order, so the result is
+    exactly what SalesRollup.apply over the rows one by one gives, first-sold order included.
+
+    Returns:
+        SalesRollup: Not tied to a file, take the totals from it.
+    """
+    rollup = SalesRollup(None)
+    for daily, hourly, products, daily_products in _scan(store or get_transaction_store(), "rollup", workers=workers):
+        rollup.merge(daily, hourly, products, daily_products)
+    return rollup
+
+@metrics.timed("pos_core.scan_transactions")
+def scan_transactions(year=None, month=None, day=None, workers=None):
+    """
+    Returns the rows load_transactions would return, parsed by a parallel scan, see _scan.
+    """
+    flush_checkouts()
+    rows = []
+    for chunk_rows in _scan(get_transaction_store(), "rows", year, month, day, workers):
+        rows += chunk_rows
+    return rows
+
+def scan_daily_sales(workers=None):
+    """
+    Returns:
+        dict: {date: total sales} from a parallel scan, in the order the dates first appear.
+    """
+    flush_checkouts()
+    return scan_sales_rollup(workers=workers).daily_sales()
+
+def scan_top_products(n=10, workers=None):
+    """
+    Returns the n best selling products as [(product, quantity), ...] from a parallel scan,
+    the same as top_products_from_rows over every row.
+    """
+    flush_checkouts()
+    return scan_sales_rollup(workers=workers).top_products(n)
+
+def _parse_date_key(key):
+    """
+    Parses the date part of a transaction timestamp ('2025-04-02' or legacy '2/4/2025').
+
+    Returns:
+        date: The parsed date, or None if it is in neither format.
+    """
+    try:
+        return date.fromisoformat(key)  # Every key the rollup writes, parsed in C
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(key, "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+class DayIndex:
+    """
+    Cumulative daily sales: cents[i] and rows[i] are the totals of every day before
+    first + i, so the total of any date range is one subtraction, whatever its length.
+    Built from SalesRollup.daily in O(days between the first and last sale), then kept up
+    to date by add(), which for a sale of today only touches the last entry.
+    """
+
+    def __init__(self, daily):
+        days = {}
+        for key, (cents, rows) in daily.items():
+            day = _parse_date_key(key)
+            if day is not None:
+                total = days.setdefault(day.toordinal(), [0, 0])
+                total[0] += cents
+                total[1] += rows
+        self.first = min(days, default=0)
+        self.cents = [0]
+        self.rows = [0]
+        for ordinal in range(self.first, max(days, default=-1) + 1):
+            cents, rows = days.get(ordinal, (0, 0))
+            self.cents.append(self.cents[-1] + cents)
+            self.rows.append(self.rows[-1] + rows)
+
+    def add(self, key, cents, rows):
+        """
+        Adds the cents and rows sold on day `key` to the running totals, in place, in
+        O(days from it to the last day).
+
+        Returns:
+            bool: False if the index has to be built again instead: the day is before the
+                first one, or the first or last day was left without sales.
+        """
+        day = _parse_date_key(key)
+        if day is None:
+            return True  # Not counted when building either
+        position = day.toordinal() - self.first + 1
+        if len(self.cents) == 1 or position < 1:
+            return False
+        while len(self.cents) <= position:  # A day after the last one, the days between had no sales
+            self.cents.append(self.cents[-1])
+            self.rows.append(self.rows[-1])
+        for i in range(position, len(self.cents)):
+            self.cents[i] += cents
+            self.rows[i] += rows
+        return self.rows[1] > 0 and self.rows[-1] > self.rows[-2]
+
+    @property
+    def first_day(self):
+        return date.fromordinal(self.first) if len(self.cents) > 1 else None
+
+    @property
+    def last_day(self):
+        return date.fromordinal(self.first + len(self.cents) - 2) if len(self.cents) > 1 else None
+
+    def _position(self, day):
+        return min(max(day.toordinal() - self.first, 0), len(self.cents) - 1)
+
+    def total(self, start=None, end=None):
+        """
+        Returns (cents, rows) sold from the start to the end date, both inclusive and
+        both optional.
+        """
+        low = 0 if start is None else self._position(start)
+        high = len(self.cents) - 1 if end is None else self._position(end + timedelta(days=1))
+        if high <= low:
+            return 0, 0
+        return self.cents[high] - self.cents[low], self.rows[high] - self.rows[low]
+
+class ProductRanking:
+    """
+    Quantities sold per product, kept sorted by quantity as they change, so the top n is a
+    slice instead of a pass over every product. Ties are ordered by when the product was
+    added to the ranking, the same as heapq.nlargest over the quantities in that order.
+    """
+
+    def __init__(self, quantities=()):
+        self.totals = {}  # product -> [quantity, rows, order]
+        self.order = 0
+        for product, quantity, rows in quantities:
+            total = self.totals.get(product)
+            if total is None:
+                total = self.totals[product] = [0, 0, self.order]
+                self.order += 1
+            total[0] += quantity
+            total[1] += rows
+        self.ranked = sorted((-quantity, order, product) for product, (quantity, rows, order) in self.totals.items() if rows > 0)
+        self.totals = {product: total for product, total in self.totals.items() if total[1] > 0}
+
+    def add(self, product, quantity, rows):
+        """
+        Adds (or with negative values removes) quantity and rows of `product`, in
+        O(log products) plus one list insert.
+        """
+        total = self.totals.get(product)
+        if total is None:
+            total = self.totals[product] = [0, 0, self.order]
+            self.order += 1
+        else:
+            del self.ranked[bisect.bisect_left(self.ranked, (-total[0], total[2]))]
+        total[0] += quantity
+        total[1] += rows
+        if total[1] <= 0:
+            del self.totals[product]
+        else:
+            bisect.insort(self.ranked, (-total[0], total[2], product))
+
+    def top(self, n):
+        return [(product, -negative) for negative, order, product in self.ranked[:n]]
+
+ROLLUP_WINDOWS = 8  # Date windows of top_products kept ranked, the periods of the Top tab and a few more
+ROLLUP_SNAPSHOT_ROWS = 50000  # Rows in the rollup's delta log before the totals are written out in full again
+
+class SalesRollup:
+    """
+    Per-day and per-hour sales totals and per-day product quantities, kept next to the
+    store. Days are 'YYYY-MM-DD' and hours 'YYYY-MM-DD HH', whichever format the
+    transaction's timestamp was written in.
+
+    record_transaction and delete_transaction update the totals as they go, so reading them
+    costs O(days) instead of a scan of every transaction. Totals are kept in integer cents
+    together with a row count, so adding and removing sales never drifts.
+
+    On disk the totals are a snapshot, sales_rollup.json, and a delta log, sales_rollup.jsonl:
+    record() appends the rows a write added or removed to the log, which costs the same
+    however many days and products the totals hold. Every ROLLUP_SNAPSHOT_ROWS logged rows
+    the totals are written out in full and the log is started again. Loading (and
+    catch_up(), for the writes of other processes) replays the log. In the snapshot each
+    day's product quantities are a flat [product code, quantity, rows, ...] list, with
+    codes into "products", which keeps the per-day x per-product map (by far the largest
+    part) small and quick to encode.
+
+    Every snapshot and log entry remembers the store's signature() it matches. If the store
+    was written without the rollup being updated (a crash in between, another program
+    editing the CSV, a different backend) the appended rows are read from the store, and
+    after anything else the totals are rebuilt from the store on load.
+
+    With store None the rollup only holds totals, for the partial results of a scan.
+    """
+
+    FORMAT = 4  # Bumped when the meaning of the keys changes, older files are rebuilt
+
+    def __init__(self, store, path="sales_rollup.json", rebuild_if_stale=True):
+        self.store = store
+        self.path = path
+        self.log_path = os.path.splitext(path)[0] + ".jsonl"
+        self.daily = {}   # "date" -> [cents, rows]
+        self.hourly = {}  # "date HH" -> [cents, rows]
+        self.products = {}  # product -> [quantity, rows], in the order products were first sold
+        self.daily_products = {}  # "date" -> {product -> [quantity, rows]}
+        self.signature = None  # The store signature the totals match
+        self.position = None  # The store's tail() position the totals match
+        self.generation = None  # The snapshot's, the log starts with it
+        self.log_offset = 0  # Bytes of the log taken in, 0 if the log doesn't belong to the snapshot
+        self.log_rows = 0  # Rows logged since the snapshot
+        self._day_index = None  # Built from daily when a range total is asked for, then patched by apply()
+        self._ranking = None  # ProductRanking of products, built by top_products() and patched by apply()
+        self._windows = {}  # (first day, last day) -> ProductRanking of the days in between, likewise
+        if store is not None and not self._load() and rebuild_if_stale:
+            self.rebuild()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if data.get("format") != self.FORMAT or data.get("store") != self.store.name:
+            return False
+        try:
+            self.daily = data["daily"]
+            self.hourly = data["hourly"]
+            self.products = data["products"]
+            names = list(self.products)
+            self.daily_products = {day: {names[flat[i]]: [flat[i + 1], flat[i + 2]] for i in range(0, len(flat), 3)}
+                                   for day, flat in data["daily_products"].items()}
+            self.generation = data["generation"]
+            self.signature = data["signature"]
+            self.position = data["position"]
+        except (KeyError, IndexError, TypeError):
+            return False  # Written by an older version, rebuild
+        self._day_index = None
+        self._ranking = None
+        self._windows = {}
+        self.log_offset = self.log_rows = 0
+        return self.catch_up()
+
+    def save(self):
+        """
+        Writes the totals out in full and starts a new, empty delta log.
+        """
+        self.signature = self.store.signature()
+        self.position = self.store.tail()[2]
+        self.generation = time.time_ns()
+        codes = {product: code for code, product in enumerate(self.products)}  # Every product of a day is in there
+        daily_products = {day: [value for product, (quantity, rows) in day_products.items() for value in (codes[product], quantity, rows)]
+                          for day, day_products in self.daily_products.items()}
+        data = {"format": self.FORMAT, "store": self.store.name, "generation": self.generation, "signature": self.signature,
+                "position": self.position, "daily": self.daily, "hourly": self.hourly, "products": self.products,
+                "daily_products": daily_products}
+        with open(self.path + ".tmp", "w") as file:
+            file.write(json.dumps(data))  # dumps uses the C encoder, dump() to a file doesn't
+        os.replace(self.path + ".tmp", self.path)
+        # A crash before this leaves the old snapshot's log, which _replay() then ignores
+        header = json.dumps({"generation": self.generation}).encode() + b"\n"
+        with open(self.log_path, "wb") as file:
+            file.write(header)
+        self.log_offset = len(header)
+        self.log_rows = 0
+
+    def record(self, rows, sign=1):
+        """
+        Adds (sign=1) or removes (sign=-1) rows the store was just written with and appends
+        them to the delta log, taking a new snapshot once the log holds ROLLUP_SNAPSHOT_ROWS
+        rows. With no rows only the store signature the totals match changes, after a
+        rewrite of the store. Call with _write_lock held, after get_sales_rollup().
+        """
+        self.apply(rows, sign)
+        if (self.generation is None or self.log_rows + len(rows) >= ROLLUP_SNAPSHOT_ROWS
+                or (self.log_offset and not os.path.exists(self.log_path))):
+            self.save()
+            return
+        self.signature = self.store.signature()
+        self.position = self.store.tail()[2]
+        entry = json.dumps({"sign": sign, "rows": rows, "signature": self.signature, "position": self.position}).encode() + b"\n"
+        with open(self.log_path, "r+b" if self.log_offset else "wb") as file:
+            if not self.log_offset:
+                file.write(json.dumps({"generation": self.generation}).encode() + b"\n")
+            file.seek(self.log_offset or file.tell())
+            file.write(entry)
+            file.truncate()  # Drops a line torn by a crash, everything before it was replayed
+            self.log_offset = file.tell()
+        self.log_rows += len(rows)
+
+    def _replay(self):
+        """
+        Applies the log entries appended since the log was last read, by this process or
+        another one. Does not save.
+
+        Returns:
+            bool: False if the log was started again by a newer snapshot, or is damaged.
+        """
+        try:
+            file = open(self.log_path, "rb")
+        except FileNotFoundError:
+            return not self.log_offset
+        with file:
+            try:
+                generation = json.loads(file.readline())["generation"]
+            except (ValueError, KeyError, TypeError):
+                generation = None
+            if generation != self.generation:
+                return not self.log_offset  # Still the log of an older snapshot, or already of a newer one
+            start = max(self.log_offset, file.tell())
+            file.seek(start)
+            data = file.read()
+        end = data.rfind(b"\n") + 1  # A torn last line is cut off by the next record()
+        try:
+            for line in data[:end].splitlines():
+                entry = json.loads(line)
+                self.apply(entry["rows"], entry["sign"])
+                self.signature = entry["signature"]
+                self.position = entry["position"]
+                self.log_rows += len(entry["rows"])
+        except (ValueError, KeyError, TypeError):
+            return False
+        self.log_offset = start + end
+        return True
+
+    @staticmethod
+    def _bump(buckets, key, value, rows):
+        bucket = buckets.setdefault(key, [0, 0])
+        bucket[0] += value
+        bucket[1] += rows
+        if bucket[1] <= 0:
+            del buckets[key]
+
+    def apply(self, rows, sign=1):
+        """
+        Adds (sign=1) or removes (sign=-1) transaction rows from the totals. Does not save.
+        """
+        for row in rows:
+            try:
+                timestamp = normalize_timestamp(row[6])
+                day = timestamp[:10]
+                hour = timestamp[:13]
+                cents = round(float(row[5]) * 100)
+            except (ValueError, IndexError) as e:
+                print(f"Error processing row: {row}. Error: {e}") #handle errors
+                day = None
+            else:
+                self._bump(self.daily, day, sign * cents, sign)
+                self._bump(self.hourly, hour, sign * cents, sign)
+                if self._day_index is not None and not self._day_index.add(day, sign * cents, sign):
+                    self._day_index = None
+
+            try:
+                product = row[2]
+                amount = int(row[4])
+            except (ValueError, IndexError):
+                continue
+            self._bump(self.products, product, sign * amount, sign)
+            if self._ranking is not None:
+                self._ranking.add(product, sign * amount, sign)
+            for (first, last), ranking in self._windows.items():
+                if day is not None and first <= day <= last:
+                    ranking.add(product, sign * amount, sign)
+            if day is not None:
+                day_products = self.daily_products.setdefault(day, {})
+                self._bump(day_products, product, sign * amount, sign)
+                if not day_products:
+                    del self.daily_products[day]
+
+    def catch_up(self):
+        """
+        Brings the totals up to date with the store: replays what other processes appended
+        to the delta log, then adds any rows that were written to the store without being
+        logged (the writer died in between), read with the store's tail(), and logs them.
+        Call with _write_lock held.
+
+        Returns:
+            bool: False if that isn't possible (a newer snapshot was taken, rows were voided
+                or the store rewritten behind the rollup's back), load the totals again.
+        """
+        if not self._replay():
+            return False
+        if self.signature == self.store.signature():
+            return True
+        if self.position is None:
+            return False
+        rows, voids, position = self.store.tail(self.position)
+        if rows is None or voids:
+            return False  # Voided rows would have to be looked up
+        self.record(rows)
+        return True
+
+    def merge(self, daily, hourly, products, daily_products):
+        """
+        Adds the totals of another rollup, whose rows come after the ones in this one.
+        """
+        self._day_index = None
+        self._ranking = None
+        self._windows = {}
+        for buckets, other in ((self.daily, daily), (self.hourly, hourly), (self.products, products)):
+            for key, (value, rows) in other.items():
+                self._bump(buckets, key, value, rows)
+        for day, day_products in daily_products.items():
+            merged = self.daily_products.setdefault(day, {})
+            for product, (quantity, rows) in day_products.items():
+                self._bump(merged, product, quantity, rows)
+
+    def rebuild(self):
+        """
+        Recomputes every total from a full (parallel) scan of the store and saves them.
+        """
+        scanned = scan_sales_rollup(self.store)
+        self.daily = scanned.daily
+        self.hourly = scanned.hourly
+        self.products = scanned.products
+        self.daily_products = scanned.daily_products
+        self._day_index = None
+        self._ranking = None
+        self._windows = {}
+        self.save()
+
+    def day_index(self):
+        """
+        Returns the DayIndex of the current daily totals. It is built on the first call and
+        patched by apply() after that; only a sale before the first day, or one that empties
+        the first or last day, makes the next call build it again.
+        """
+        if self._day_index is None:
+            self._day_index = DayIndex(self.daily)
+        return self._day_index
+
+    def daily_sales(self):
+        """
+        Returns:
+            dict: {date: total sales} in the order the dates first appear in the store.
+        """
+        return {day: cents / 100 for day, (cents, rows) in self.daily.items()}
+
+    def hourly_sales(self):
+        """
+        Returns:
+            dict: {"date HH": total sales}.
+        """
+        return {hour: cents / 100 for hour, (cents, rows) in self.hourly.items()}
+
+    def top_products(self, n=10, start=None, end=None):
+        """
+        Returns the n best selling products by quantity, optionally only counting sales
+        between the start and end dates (inclusive).
+
+        Ties are ordered by when the product was first sold, the same as Counter.most_common
+        over the transactions in store order. (After a delete or a back-dated sale, ties can
+        keep the order from before it until the next rebuild.)
+
+        The ranking of every product, and of each of the last ROLLUP_WINDOWS windows asked
+        for, is built once and then kept sorted by apply(), so the answer is a slice.
+
+        Returns:
+            list: [(product, quantity), ...]
+        """
+        if start is None and end is None:
+            if self._ranking is None:
+                self._ranking = ProductRanking((product, quantity, rows) for product, (quantity, rows) in self.products.items())
+            return self._ranking.top(n)
+        # Day keys are 'YYYY-MM-DD', so the window is a string range
+        window = (start.isoformat() if start else "", end.isoformat() if end else "~")
+        ranking = self._windows.get(window)
+        if ranking is None:
+            if len(self._windows) >= ROLLUP_WINDOWS:
+                del self._windows[next(iter(self._windows))]  # The oldest
+            ranking = self._windows[window] = ProductRanking(
+                (product, quantity, rows) for day, day_products in self.daily_products.items() if window[0] <= day <= window[1]
+                for product, (quantity, rows) in day_products.items())
+        return ranking.top(n)
+
+_sales_rollup = None
+
+def get_sales_rollup():
+    """
+    Returns the shared SalesRollup for the current transaction store, brought up to date if
+    another process wrote the store since (see SalesRollup.catch_up), or loaded again if
+    that isn't possible. Call with _write_lock held.
+    """
+    global _sales_rollup
+    store = get_transaction_store()
+    if _sales_rollup is None or _sales_rollup.store is not store or not _sales_rollup.catch_up():
+        _sales_rollup = SalesRollup(store)
+    return _sales_rollup
+
+UNKNOWN_CUSTOMER = "Unknown"  # Stored for sales without a customer name
+CUSTOMER_INDEX_SAVE_ROWS = 10000  # Rows taken in since customer_index.json was written before it is written again
+
+def _customer_key(name):
+    return " ".join(str(name).split()).casefold()
+
+class CustomerIndex:
+    """
+    Every named customer's sales, lifetime spend and first and last visit, kept in
+    customer_index.json, so one customer's history is a dict lookup instead of a scan of
+    the store. Sales to UNKNOWN_CUSTOMER aren't indexed. Names match ignoring case and
+    repeated spaces, and are shown as they were first written.
+
+    The index remembers the store's tail() position it has seen and catches up from there
+    before every lookup, which takes in this till's checkouts and other tills' alike
+    without touching the write path. A void removes its line from the sale; after a
+    rewrite of the store (compaction, timestamp migration) the index is rebuilt.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, store, path="customer_index.json", load=True):
+        self.store = store
+        self.path = path
+        # key -> {"name", "sales": [[index, timestamp, [[product, amount, cents], ...]], ...] in
+        # index order, "cents", "first", "last"}
+        self.customers = {}
+        self.sale_customers = {}  # Sale index -> key of its customer, so a void finds the sale at once
+        self.position = None  # The store's tail() position the index matches
+        self.unsaved = 0  # Rows and voids taken in since the last save
+        self._keys = None  # Sorted customer keys for find(), rebuilt after a customer was added
+        if not (load and self._load()):
+            self.rebuild()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if data.get("format") != self.FORMAT or data.get("store") != self.store.name:
+            return False
+        self.customers = {}
+        self.sale_customers = {}
+        try:
+            for key, (name, sales) in data["customers"].items():
+                self.customers[key] = customer = {"name": name, "sales": sales}
+                self._summarize(customer)
+                self.sale_customers.update((sale[0], key) for sale in sales)
+            self.position = data["position"]
+        except (KeyError, TypeError, ValueError):
+            return False  # Damaged, rebuild
+        self._keys = None
+        return self.catch_up()
+
+    def save(self):
+        data = {"format": self.FORMAT, "store": self.store.name, "position": self.position,
+                "customers": {key: [customer["name"], customer["sales"]] for key, customer in self.customers.items()}}
+        with open(self.path + ".tmp", "w") as file:
+            file.write(json.dumps(data))
+        os.replace(self.path + ".tmp", self.path)
+        self.unsaved = 0
+
+    @staticmethod
+    def _summarize(customer):
+        sales = customer["sales"]
+        customer["cents"] = sum(cents for sale in sales for product, amount, cents in sale[2])
+        customer["first"] = min(sale[1] for sale in sales)
+        customer["last"] = max(sale[1] for sale in sales)
+
+    def apply(self, rows):
+        """
+        Adds transaction rows to their customers' sales. Does not save.
+        """
+        unknown = _customer_key(UNKNOWN_CUSTOMER)
+        for row in rows:
+            try:
+                index = int(row[0])
+                name = row[1]
+                line = [row[2], int(row[4]), round(float(row[5]) * 100)]
+                timestamp = normalize_timestamp(row[6])
+            except (ValueError, IndexError) as e:
+                print(f"Error processing row: {row}. Error: {e}")
+                continue
+            key = _customer_key(name)
+            if not key or key == unknown:
+                continue
+            customer = self.customers.get(key)
+            if customer is None:
+                customer = self.customers[key] = {"name": name, "sales": [], "cents": 0, "first": timestamp, "last": timestamp}
+                self._keys = None
+            sales = customer["sales"]
+            self.sale_customers[index] = key
+            if sales and sales[-1][0] == index:
+                sales[-1][2].append(line)
+            elif not sales or sales[-1][0] < index:
+                sales.append([index, timestamp, [line]])
+            else:
+                position = bisect.bisect_left(sales, [index])  # A backdated import
+                if position < len(sales) and sales[position][0] == index:
+                    sales[position][2].append(line)
+                else:
+                    sales.insert(position, [index, timestamp, [line]])
+            customer["cents"] += line[2]
+            customer["first"] = min(customer["first"], timestamp)
+            customer["last"] = max(customer["last"], timestamp)
+
+    def void(self, index, product):
+        """
+        Removes the line for `product` from sale `index`, and the sale once it has no lines left.
+        """
+        key = self.sale_customers.get(index)
+        if key is None:
+            return  # A sale to UNKNOWN_CUSTOMER, or voided already
+        customer = self.customers[key]
+        sales = customer["sales"]
+        position = bisect.bisect_left(sales, [index])
+        if position == len(sales) or sales[position][0] != index:
+            return
+        lines = sales[position][2]
+        for line in lines:
+            if line[0] == product:
+                lines.remove(line)
+                customer["cents"] -= line[2]
+                break
+        if not lines:
+            del sales[position]
+            del self.sale_customers[index]
+            if not sales:
+                del self.customers[key]
+                self._keys = None
+            else:
+                self._summarize(customer)
+
+    def catch_up(self):
+        """
+        Takes in what was written to the store since the index last looked, saving it every
+        CUSTOMER_INDEX_SAVE_ROWS rows.
+
+        Returns:
+            bool: False if the store was rewritten since, the index is unchanged then.
+        """
+        rows, voids, position = self.store.tail(self.position)
+        if rows is None:
+            return False
+        self.apply(rows)
+        for index, product in voids:
+            self.void(int(index), product)
+        self.position = position
+        self.unsaved += len(rows) + len(voids)
+        if self.unsaved >= CUSTOMER_INDEX_SAVE_ROWS:
+            self.save()
+        return True
+
+    def rebuild(self):
+        """
+        Indexes every transaction from a full scan of the store and saves the index.
+        """
+        self.customers = {}
+        self.sale_customers = {}
+        self._keys = None
+        self.position = self.store.tail()[2]
+        self.apply(self.store.iter_rows())
+        self.save()
+
+    def lookup(self, name, limit=10):
+        """
+        Returns:
+            dict: {"name", "visits", "spend", "first", "last", "recent"} for the customer, or
+                None if there is no such customer. "recent" holds the `limit` latest sales,
+                newest first, as {"index", "timestamp", "total", "lines": [(product, amount, total), ...]}.
+        """
+        customer = self.customers.get(_customer_key(name))
+        if customer is None:
+            return None
+        recent = [{"index": index, "timestamp": timestamp, "total": sum(line[2] for line in lines) / 100,
+                   "lines": [(product, amount, cents / 100) for product, amount, cents in lines]}
+                  for index, timestamp, lines in reversed(customer["sales"][-limit:])] if limit else []
+        return {"name": customer["name"], "visits": len(customer["sales"]), "spend": customer["cents"] / 100,
+                "first": customer["first"], "last": customer["last"], "recent": recent}
+
+    def find(self, prefix, limit=5):
+        """
+        Returns the names of up to `limit` customers whose name starts with `prefix`, in
+        alphabetical order.
+        """
+        if self._keys is None:
+            self._keys = sorted(self.customers)
+        prefix = _customer_key(prefix)
+        names = []
+        for key in self._keys[bisect.bisect_left(self._keys, prefix):]:
+            if not key.startswith(prefix) or len(names) == limit:
+                break
+            names.append(self.customers[key]["name"])
+        return names
+
+_customer_index = None
+
+def get_customer_index():
+    """
+    Returns the shared CustomerIndex for the current transaction store, caught up with
+    the store. Call with _write_lock held.
+    """
+    global _customer_index
+    store = get_transaction_store()
+    if _customer_index is None or _customer_index.store is not store:
+        _customer_index = CustomerIndex(store)
+    elif not _customer_index.catch_up():
+        _customer_index.rebuild()
+    return _customer_index
+
+@metrics.timed("pos_core.customer_history")
+def customer_history(name, limit=10):
+    """
+    Returns a customer's visits, spend and latest sales, see CustomerIndex.lookup.
+    """
+    flush_checkouts()  # Includes the sale that was just rung up
+    with _write_lock:
+        return get_customer_index().lookup(name, limit)
+
+@metrics.timed("pos_core.find_customers")
+def find_customers(prefix, limit=5):
+    """
+    Returns the names of up to `limit` known customers starting with `prefix`.
+    """
+    flush_checkouts()
+    with _write_lock:
+        return get_customer_index().find(prefix, limit)
+
+def calculate_daily_sales_from_rows(rows):
+    """
+    Sums the Total column per date with a full pass over the given rows.
+
+    The plain serial version of scan_daily_sales (which sums exact cents), bench.py checks
+    they agree to the cent.
+    """
+    daily_sales = defaultdict(float)
+    for row in rows:
+        try:
+            timestamp = row[6]  # Timestamp is in the 7th column (index 6) now
+            day = normalize_timestamp(timestamp)[:10]  # Extract date part, the same for legacy and current rows
+            total = float(row[5])      # Total price is in 6th column now
+            daily_sales[day] += total
+        except (ValueError, IndexError) as e:
+            print(f"Error processing row: {row}. Error: {e}") #handle errors
+    return daily_sales
+
+def top_products_from_rows(rows, n=10):
+    """
+    Counts the quantity sold per product with a full pass over the given rows.
+
+    The plain serial version of scan_top_products, bench.py checks they agree.
+    """
+    product_quantities = Counter()
+    for row in rows:
+        try:
+            product = row[2]  # Product name is now in the 3rd column
+            amount = int(row[4]) # Amount sold is now in the 5th column
+            product_quantities[product] += amount
+        except (ValueError, IndexError) as e:
+            print(f"Error processing row: {row}. Error: {e}")
+    return product_quantities.most_common(n)
+
+def check_sales_rollup():
+    """
+    Rebuilds the sales rollups from scratch, with a parallel scan of the transactions, and
+    compares the stored ones with them.
+
+    Returns:
+        list: (key, rollup_value, raw_value) for every date total, hour total ('YYYY-MM-DD HH')
+            and product quantity the stored rollup had wrong. Empty if the stored rollup was
+            correct. The rollup is rebuilt either way.
+    """
+    global _sales_rollup
+    store = get_transaction_store()
+    with _write_lock:
+        stored = SalesRollup(store, rebuild_if_stale=False)
+        _sales_rollup = SalesRollup(store, rebuild_if_stale=False)
+        _sales_rollup.rebuild()
+    mismatches = []
+    totals = ((_sales_rollup.daily_sales(), stored.daily_sales()), (_sales_rollup.hourly_sales(), stored.hourly_sales()))
+    for raw, stored_totals in totals:
+        for key in sorted(set(raw) | set(stored_totals)):
+            if abs(stored_totals.get(key, 0.0) - raw.get(key, 0.0)) >= 0.005:
+                mismatches.append((key, stored_totals.get(key, 0.0), raw.get(key, 0.0)))
+
+    raw_quantities = dict(_sales_rollup.top_products(len(_sales_rollup.products)))
+    stored_quantities = dict(stored.top_products(len(stored.products)))
+    for product in sorted(set(raw_quantities) | set(stored_quantities)):
+        if stored_quantities.get(product, 0) != raw_quantities.get(product, 0):
+            mismatches.append((f"product {product}", stored_quantities.get(product, 0), raw_quantities.get(product, 0)))
+    return mismatches
+
+@metrics.timed("pos_core.record_sales")
+def _record_sales(sales, fsync=False):
+    """
+    Writes sales with pre-assigned indices to the store and the rollup in one go.
+    """
+    with _write_lock:
+        rollup = get_sales_rollup()  # Loaded (or rebuilt) before the store changes under it
+        get_transaction_store().record_many(sales, fsync=fsync)
+        rollup.record([row for sale in sales for row in sale_rows(sale)])
+
+@metrics.timed("pos_core.record_transaction")
+def record_transaction(cart, customer_name, timestamp=None):
+    """
+    Records a sale. `cart` is a Cart or a list of (name, price) items.
+
+    With write-behind enabled (see get_checkout_writer) the sale is journaled and this
+    returns at once; the store catches up within CheckoutWriter.batch_delay, and the read
+    functions below wait for it (flush_checkouts) so they never miss a sale.
+
+    Returns:
+        int: The transaction index of the sale.
+    """
+    if timestamp is None:
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    cart_summary = cart.summary() if isinstance(cart, Cart) else summarize_cart(cart)
+    cart_summary = {product: dict(details) for product, details in cart_summary.items()}  # The cart may change after we return
+
+    writer = get_checkout_writer()
+    if writer is not None:
+        index = writer.submit(customer_name, cart_summary, timestamp)
+    else:
+        with _write_lock:
+            index = get_transaction_store().next_index()
+            _record_sales([{"index": index, "customer": customer_name, "lines": cart_summary, "timestamp": timestamp}])
+    sale = {"index": index, "customer": customer_name, "lines": cart_summary, "timestamp": timestamp}
+    publish("sale_recorded", rows=sale_rows(sale), **sale)
+    return index
+
+@metrics.timed("pos_core.delete_transaction")
+def delete_transaction(index, product):
+    """
+    Deletes the row for `product` of sale `index`.
+
+    Returns:
+        list: The deleted row, or None if there is no such row.
+    """
+    flush_checkouts()  # The sale may still be on its way to the store
+    with _write_lock:
+        rollup = get_sales_rollup()  # Loaded (or rebuilt) before the store changes under it
+        deleted = get_transaction_store().delete(index, product)
+        if deleted is not None:
+            rollup.record([deleted], sign=-1)
+    if deleted is not None:
+        publish("sale_voided", index=int(index), product=product, row=deleted)
+    return deleted
+
+def import_sales(sales):
+    """
+    Records a batch of finished sales, for bulk imports: consecutive indices handed out
+    under one lock, one write to the store and one rollup update for the whole batch.
+
+    Checkouts wait while the batch is written, so they never get an index it uses.
+
+    Args:
+        sales (list): Sale dicts without "index", see sale_rows.
+
+    Returns:
+        list: The index given to each sale.
+    """
+    writer = get_checkout_writer()
+    if writer is None:
+        return _import_sales(sales)
+    with writer.pause():  # submit() hands out indices without the store lock
+        return _import_sales(sales)
+
+def _import_sales(sales):
+    with _write_lock:
+        index = get_transaction_store().next_index()
+        batch = []
+        for sale in sales:
+            batch.append(dict(sale, index=index))
+            index += len(sale["lines"])  # Every row uses up an index, see record_many
+        if batch:
+            _record_sales(batch, fsync=True)
+    for sale in batch:
+        publish("sale_recorded", rows=sale_rows(sale), **sale)
+    return [sale["index"] for sale in batch]
+
+def normalize_transaction_timestamps():
+    """
+    Migrates legacy timestamps in the transaction store to the '%Y-%m-%d %H:%M:%S' format.
+
+    Returns:
+        int: The number of rows rewritten.
+    """
+    flush_checkouts()
+    with _write_lock:
+        rollup = get_sales_rollup()  # Already keyed by normalized dates, only its signature changes
+        rewritten = get_transaction_store().normalize_timestamps()
+        rollup.record([])
+    return rewritten
+
+def compact_transactions():
+    """
+    Physically removes deleted transactions from the store.
+
+    Returns:
+        int: The number of rows removed.
+    """
+    flush_checkouts()
+    with _write_lock:
+        rollup = get_sales_rollup()  # Brought up to date before the store changes under it
+        removed = get_transaction_store().compact()
+        rollup.record([])  # Same transactions, so only the signature the totals match changes
+    return removed
+
+CHECKOUT_JOURNAL = "checkout_journal.jsonl"
+
+def recover_checkout_journal():
+    """
+    Writes the sales in checkout_journal.jsonl that are missing from the store, then empties
+    the journal.
+
+    A CheckoutWriter owns the store lock from its first queued sale until the queue is
+    drained and the journal emptied, so a journal with entries in it means the process that
+    wrote them died. This runs every time a process takes the store lock, before it writes
+    anything of its own.
+
+    Returns:
+        int: The number of sales that had to be (partly) written again.
+    """
+    try:
+        if not os.path.getsize(CHECKOUT_JOURNAL):
+            return 0
+    except OSError:
+        return 0
+    sales = []
+    with _write_lock:
+        with open(CHECKOUT_JOURNAL, "r+", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    sales.append(json.loads(line))
+                except ValueError:
+                    pass  # Torn last line, that sale was never acknowledged
+            store = get_transaction_store()
+            store.repair()
+            missing = []
+            for sale in sales:
+                recorded = store.sale_products(sale["index"])
+                lines = {product: details for product, details in sale["lines"].items() if product not in recorded}
+                if lines:
+                    missing.append(dict(sale, lines=lines))
+            if missing:
+                _record_sales(missing, fsync=True)
+                print(f"Recovered {len(missing)} sales from {CHECKOUT_JOURNAL}")
+            file.truncate(0)
+    return len(missing)
+
+_write_lock.on_acquire = recover_checkout_journal
+
+CHECKOUT_RETRY_DELAYS = (1, 5, 30)  # Seconds before each retry of sales the checkout writer couldn't write
+
+class CheckoutWriter:
+    """
+    Write-behind queue for checkouts with group commit.
+
+    submit() hands out the transaction index, appends the sale to checkout_journal.jsonl and
+    returns; a background thread writes queued sales to the store and the rollup in batches.
+    Once everything journaled is in the store the journal is emptied. If the app dies first,
+    recover_checkout_journal writes whatever part of the journaled sales didn't reach the
+    store, so no sale that was acknowledged is lost.
+
+    From the first queued sale until the queue is drained the writer holds the store lock,
+    so other processes wait instead of appending between its sales (rows stay in index
+    order) or handing out the same indices. Threads of this process keep submitting.
+
+    If a batch can't be written (a full disk, a locked database) the writer doesn't keep
+    the lock: the queued sales stay in the journal, the lock is given up and
+    checkouts_failed is published. recover_checkout_journal then writes them the next time
+    this process or another one takes the lock, which the writer itself does after each of
+    CHECKOUT_RETRY_DELAYS; checkouts_recovered is published once they are in the store.
+
+    Durability policies:
+        "flush": the journal line is handed to the OS before submit returns. Survives the
+            app crashing, not a power cut. The default.
+        "fsync": the journal line is fsynced before submit returns, and each batch is
+            fsynced to the store before the journal is emptied. Survives a power cut.
+    """
+
+    def __init__(self, store, durability="flush", path=CHECKOUT_JOURNAL, batch_size=500, batch_delay=0.05):
+        self.store = store
+        self.durability = durability
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay  # Seconds to wait for more sales to join a batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()  # Guards the journal, next_index and pending
+        self.admission = threading.Lock()  # Held by submit(), and by pause() to hold new sales back
+        self.idle = threading.Condition(self.lock)
+        self.pending = 0  # Journaled but not yet in the store
+        self.next_index = None  # Read from the store whenever the queue starts filling
+        self.failed = 0  # Sales left in the journal by a failed write, until they are recovered
+        self.error = None  # Why the last write failed
+        self.retry_timer = None
+        self.journal = open(path, "a", encoding="utf-8")
+        self.thread = threading.Thread(target=self._run, name="checkout-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, customer_name, cart_summary, timestamp):
+        """
+        Journals one sale and queues it for the store.
+
+        Returns:
+            int: The transaction index of the sale.
+        """
+        recovered = 0
+        with self.admission, self.lock:
+            if self.pending == 0:
+                with _write_lock:  # Waits for other processes, and recovers a journal a dead one (or a failed write) left
+                    _write_lock.hold()  # Given back by _write once the queue is drained
+                    self.next_index = self.store.next_index()
+                recovered, self.failed, self.error = self.failed, 0, None
+            index = self.next_index
+            self.next_index += len(cart_summary)
+            sale = {"index": index, "customer": customer_name, "lines": cart_summary, "timestamp": timestamp}
+            try:
+                self.journal.write(json.dumps(sale) + "\n")
+                self.journal.flush()
+                if self.durability == "fsync":
+                    os.fsync(self.journal.fileno())
+            except BaseException:
+                if self.pending == 0:
+                    _write_lock.release()
+                raise
+            self.pending += 1
+            self.queue.put(sale)  # Under the lock, so the queue is in index order
+        if recovered:
+            publish("checkouts_recovered", sales=recovered)
+        return index
+
+    def _run(self):
+        while True:
+            sale = self.queue.get()
+            if sale is None:
+                return
+            batch = [sale]
+            deadline = time.monotonic() + self.batch_delay
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    sale = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if sale is None:
+                    stop = True
+                    break
+                batch.append(sale)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        try:
+            _record_sales(batch, fsync=self.durability == "fsync")
+        except (OSError, sqlite3.Error) as e:
+            self._fail(e)
+            return
+        with self.lock:
+            self.pending -= len(batch)
+            if self.pending == 0:
+                self.journal.seek(0)
+                self.journal.truncate()
+                if self.durability == "fsync":
+                    os.fsync(self.journal.fileno())
+                _write_lock.release()
+                self.idle.notify_all()
+
+    def _fail(self, error):
+        """
+        Hands the sales of a failed batch, and the ones queued behind it, over to journal
+        recovery and gives up the store lock.
+        """
+        with self.lock:
+            stop = False
+            while True:  # The queued sales are in the journal too
+                try:
+                    if self.queue.get_nowait() is None:
+                        stop = True
+                except queue.Empty:
+                    break
+            if stop:
+                self.queue.put(None)
+            failed = self.pending
+            self.failed += failed
+            self.error = str(error)
+            self.pending = 0
+            _write_lock.release()  # The next holder recovers the journal first
+            self.idle.notify_all()
+        print(f"Could not write {failed} sales, they wait in {self.path}: {error}")
+        publish("checkouts_failed", sales=failed, error=str(error))
+        self._schedule_retry(0)
+
+    def _schedule_retry(self, attempt):
+        if attempt < len(CHECKOUT_RETRY_DELAYS):
+            self.retry_timer = threading.Timer(CHECKOUT_RETRY_DELAYS[attempt], self._retry, (attempt,))
+            self.retry_timer.daemon = True
+            self.retry_timer.start()
+
+    def _retry(self, attempt):
+        with self.lock:
+            if not self.failed:
+                return  # A checkout took the store lock since, which recovered the journal
+            try:
+                with _write_lock:  # Recovers the journal, see StoreLock.on_acquire
+                    pass
+                recovered = not os.path.getsize(self.path)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Still could not write {self.failed} sales: {e}")
+                self.error = str(e)
+                recovered = False
+            sales = self.failed
+            if recovered:
+                self.failed = 0
+                self.error = None
+        if recovered:
+            publish("checkouts_recovered", sales=sales)
+        else:
+            self._schedule_retry(attempt + 1)
+
+    def flush(self, timeout=None):
+        """
+        Waits until every submitted sale is in the store, or after a failed write, left in
+        the journal for whoever takes the store lock next to recover.
+
+        Returns:
+            bool: False if the timeout passed first.
+        """
+        with self.lock:
+            return self.idle.wait_for(lambda: self.pending == 0, timeout)
+
+    @contextlib.contextmanager
+    def pause(self):
+        """
+        Holds new sales back and waits until the queued ones are in the store. Until the
+        block ends the store lock isn't leased, and no index is handed out without it.
+        """
+        with self.admission:
+            self.flush()
+            yield
+
+    def close(self):
+        """
+        Writes the remaining sales and stops the background thread.
+        """
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.journal.close()
+
+CHECKOUT_DURABILITY = ("sync", "flush", "fsync")
+_checkout_writer = None
+
+def get_checkout_writer():
+    """
+    Returns the shared CheckoutWriter, or None when checkouts are written synchronously.
+
+    Picked with the POS_DURABILITY environment variable: "flush" (the default) and "fsync"
+    use the write-behind journal with that policy, "sync" writes each checkout before
+    record_transaction returns.
+    """
+    global _checkout_writer
+    durability = os.environ.get("POS_DURABILITY", "flush")
+    if durability not in CHECKOUT_DURABILITY:
+        raise ValueError(f"Unknown POS_DURABILITY {durability!r}, expected one of {', '.join(CHECKOUT_DURABILITY)}")
+    if durability == "sync":
+        return None
+    with _shared_state_lock:
+        if _checkout_writer is None:
+            _checkout_writer = CheckoutWriter(get_transaction_store(), durability)
+            atexit.register(_checkout_writer.close)
+        return _checkout_writer
+
+def flush_checkouts(timeout=None):
+    """
+    Waits until every checkout submitted so far is in the store. Returns at once when
+    write-behind isn't running.
+    """
+    if _checkout_writer is not None:
+        _checkout_writer.flush(timeout)
+
+FOLLOW_INTERVAL = 1.0  # Seconds between SalesFollower polls
+FOLLOW_EVENT_ROWS = 1000  # More new rows than this in one poll are published as one sales_resynced
+
+class SalesFollower:
+    """
+    Follows the transaction store for sales and voids written by other processes (another
+    till, a bulk import) and publishes them as sale_recorded and sale_voided events with
+    "remote": True, so views keep up with them the way they keep up with this process's
+    own checkouts. Every `interval` seconds the store's tail() is asked for what was
+    appended since the last poll; nothing is read again.
+
+    A rewrite of the store (compaction, timestamp migration) or a burst of more than
+    FOLLOW_EVENT_ROWS rows is published as a single sales_resynced event instead, and
+    views reload.
+
+    Sales and voids this process published itself are skipped when they show up in the store.
+    """
+
+    def __init__(self, interval=FOLLOW_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()  # Guards the local_* sets
+        self.local_sales = set()  # Indices published here that weren't seen in the store yet
+        self.local_voids = set()  # (index, product) likewise
+        self.position = None
+        self.stopped = threading.Event()
+        self.thread = None
+        subscribe("sale_recorded", self._note_local)
+        subscribe("sale_voided", self._note_local)
+
+    def _note_local(self, topic, payload):
+        if payload.get("remote"):
+            return
+        with self.lock:
+            if topic == "sale_recorded":
+                self.local_sales.add(payload["index"])
+            else:
+                self.local_voids.add((payload["index"], payload["product"]))
+
+    @metrics.timed("pos_core.follow_sales")
+    def poll(self):
+        """
+        Publishes what other processes wrote since the last poll.
+
+        Returns:
+            int: The number of events published.
+        """
+        store = get_transaction_store()
+        rows, voids, self.position = store.tail(self.position)
+        if rows is None or len(rows) > FOLLOW_EVENT_ROWS:
+            with self.lock:
+                self.local_sales.clear()
+                self.local_voids.clear()
+            publish("sales_resynced")
+            return 1
+        sales = {}
+        seen = set()
+        for row in rows:
+            try:
+                index = int(row[0])
+            except (ValueError, IndexError) as e:
+                print(f"Error processing row: {row}. Error: {e}")
+                continue
+            seen.add(index)
+            sale = sales.setdefault(index, {"index": index, "customer": row[1], "lines": {}, "timestamp": row[6], "rows": []})
+            sale["lines"][row[2]] = {"price": row[3], "amount": row[4], "total": row[5]}
+            sale["rows"].append(row)
+        with self.lock:
+            for index in seen & self.local_sales:
+                del sales[index]
+            self.local_sales -= seen
+        for sale in sales.values():
+            publish("sale_recorded", remote=True, **sale)
+        published = len(sales)
+        for index, product in voids:
+            key = (int(index), product)
+            with self.lock:
+                if key in self.local_voids:
+                    self.local_voids.discard(key)
+                    continue
+            publish("sale_voided", remote=True, index=key[0], product=product, row=None)
+            published += 1
+        return published
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:  # Keep following, the next poll starts from the same position
+                print(f"Error following the transaction store: {e}")
+
+    def start(self):
+        """
+        Starts polling from the current end of the store on a daemon thread.
+        """
+        self.position = get_transaction_store().tail()[2]
+        self.thread = threading.Thread(target=self._run, name="sales-follower", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops polling, after a poll that is under way.
+        """
+        self.stopped.set()
+        unsubscribe("sale_recorded", self._note_local)
+        unsubscribe("sale_voided", self._note_local)
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+_sales_follower = None
+
+def get_sales_follower():
+    """
+    Returns the shared SalesFollower, started on the first call. One per process: every
+    session subscribes to its events instead of following the store itself, so a sale made
+    at another till is read and published once.
+    """
+    global _sales_follower
+    with _shared_state_lock:
+        if _sales_follower is None:
+            _sales_follower = SalesFollower().start()
+        return _sales_follower
+
+def reset_state():
+    """
+    Stops the checkout writer and the sales follower and forgets the shared catalog cache,
+    transaction store, rollup and customer index, so the next call reads the files in the
+    current directory (and POS_STORE, POS_DURABILITY) again. For tools that switch data
+    directories.
+    """
+    global _transaction_store, _sales_rollup, _customer_index, _checkout_writer, _sales_follower
+    if _sales_follower is not None:
+        _sales_follower.stop()
+        _sales_follower = None
+    if _checkout_writer is not None:
+        _checkout_writer.close()
+        atexit.unregister(_checkout_writer.close)
+        _checkout_writer = None
+    _catalog_cache.update({"key": None, "products": {}, "hits": 0, "misses": 0, "log_offset": 0, "log_rows": 0})
+    _product_index.update({"key": None, "index": None})
+    _transaction_store = None
+    _sales_rollup = None
+    _customer_index = None
+
+@metrics.timed("pos_core.checkout")
+def checkout(cart, customer_name=""):
+    """
+    Records the sale in `cart` and returns its receipt. The cart is left as it is.
+
+    Args:
+        cart (Cart): The items being bought.
+        customer_name (str): Stored with the sale, UNKNOWN_CUSTOMER if empty.
+
+    Returns:
+        dict: {"index": int, "customer": str, "lines": {product: line}, "total": float, "timestamp": str}
+
+    Raises:
+        ValueError: If the cart is empty.
+    """
+    if not cart:
+        raise ValueError("Cart is empty!")
+    customer_name = customer_name.strip() or UNKNOWN_CUSTOMER
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    index = record_transaction(cart, customer_name, timestamp)
+    return {
+        "index": index,
+        "customer": customer_name,
+        "lines": {product: dict(line) for product, line in cart.summary().items()},
+        "total": cart.total,
+        "timestamp": timestamp,
+    }
+
+def load_transactions(year=None, month=None, day=None):
+    """
+    Returns every transaction row, optionally filtered by year, month and day.
+    """
+    flush_checkouts()  # Reads see every checkout that has returned
+    return get_transaction_store().load(year, month, day)
+
+def iter_transactions(year=None, month=None, day=None):
+    """
+    Yields the transaction rows load_transactions would return without holding them all
+    in memory, for exports.
+    """
+    flush_checkouts()
+    yield from get_transaction_store().iter_rows(year, month, day)
+
+@metrics.timed("pos_core.load_transactions_page")
+def load_transactions_page(year=None, month=None, day=None, before=None, limit=50, start=None, end=None):
+    """
+    Returns one page of transaction rows, newest first, and the cursor for the next page.
+    start and end narrow the rows to a date range, both inclusive and both optional.
+    """
+    flush_checkouts()
+    return get_transaction_store().load_page(year, month, day, before=before, limit=limit, start=start, end=end)
+
+@metrics.timed("pos_core.daily_sales")
+def daily_sales():
+    """
+    Returns:
+        dict: {"YYYY-MM-DD": total sales}, maintained on every checkout and delete.
+    """
+    flush_checkouts()
+    with _write_lock:
+        return get_sales_rollup().daily_sales()
+
+@metrics.timed("pos_core.hourly_sales")
+def hourly_sales():
+    """
+    Returns:
+        dict: {"YYYY-MM-DD HH": total sales}.
+    """
+    flush_checkouts()
+    with _write_lock:
+        return get_sales_rollup().hourly_sales()
+
+def period_start(period, today=None):
+    """
+    Returns the first day of a reporting period: "today", "week" (since Monday) or "month".
+    Anything else (such as "all") returns None, meaning no lower bound.
+    """
+    today = today or datetime.now().date()
+    return {
+        "today": today,
+        "week": today - timedelta(days=today.weekday()),
+        "month": today.replace(day=1),
+    }.get(period)
+
+SALES_GRANULARITIES = ("hour", "day", "week", "month")
+
+def _report_buckets(start, end, granularity):
+    """
+    Yields (label, first day, last day) for the buckets of a report from start to end.
+    Weeks start on Monday and are labelled '2025-W14', months '2025-04'; the first and
+    last bucket are cut to the range.
+    """
+    if granularity == "day":
+        for offset in range((end - start).days + 1):
+            day = start + timedelta(days=offset)
+            yield day.isoformat(), day, day
+    elif granularity == "week":
+        monday = start - timedelta(days=start.weekday())
+        while monday <= end:
+            year, week, weekday = monday.isocalendar()
+            yield f"{year}-W{week:02d}", max(monday, start), min(monday + timedelta(days=6), end)
+            monday += timedelta(days=7)
+    elif granularity == "month":
+        first = start.replace(day=1)
+        while first <= end:
+            following = (first + timedelta(days=32)).replace(day=1)
+            yield first.strftime("%Y-%m"), max(first, start), min(following - timedelta(days=1), end)
+            first = following
+    else:
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+@metrics.timed("pos_core.sales_report")
+def sales_report(start=None, end=None, granularity="day"):
+    """
+    Returns the sales from the start to the end date (inclusive) per hour, day, week or
+    month. Every bucket in the range is listed, those without sales as 0.0. Start and end
+    default to the first and last day with sales.
+
+    Day, week and month totals come from the rollup's DayIndex, one subtraction per bucket
+    however many days it spans.
+
+    Returns:
+        dict: {bucket label: total sales} in time order, see _report_buckets for the labels;
+            hours are 'YYYY-MM-DD HH'.
+
+    Raises:
+        ValueError: If granularity isn't one of SALES_GRANULARITIES.
+    """
+    if granularity not in SALES_GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    flush_checkouts()
+    with _write_lock:
+        rollup = get_sales_rollup()
+        index = rollup.day_index()
+        start = start or index.first_day
+        end = end or index.last_day
+        if start is None or end is None or end < start:
+            return {}
+        if granularity == "hour":
+            report = {}
+            for offset in range((end - start).days + 1):
+                day = (start + timedelta(days=offset)).isoformat()
+                for hour in range(24):
+                    key = f"{day} {hour:02d}"
+                    report[key] = rollup.hourly.get(key, (0, 0))[0] / 100
+            return report
+        return {label: index.total(first, last)[0] / 100 for label, first, last in _report_buckets(start, end, granularity)}
+
+def sales_total(start=None, end=None):
+    """
+    Returns the sales from the start to the end date (both inclusive and optional), in
+    O(1) from the rollup's DayIndex.
+    """
+    flush_checkouts()
+    with _write_lock:
+        return get_sales_rollup().day_index().total(start, end)[0] / 100
+
+def compare_sales(period="week", today=None):
+    """
+    Compares the sales of the current period so far with the same stretch of the one
+    before: this week up to today against last week up to the same weekday, this month
+    up to today's date against last month up to the same date, today against yesterday.
+
+    Returns:
+        dict: {"current": (start, end, total), "previous": (start, end, total),
+            "change": relative change, None if there were no previous sales}
+
+    Raises:
+        ValueError: If period isn't "today", "week" or "month".
+    """
+    today = today or datetime.now().date()
+    start = period_start(period, today)
+    if start is None:
+        raise ValueError(f"Unknown period: {period}")
+    if period == "month":
+        previous_start = (start - timedelta(days=1)).replace(day=1)
+        previous_end = min(previous_start + (today - start), start - timedelta(days=1))
+    else:
+        length = timedelta(days=1 if period == "today" else 7)
+        previous_start, previous_end = start - length, today - length
+    current = sales_total(start, today)
+    previous = sales_total(previous_start, previous_end)
+    return {
+        "current": (start, today, current),
+        "previous": (previous_start, previous_end, previous),
+        "change": (current - previous) / previous if previous else None,
+    }
+
+@metrics.timed("pos_core.top_products")
+def top_products(n=10, start=None, end=None, period=None):
+    """
+    Returns the n best selling products as [(product, quantity), ...], optionally counting
+    only sales between the start and end dates or within a period (see period_start).
+    """
+    if period is not None:
+        start = period_start(period)
+    flush_checkouts()
+    with _write_lock:
+        return get_sales_rollup().top_products(n, start=start, end=end)
+
+def add_command_arguments(parser):
+    """
+    Adds the maintenance commands to an argparse parser, see run_command.
+    """
+    parser.add_argument("--store", choices=sorted(TRANSACTION_STORES), help="Transaction store backend (default: $POS_STORE or csv)")
+    parser.add_argument("--check-counter", action="store_true", help="Rebuild the transaction index counter from transactions.csv and exit")
+    parser.add_argument("--migrate-sqlite", action="store_true", help="Copy transactions.csv into transactions.db and exit")
+    parser.add_argument("--migrate-partitions", action="store_true", help="Copy transactions.csv into monthly files under transactions/ and exit")
+    parser.add_argument("--compress-partitions", action="store_true", help="Gzip the monthly transaction files older than $POS_COLD_MONTHS months and exit")
+    parser.add_argument("--migrate-timestamps", action="store_true", help="Rewrite legacy '31/3/2025 22:58' timestamps in the store and exit")
+    parser.add_argument("--compact", action="store_true", help="Physically remove deleted transactions and exit")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="Recompute the daily/hourly sales rollups, check both against the transactions and exit")
+    parser.add_argument("--rebuild-customers", action="store_true", help="Rebuild the customer purchase index from the transactions and exit")
+    parser.add_argument("--compact-catalog", action="store_true", help="Fold the product change log into products.csv and exit")
+
+def run_command(args):
+    """
+    Runs the maintenance command selected in the parsed args, if any.
+
+    Returns:
+        bool: True if a command ran, False if none was given.
+    """
+    if args.store:
+        os.environ["POS_STORE"] = args.store
+
+    if args.migrate_sqlite:
+        try:
+            migrated, skipped = migrate_csv_to_sqlite()
+            print(f"Migrated {migrated} transactions to transactions.db ({skipped} skipped)")
+        except ValueError as e:
+            print(f"Migration failed: {e}")
+    elif args.migrate_partitions:
+        try:
+            migrated, skipped = migrate_csv_to_partitions()
+            print(f"Migrated {migrated} transactions to {PARTITION_DIR}/ ({skipped} skipped)")
+        except ValueError as e:
+            print(f"Migration failed: {e}")
+    elif args.compress_partitions:
+        print(f"Compressed {PartitionedTransactionStore().compress_partitions()} monthly transaction files")
+    elif args.migrate_timestamps:
+        print(f"Normalized {normalize_transaction_timestamps()} legacy timestamps")
+    elif args.compact:
+        print(f"Compacted transactions, {compact_transactions()} deleted rows removed")
+    elif args.rebuild_customers:
+        with _write_lock:
+            index = CustomerIndex(get_transaction_store(), load=False)
+        print(f"Customer index rebuilt, {len(index.customers)} customers")
+    elif args.compact_catalog:
+        print(f"Compacted catalog, {compact_catalog()} logged changes folded into products.csv")
+    elif args.rebuild_rollups:
+        mismatches = check_sales_rollup()
+        for key, rollup_value, raw_value in mismatches:
+            print(f"{key}: rollup {rollup_value}, transactions {raw_value}")
+        print(f"Sales rollups rebuilt, {len(mismatches)} entries were wrong")
+    elif args.check_counter:
+        stored_index, rebuilt_index = check_transaction_counter()
+        status = "OK" if stored_index == rebuilt_index else "REPAIRED"
+        print(f"Transaction counter: stored={stored_index} rebuilt={rebuilt_index} {status}")
+    else:
+        return False
+    return True
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="My POS App maintenance commands")
+    add_command_arguments(parser)
+    if not run_command(parser.parse_args()):
+        parser.print_help()
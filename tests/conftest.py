@@ -0,0 +1,83 @@
+"""
+Every test runs in its own empty data directory, with the shared state of pos_core reset
+before and after, and checkouts written synchronously unless a test asks otherwise.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pos_core  # noqa: E402
+
+PRODUCTS = {"Apple": 0.5, "Bread": 2.25, "Cheese": 4.1, "Milk": 1.19}
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("POS_DURABILITY", "sync")
+    monkeypatch.setenv("POS_STORE", "csv")
+    with open("products.csv", "w", newline="") as file:
+        file.write("Name,Price\n" + "".join(f"{name},{price}\n" for name, price in PRODUCTS.items()))
+    pos_core.reset_state()
+    yield tmp_path
+    pos_core.reset_state()
+
+@pytest.fixture(params=sorted(pos_core.TRANSACTION_STORES))
+def store_name(request, data_dir, monkeypatch):
+    """
+    Runs the test once per transaction store backend.
+    """
+    monkeypatch.setenv("POS_STORE", request.param)
+    pos_core.reset_state()
+    return request.param
+
+def ring_up(customer, *items, timestamp=None):
+    """
+    Records a sale of (product, amount) items at PRODUCTS prices and returns its index.
+    """
+    cart = pos_core.Cart()
+    for product, amount in items:
+        cart.add(product, PRODUCTS[product], amount=amount)
+    return pos_core.record_transaction(cart, customer, timestamp)
+
+def sale(index, customer, *products, timestamp="2025-05-01 12:00:00"):
+    """
+    A sale with a pre-assigned index, one of each product at 1.00, the way the checkout
+    journal and record_many take it. For writing to the store behind pos_core's back, as
+    another till or a crashed process would have.
+    """
+    return {"index": index, "customer": customer, "timestamp": timestamp,
+            "lines": {product: {"price": 1.0, "amount": 1, "total": 1.0} for product in products}}
+
+def ring_up_history():
+    """
+    A few weeks of sales across two months, some with legacy timestamps and some without
+    a customer name.
+
+    Returns:
+        list: The sale indices.
+    """
+    indices = []
+    for day in range(1, 40):
+        month, day_of_month = (1, day) if day <= 31 else (2, day - 31)
+        if day % 4:
+            timestamp = f"2025-{month:02d}-{day_of_month:02d} {8 + day % 10:02d}:15:00"
+        else:
+            timestamp = f"{day_of_month}/{month}/2025 {8 + day % 10}:15"
+        customer = pos_core.UNKNOWN_CUSTOMER if day % 5 == 0 else f"Customer {day % 6}"
+        items = [("Apple", 1 + day % 3), ("Bread", 1)] if day % 2 else [("Milk", 2), ("Cheese", 1 + day % 2), ("Apple", 1)]
+        indices.append(ring_up(customer, *items, timestamp=timestamp))
+    return indices
+
+@pytest.fixture
+def history(store_name):
+    """
+    ring_up_history() on every store, with a few lines voided and a sale after the voids.
+    """
+    indices = ring_up_history()
+    for index in indices[::7]:
+        pos_core.delete_transaction(index, "Apple")
+    ring_up("Customer 1", ("Bread", 3))
+    return indices
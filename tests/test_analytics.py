@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+
+import pos_core
+from conftest import ring_up, ring_up_history
+
+np = pytest.importorskip("numpy")
+import analytics  # noqa: E402
+
+def columns():
+    return analytics.load_columns(cache_dir="analytics_cache")
+
+def assert_matches_the_rows(found):
+    rows = pos_core.load_transactions()
+    assert len(found) == len(rows)
+    assert dict(found.top_products(100)) == dict(pos_core.top_products_from_rows(rows, 100))
+    assert found.total() == pytest.approx(sum(float(row[5]) for row in rows))
+
+def test_columns_follow_writes_and_voids(store_name):
+    indices = ring_up_history()
+    assert_matches_the_rows(columns())
+    for index in indices[::5]:
+        pos_core.delete_transaction(index, "Apple")
+    ring_up("Customer 9", ("Cheese", 2), timestamp="2025-02-10 09:00:00")
+    assert_matches_the_rows(columns())  # From the cache plus what was written since
+    pos_core.compact_transactions()
+    assert_matches_the_rows(columns())
+
+def test_bad_rows_are_skipped_with_one_line(data_dir, capsys, monkeypatch):
+    monkeypatch.setattr(analytics, "CONVERT_BLOCK_ROWS", 8)
+    ring_up_history()
+    with open("transactions.csv", "a", newline="") as file:
+        file.write("x,Bob,Milk,1.0,1,1.0,2025-02-01 10:00:00\n9999,Bob,Milk,1.0,one,1.0,2025-02-01 10:00:00\n")
+    ring_up("Customer 9", ("Cheese", 2), timestamp="2025-02-10 09:00:00")
+    found = columns()
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1 and lines[0].startswith("Skipped 2 rows")
+    assert len(found) == len(pos_core.load_transactions()) - 2
+    assert np.count_nonzero(found.column("customer") == found.customer_codes["Customer 9"]) == 1
+
+@pytest.mark.parametrize("store_name", ["partitioned"], indirect=True)
+def test_only_the_month_written_to_is_parsed_again(store_name, monkeypatch):
+    ring_up_history()
+    this_month = datetime.now().strftime("%Y-%m")
+    ring_up("Customer 8", ("Milk", 1), timestamp=f"{this_month}-01 09:00:00")
+    columns()
+    parsed = []
+    month_rows = pos_core.PartitionedTransactionStore.month_rows
+    monkeypatch.setattr(pos_core.PartitionedTransactionStore, "month_rows",
+                        lambda self, key, entry, offset=0: parsed.append((key, offset)) or month_rows(self, key, entry, offset))
+    assert_matches_the_rows(columns())
+    assert parsed == []
+    ring_up("Customer 9", ("Cheese", 2), timestamp=f"{this_month}-01 10:00:00")
+    assert_matches_the_rows(columns())
+    assert [key for key, offset in parsed] == [this_month] and parsed[0][1] > 0  # Only the rows appended
+    del parsed[:]
+    ring_up("Customer 9", ("Cheese", 2), timestamp="2025-01-20 09:00:00")  # Unpacks the gzipped month
+    assert_matches_the_rows(columns())
+    assert ("2025-01", 0) in parsed and (this_month, 0) not in parsed
@@ -0,0 +1,48 @@
+import csv
+import json
+
+import bulk
+import pos_core
+from conftest import PRODUCTS, ring_up_history
+
+def test_products_saved_by_excel_import(data_dir):
+    with open("prices.csv", "w", newline="", encoding="utf-8-sig") as file:  # Starts with a byte order mark
+        file.write("Name,Price\r\nPear,0.80\r\nApple,0.55\r\nPlum,cheap\r\n,1.0\r\n")
+    assert bulk.import_products("prices.csv", batch_rows=1) == (2, 2)
+    assert pos_core.load_products() == dict(PRODUCTS, Pear=0.8, Apple=0.55)
+    with open("prices.csv.errors.csv", newline="", encoding="utf-8") as file:
+        assert [row[:2] for row in csv.reader(file)][1:] == [["4", "price is not a number: 'cheap'"], ["5", "missing name"]]
+
+def test_transactions_group_into_sales(store_name):
+    lines = [
+        {"Index": 7, "Customer": "Alice", "Product": "Apple", "Price": 0.5, "Amount": 2, "Timestamp": "2025-03-01 10:00:00"},
+        {"Index": 7, "Customer": "Alice", "Product": "Apple", "Price": 0.5, "Amount": 1, "Timestamp": "2025-03-01 10:00:00"},
+        {"Index": 7, "Customer": "Alice", "Product": "Milk", "Price": 1.19, "Amount": 1, "Timestamp": "2025-03-01 10:00:00"},
+        {"Customer": "Bob", "Product": "Bread", "Price": 2.25, "Amount": 1, "Timestamp": "2/3/2025 9:30"},
+        {"Customer": "Bob", "Product": "Bread", "Price": 2.25, "Amount": 0, "Timestamp": "2025-03-02 09:30:00"},
+        "not an object",
+    ]
+    with open("history.jsonl", "w", encoding="utf-8") as file:
+        file.write("".join(json.dumps(line) + "\n" for line in lines))
+    assert bulk.import_transactions("history.jsonl", batch_rows=1) == (4, 2)
+    rows = pos_core.load_transactions()
+    assert [(row[1], row[2], int(row[4]), round(float(row[5]), 2), row[6]) for row in rows] == [
+        ("Alice", "Apple", 3, 1.5, "2025-03-01 10:00:00"),
+        ("Alice", "Milk", 1, 1.19, "2025-03-01 10:00:00"),
+        ("Bob", "Bread", 1, 2.25, "2025-03-02 09:30:00"),
+    ]
+    assert rows[0][0] == rows[1][0] != rows[2][0]  # New indices, one per sale
+    assert pos_core.check_sales_rollup() == []
+
+def test_export_reads_back_the_same(store_name):
+    ring_up_history()
+    for format in bulk.FORMATS:
+        path = f"export.{format}"
+        assert bulk.export_transactions(path) == len(pos_core.load_transactions())
+        with open(path, newline="", encoding="utf-8") as file:
+            records = [record for _, record in bulk.read_records(file, format)]
+        assert [bulk.validate_transaction(record)["total"] for record in records] == [float(row[5]) for row in pos_core.load_transactions()]
+    assert bulk.export_products("catalog.csv") == len(PRODUCTS)
+    pos_core.save_products({})
+    assert bulk.import_products("catalog.csv") == (len(PRODUCTS), 0)
+    assert pos_core.load_products() == PRODUCTS
@@ -0,0 +1,58 @@
+import csv
+import os
+
+import pos_core
+from conftest import PRODUCTS
+
+def snapshot():
+    with open("products.csv", newline="") as file:
+        return {row[0]: float(row[1]) for row in list(csv.reader(file))[1:] if row}
+
+def test_edits_are_logged_and_replayed(data_dir):
+    pos_core.set_product("Oat Milk", 1.5)
+    pos_core.set_product("Milk", 1.25)
+    assert pos_core.remove_product("Cheese")
+    assert not pos_core.remove_product("Cheese")
+    expected = dict(PRODUCTS, Milk=1.25, **{"Oat Milk": 1.5})
+    del expected["Cheese"]
+    assert snapshot() == PRODUCTS  # Untouched until compaction
+    assert pos_core.load_products() == expected
+    pos_core.reset_state()  # A new process replays the log
+    assert pos_core.load_products() == expected
+
+def test_save_products_logs_only_the_differences(data_dir):
+    pos_core.save_products(dict(PRODUCTS, Apple=0.55, Pear=0.8))
+    with open("products_log.csv", newline="") as file:
+        assert list(csv.reader(file))[1:] == [["set", "Apple", "0.55"], ["set", "Pear", "0.8"]]
+
+def test_log_is_folded_into_the_snapshot(data_dir, monkeypatch):
+    monkeypatch.setattr(pos_core, "CATALOG_COMPACT_ROWS", 3)
+    for price in (0.8, 0.81, 0.82, 0.83):
+        pos_core.set_product("Pear", price)
+    assert os.path.exists("products_log.csv")  # Not before the log is as long as the catalog
+    pos_core.set_product("Pear", 0.85)
+    assert not os.path.exists("products_log.csv")
+    assert snapshot() == pos_core.load_products() == dict(PRODUCTS, Pear=0.85)
+
+def test_crash_during_compaction_gives_the_same_catalog(data_dir, monkeypatch):
+    pos_core.set_product("Pear", 0.8)
+    assert pos_core.remove_product("Apple")
+    expected = pos_core.load_products()
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "remove", lambda path: None)  # Dies before the log is removed
+        pos_core.compact_catalog()
+    assert snapshot() == expected and os.path.exists("products_log.csv")
+    pos_core.reset_state()
+    assert pos_core.load_products() == expected
+
+def test_edits_of_another_process_and_a_torn_row(data_dir):
+    pos_core.set_product("Pear", 0.8)
+    assert pos_core.load_products()["Pear"] == 0.8
+    # Another process appends, the last row half written when it died
+    with open("products_log.csv", "a", newline="") as file:
+        file.write("set,Plum,0.3\r\nset,Ki")
+    assert pos_core.load_products() == dict(PRODUCTS, Pear=0.8, Plum=0.3)
+    assert pos_core._catalog_cache["log_rows"] == 2  # Only the new row was replayed
+    pos_core.set_product("Kiwi", 0.4)  # Cuts the torn row off first
+    pos_core.reset_state()
+    assert pos_core.load_products() == dict(PRODUCTS, Pear=0.8, Plum=0.3, Kiwi=0.4)
@@ -0,0 +1,49 @@
+import os
+import threading
+from collections import Counter
+
+import pos_core
+from conftest import ring_up
+
+def stored():
+    return Counter((int(row[0]), row[2]) for row in pos_core.load_transactions())
+
+def test_write_behind_drains_and_empties_the_journal(store_name, monkeypatch):
+    monkeypatch.setenv("POS_DURABILITY", "flush")
+    indices = [ring_up(f"Customer {n}", ("Apple", 1), ("Milk", 2)) for n in range(20)]
+    pos_core.flush_checkouts()
+    assert len(set(indices)) == 20
+    assert sum(stored().values()) == 40
+    assert os.path.getsize(pos_core.CHECKOUT_JOURNAL) == 0
+
+def test_failed_write_gives_up_the_lock_and_is_recovered(store_name, monkeypatch):
+    monkeypatch.setenv("POS_DURABILITY", "flush")
+    monkeypatch.setattr(pos_core, "CHECKOUT_RETRY_DELAYS", (0.05,) * 5)
+    events = []
+    recovered = threading.Event()
+    callback = lambda topic, payload: (events.append((topic, payload["sales"])), topic == "checkouts_recovered" and recovered.set())
+    for topic in ("checkouts_failed", "checkouts_recovered"):
+        pos_core.subscribe(topic, callback)
+    store = pos_core.get_transaction_store()
+    record_many = store.record_many
+    failures = [OSError(28, "No space left on device")]
+
+    def flaky_record_many(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return record_many(*args, **kwargs)
+
+    monkeypatch.setattr(store, "record_many", flaky_record_many)
+    try:
+        ring_up("Alice", ("Apple", 1))
+        assert pos_core.flush_checkouts(5) is None  # Returns instead of waiting for the store
+        assert recovered.wait(5)
+        ring_up("Bob", ("Bread", 1), ("Milk", 1))
+        pos_core.flush_checkouts()
+    finally:
+        for topic in ("checkouts_failed", "checkouts_recovered"):
+            pos_core.unsubscribe(topic, callback)
+    assert events == [("checkouts_failed", 1), ("checkouts_recovered", 1)]
+    assert pos_core._write_lock._holds == 0
+    assert stored() == {(1, "Apple"): 1, (2, "Bread"): 1, (2, "Milk"): 1}
+    assert pos_core.check_sales_rollup() == []
@@ -0,0 +1,83 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from collections import Counter
+
+import pos_core
+from conftest import ring_up, sale
+
+def journal(*sales):
+    with open(pos_core.CHECKOUT_JOURNAL, "a", encoding="utf-8") as file:
+        for entry in sales:
+            file.write(json.dumps(entry) + "\n")
+
+def stored():
+    return Counter((int(row[0]), row[2]) for row in pos_core.load_transactions())
+
+def test_journal_left_by_a_crash_is_written_on_the_next_lock(store_name):
+    index = ring_up("Alice", ("Apple", 1))
+    # The dead process journaled three sales: the first made it to the store, the second
+    # only partly, the third not at all, and the line of a fourth was torn
+    written, partial, missing = sale(index + 1, "Bob", "Milk"), sale(index + 2, "Carol", "Milk", "Bread"), sale(index + 4, "Dan", "Cheese")
+    pos_core.get_transaction_store().record_many([written, sale(index + 2, "Carol", "Milk")])
+    journal(written, partial, missing)
+    with open(pos_core.CHECKOUT_JOURNAL, "a") as file:
+        file.write('{"index": 99, "customer": "Er')
+    pos_core.reset_state()  # A new process
+
+    with pos_core._write_lock:  # Taking the store lock recovers first
+        pass
+    assert stored() == {(index, "Apple"): 1, (index + 1, "Milk"): 1, (index + 2, "Milk"): 1, (index + 2, "Bread"): 1, (index + 4, "Cheese"): 1}
+    assert os.path.getsize(pos_core.CHECKOUT_JOURNAL) == 0
+    assert pos_core.check_sales_rollup() == []
+    assert ring_up("Eve", ("Apple", 1)) == index + 5  # Past every recovered index
+
+def test_torn_csv_row_is_cut_off_before_recovery(data_dir):
+    ring_up("Alice", ("Apple", 1))
+    with open("transactions.csv", "a", newline="") as file:
+        file.write("2,Bob,Mi")
+    journal(sale(2, "Bob", "Milk"))
+    pos_core.reset_state()
+    with pos_core._write_lock:
+        pass
+    assert stored() == {(1, "Apple"): 1, (2, "Milk"): 1}
+
+
+def test_sessions_checking_out_at_once_get_their_own_indices(store_name, monkeypatch):
+    monkeypatch.setenv("POS_DURABILITY", "flush")
+    indices = []
+
+    def session(n):
+        for _ in range(10):
+            indices.append(ring_up(f"Customer {n}", ("Apple", 1), ("Bread", 1)))
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pos_core.flush_checkouts()
+    assert len(set(indices)) == 40
+    assert stored() == {(index, product): 1 for index in indices for product in ("Apple", "Bread")}
+    assert pos_core.check_sales_rollup() == []
+
+TERMINAL = """
+import sys
+sys.path.insert(0, {root!r})
+import pos_core
+for _ in range(10):
+    cart = pos_core.Cart()
+    cart.add("Milk", 0.99)
+    pos_core.record_transaction(cart, sys.argv[1])
+pos_core.flush_checkouts()
+"""
+
+def test_terminals_checking_out_at_once_get_their_own_indices(store_name):
+    script = TERMINAL.format(root=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    terminals = [subprocess.Popen([sys.executable, "-c", script, f"Terminal {n}"]) for n in range(3)]
+    assert [terminal.wait(60) for terminal in terminals] == [0, 0, 0]
+    rows = pos_core.load_transactions()
+    assert len(rows) == len({int(row[0]) for row in rows}) == 30
+    assert pos_core.check_sales_rollup() == []
@@ -0,0 +1,38 @@
+import pos_core
+
+def customers():
+    with pos_core._write_lock:
+        return pos_core.get_customer_index().customers
+
+def assert_matches_a_rebuild():
+    rebuilt = pos_core.CustomerIndex(pos_core.get_transaction_store(), path="rebuilt_customer_index.json", load=False)
+    assert customers() == rebuilt.customers
+
+def test_index_matches_a_rebuild(history):
+    assert_matches_a_rebuild()
+    pos_core.reset_state()  # Read back from customer_index.json
+    assert_matches_a_rebuild()
+
+def test_index_catches_up_with_other_tills(history):
+    customers()
+    store = pos_core.get_transaction_store()
+    index = store.next_index()
+    store.record_many([{"index": index, "customer": "Customer 3", "timestamp": "2025-02-09 09:00:00",
+                        "lines": {"Cheese": {"price": 4.1, "amount": 2, "total": 8.2}, "Milk": {"price": 1.19, "amount": 1, "total": 1.19}}}])
+    assert_matches_a_rebuild()
+    store.delete(index, "Cheese")
+    assert_matches_a_rebuild()
+
+def test_index_is_rebuilt_after_compaction(history):
+    customers()
+    pos_core.compact_transactions()
+    assert_matches_a_rebuild()
+
+def test_customer_lookup_matches_the_rows(history):
+    assert pos_core.customer_history(pos_core.UNKNOWN_CUSTOMER) is None
+    rows = [row for row in pos_core.load_transactions() if row[1] == "Customer 1"]
+    found = pos_core.customer_history("  customer   1 ", limit=100)
+    assert found["visits"] == len(found["recent"]) == len({row[0] for row in rows})
+    assert round(found["spend"], 2) == round(sum(float(row[5]) for row in rows), 2)
+    assert pos_core.find_customers("cust", limit=10) == [f"Customer {n}" for n in range(6)]
+    assert pos_core.find_customers("customer 4") == ["Customer 4"]
@@ -0,0 +1,22 @@
+import metrics
+
+def test_updates_and_noted_rows_count_towards_every_running_operation(monkeypatch):
+    monkeypatch.setattr(metrics, "_histograms", {})
+    metrics.add_controls(3)  # Outside any operation, nothing to count it to
+    with metrics.timed("outer"):
+        with metrics.timed("inner"):
+            metrics.add_controls(50)
+            metrics.record_update(0.002, 2)
+        metrics.record_update(0.001, 0)  # A whole-page update
+    snapshot = metrics.snapshot()
+    assert (snapshot["inner"]["controls_max"], snapshot["outer"]["controls_max"]) == (52, 52)
+    assert snapshot["outer"]["update_mean_ms"] == 3.0
+    assert snapshot["page.update"]["count"] == 2 and snapshot["page.update"]["controls_max"] == 2
+
+def test_percentiles_stay_within_a_bucket(monkeypatch):
+    monkeypatch.setattr(metrics, "_histograms", {})
+    histogram = metrics.histogram("operation")
+    for milliseconds in range(1, 101):
+        histogram.add(milliseconds / 1000)
+    assert 50 <= histogram.percentile(0.5) * 1000 <= 50 * 1.1
+    assert histogram.percentile(0.99) * 1000 <= 100
@@ -0,0 +1,60 @@
+import random
+
+import pos_core
+
+NAMES = ["Apple", "Apple Juice", "Green Apple", "Pineapple", "Banana", "Bread", "Brown Bread", "Milk", "Oat Milk"]
+
+def scanned(query, names, limit=20):
+    """
+    What ProductIndex.search returns, from a pass over every name.
+    """
+    query = query.strip().casefold()
+    if not query:
+        return []
+    keys = sorted((key, name) for name in names for key in pos_core.ProductIndex._keys(name) if key.startswith(query))
+    matches = dict.fromkeys(name for _, name in keys)
+    if len(query) >= 3:
+        matches.update(dict.fromkeys(sorted((name for name in names if name not in matches and query in name.casefold()), key=str.casefold)))
+    return list(matches)[:limit]
+
+def test_prefixes_first_then_substrings():
+    index = pos_core.ProductIndex(NAMES)
+    assert index.search("apple") == ["Apple", "Apple Juice", "Green Apple", "Pineapple"]
+    assert index.search("  BR ") == ["Bread", "Brown Bread"]
+    assert index.search("ilk") == ["Milk", "Oat Milk"]  # Substrings only from 3 characters
+    assert index.search("il") == []
+    assert index.search("") == []
+    assert index.search("a", limit=2) == ["Apple", "Apple Juice"]
+
+def test_search_matches_a_scan_through_edits():
+    rng = random.Random(7)
+    words = ["red", "green", "apple", "pear", "juice", "bread", "roll", "milk", "oat", "soy"]
+    names = {" ".join(rng.sample(words, rng.randint(1, 3))).title() for _ in range(200)}
+    index = pos_core.ProductIndex(names)
+    for step in range(100):
+        name = rng.choice(sorted(names))
+        if step % 3:
+            names.discard(name)
+            index.remove(name)
+        else:
+            name = name + " Xl"
+            names.add(name)
+            index.add(name)
+        for query in ("r", "re", "ree", "oat m", "xl", "ice"):
+            assert index.search(query, limit=15) == scanned(query, names, limit=15)
+
+def test_search_products_follows_the_catalog(data_dir):
+    assert pos_core.search_products("mil") == [("Milk", 1.19)]
+    index = pos_core._product_index["index"]
+    pos_core.set_product("Oat Milk", 1.5)
+    pos_core.set_product("Milk", 1.25)
+    assert pos_core.remove_product("Cheese")
+    assert pos_core.search_products("mil") == [("Milk", 1.25), ("Oat Milk", 1.5)]
+    assert pos_core.search_products("chee") == []
+    assert pos_core._product_index["index"] is index  # Patched, not built again
+
+    # Another process rewrites the catalog
+    with open("products.csv", "a", newline="") as file:
+        file.write("Milkshake,3.0\n")
+    assert pos_core.search_products("milk") == [("Milk", 1.25), ("Oat Milk", 1.5), ("Milkshake", 3.0)]
+    assert pos_core._product_index["index"] is not index
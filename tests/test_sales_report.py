@@ -0,0 +1,88 @@
+from datetime import date, timedelta
+
+import pytest
+
+import pos_core
+from conftest import ring_up, ring_up_history
+
+def day_totals():
+    totals = {}
+    for row in pos_core.load_transactions():
+        day = date.fromisoformat(pos_core.normalize_timestamp(row[6])[:10])
+        totals[day] = totals.get(day, 0) + round(float(row[5]) * 100)
+    return totals
+
+def rescanned_total(totals, start, end):
+    return sum(cents for day, cents in totals.items() if (start is None or day >= start) and (end is None or day <= end)) / 100
+
+def day_index():
+    with pos_core._write_lock:
+        return pos_core.get_sales_rollup().day_index()
+
+def state(index):
+    return index.first_day, index.last_day, index.cents, index.rows
+
+def test_range_totals_match_a_rescan(data_dir):
+    ring_up_history()
+    totals = day_totals()
+    bounds = [None, date(2024, 12, 1), date(2025, 1, 1), date(2025, 1, 13), date(2025, 1, 31), date(2025, 2, 8), date(2025, 3, 1)]
+    for start in bounds:
+        for end in bounds:
+            assert round(pos_core.sales_total(start, end), 2) == round(rescanned_total(totals, start, end), 2), (start, end)
+
+def test_day_index_is_patched_in_place(data_dir):
+    ring_up_history()
+    index = day_index()
+    for timestamp in ("2025-02-08 18:00:00", "2025-01-20 09:30:00", "2025-02-20 12:00:00"):
+        ring_up("Customer 1", ("Bread", 1), timestamp=timestamp)
+        assert day_index() is index  # Patched, not built again
+        assert state(index) == state(pos_core.DayIndex(pos_core.get_sales_rollup().daily))
+
+@pytest.mark.parametrize("timestamp, voided", [("2024-12-31 10:00:00", False), ("2025-03-01 10:00:00", True)])
+def test_day_index_is_built_again_when_the_range_changes_at_the_front_or_back(data_dir, timestamp, voided):
+    ring_up_history()
+    index = day_index()
+    sale = ring_up("Customer 1", ("Bread", 1), timestamp=timestamp)
+    if voided:
+        assert day_index() is index  # A day after the last one is appended
+        pos_core.delete_transaction(sale, "Bread")  # Empties the last day
+    assert day_index() is not index
+    assert state(day_index()) == state(pos_core.DayIndex(pos_core.get_sales_rollup().daily))
+
+def test_report_buckets(data_dir):
+    ring_up_history()
+    totals = day_totals()
+    start, end = date(2025, 1, 29), date(2025, 2, 3)
+    days = pos_core.sales_report(start, end, "day")
+    assert list(days) == [(start + timedelta(days=n)).isoformat() for n in range(6)]
+    assert all(round(total, 2) == round(rescanned_total(totals, date.fromisoformat(day), date.fromisoformat(day)), 2) for day, total in days.items())
+    weeks = pos_core.sales_report(start, end, "week")
+    assert list(weeks) == ["2025-W05", "2025-W06"]  # Monday 27 January and 3 February
+    assert round(weeks["2025-W05"], 2) == round(rescanned_total(totals, start, date(2025, 2, 2)), 2)
+    months = pos_core.sales_report(None, None, "month")
+    assert list(months) == ["2025-01", "2025-02"]
+    assert round(sum(months.values()), 2) == round(pos_core.sales_total(), 2)
+    hours = pos_core.sales_report(date(2025, 1, 3), date(2025, 1, 3), "hour")
+    assert len(hours) == 24 and round(sum(hours.values()), 2) == round(rescanned_total(totals, date(2025, 1, 3), date(2025, 1, 3)), 2)
+    with pytest.raises(ValueError):
+        pos_core.sales_report(granularity="year")
+
+def test_compare_sales(data_dir):
+    ring_up_history()
+    comparison = pos_core.compare_sales("week", today=date(2025, 2, 5))
+    assert comparison["current"][:2] == (date(2025, 2, 3), date(2025, 2, 5))
+    assert comparison["previous"][:2] == (date(2025, 1, 27), date(2025, 1, 29))
+    current, previous = comparison["current"][2], comparison["previous"][2]
+    assert comparison["change"] == pytest.approx((current - previous) / previous)
+
+def test_history_page_within_a_date_range(store_name):
+    ring_up_history()
+    start, end = date(2025, 1, 30), date(2025, 2, 2)
+    expected = [row for row in pos_core.load_transactions() if start.isoformat() <= pos_core.normalize_timestamp(row[6])[:10] <= end.isoformat()]
+    rows, cursor = pos_core.load_transactions_page(limit=3, start=start, end=end)
+    while cursor is not None:
+        more, cursor = pos_core.load_transactions_page(before=cursor, limit=3, start=start, end=end)
+        rows += more
+    assert [row[:6] for row in rows] == [row[:6] for row in reversed(expected)]
+    january, cursor = pos_core.load_transactions_page(2025, 1, start=start, end=end)  # Both filters apply
+    assert [row[:6] for row in january] == [row[:6] for row in rows if pos_core.normalize_timestamp(row[6]).startswith("2025-01")]
@@ -0,0 +1,77 @@
+"""
+The rollup is kept up to date on every write, as a snapshot and a delta log; its totals
+have to agree with a full pass over the transactions.
+"""
+from collections import defaultdict
+
+import pos_core
+from conftest import ring_up, sale
+
+def rounded(sales):
+    return {key: round(total, 2) for key, total in sales.items() if round(total, 2)}
+
+def hourly_from_rows(rows):
+    hourly = defaultdict(float)
+    for row in rows:
+        hourly[pos_core.normalize_timestamp(row[6])[:13]] += float(row[5])
+    return hourly
+
+def assert_agrees_with_a_rescan():
+    rows = pos_core.load_transactions()
+    assert rounded(pos_core.daily_sales()) == rounded(pos_core.calculate_daily_sales_from_rows(rows))
+    assert rounded(pos_core.hourly_sales()) == rounded(hourly_from_rows(rows))
+
+def test_kept_totals_match_a_rescan(history):
+    assert_agrees_with_a_rescan()
+    assert pos_core.check_sales_rollup() == []
+
+def test_totals_read_back_from_disk_match_a_rescan(history, monkeypatch):
+    monkeypatch.setattr(pos_core, "ROLLUP_SNAPSHOT_ROWS", 5)  # Snapshots and delta log both in play
+    ring_up("Customer 2", ("Milk", 1))
+    pos_core.delete_transaction(history[1], "Bread")
+    pos_core.reset_state()
+    assert_agrees_with_a_rescan()
+
+def test_delta_log_is_replayed_on_load(history):
+    with pos_core._write_lock:
+        rollup = pos_core.get_sales_rollup()
+        rollup.save()
+        with open(rollup.path) as file:
+            size = len(file.read())
+    pos_core.delete_transaction(history[2], "Bread")
+    with open(pos_core.get_sales_rollup().path) as file:
+        assert len(file.read()) == size  # Only the log was written
+    pos_core.reset_state()
+    assert_agrees_with_a_rescan()
+
+def test_totals_catch_up_with_writes_they_missed(history):
+    with pos_core._write_lock:
+        pos_core.get_sales_rollup()
+    # Another till writes straight to the store
+    store = pos_core.get_transaction_store()
+    index = store.next_index()
+    store.record_many([sale(index, "Customer 3", "Cheese", timestamp="2025-02-09 09:00:00")])
+    assert_agrees_with_a_rescan()
+    store.delete(index, "Cheese")
+    assert_agrees_with_a_rescan()
+    assert pos_core.check_sales_rollup() == []
+
+def test_totals_survive_compaction(history):
+    pos_core.compact_transactions()
+    assert_agrees_with_a_rescan()
+    pos_core.reset_state()
+    assert_agrees_with_a_rescan()
+
+def test_check_reports_and_repairs_drift(history):
+    with pos_core._write_lock:
+        rollup = pos_core.get_sales_rollup()
+        hour = next(iter(rollup.hourly))
+        day = next(iter(rollup.daily))
+        rollup.hourly[hour][0] += 500
+        rollup.daily[day][0] -= 100
+        rollup.save()
+    mismatches = pos_core.check_sales_rollup()
+    assert sorted(key for key, stored, raw in mismatches) == sorted([day, hour])
+    assert sorted(round(abs(stored - raw), 2) for key, stored, raw in mismatches) == [1.0, 5.0]
+    assert pos_core.check_sales_rollup() == []
+    assert_agrees_with_a_rescan()
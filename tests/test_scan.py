@@ -0,0 +1,22 @@
+import pos_core
+
+def rounded(sales):
+    return {day: round(total, 2) for day, total in sales.items()}
+
+def test_parallel_scan_matches_the_serial_passes(history, monkeypatch):
+    rows = pos_core.load_transactions()
+    monkeypatch.setattr(pos_core, "SCAN_PARALLEL_BYTES", 0)
+    for workers in (1, 2):
+        assert pos_core.scan_transactions(workers=workers) == rows
+        assert pos_core.scan_transactions(2025, 2, workers=workers) == pos_core.load_transactions(2025, 2)
+        assert rounded(pos_core.scan_daily_sales(workers=workers)) == rounded(pos_core.calculate_daily_sales_from_rows(rows))
+        assert dict(pos_core.scan_top_products(100, workers=workers)) == dict(pos_core.top_products_from_rows(rows, 100))
+
+def test_split_range_cuts_at_line_breaks(tmp_path):
+    path = tmp_path / "rows.csv"
+    data = b"".join(b"%d,%s\n" % (n, b"x" * (n % 17)) for n in range(500))
+    path.write_bytes(data)
+    ranges = pos_core._split_range(str(path), 0, len(data), 100)
+    assert len(ranges) > 1
+    assert b"".join(data[start:end] for start, end in ranges) == data
+    assert all(start == 0 or data[start - 1:start] == b"\n" for start, _ in ranges)
@@ -0,0 +1,81 @@
+import pytest
+
+import pos_core
+from conftest import ring_up, sale
+
+@pytest.fixture
+def events():
+    published = []
+    callback = lambda topic, payload: published.append((topic, payload))
+    for topic in ("sale_recorded", "sale_voided", "sales_resynced"):
+        pos_core.subscribe(topic, callback)
+    yield published
+    for topic in ("sale_recorded", "sale_voided", "sales_resynced"):
+        pos_core.unsubscribe(topic, callback)
+
+@pytest.fixture
+def follower():
+    follower = pos_core.SalesFollower()
+    follower.position = pos_core.get_transaction_store().tail()[2]
+    yield follower
+    follower.stop()
+
+def test_tail_returns_only_what_was_written_since(store_name):
+    store = pos_core.get_transaction_store()
+    first = ring_up("Alice", ("Apple", 1), ("Bread", 1))
+    rows, voids, position = store.tail()
+    assert (rows, voids) == ([], [])
+    assert store.tail(position)[:2] == ([], [])
+
+    second = ring_up("Bob", ("Milk", 1))
+    pos_core.delete_transaction(first, "Bread")
+    rows, voids, position = store.tail(position)
+    assert [(int(row[0]), row[1], row[2]) for row in rows] == [(second, "Bob", "Milk")]
+    assert [(int(index), product) for index, product in voids] == [(first, "Bread")]
+    assert store.tail(position)[:2] == ([], [])
+
+@pytest.mark.parametrize("store_name", ["csv", "partitioned"], indirect=True)
+def test_tail_asks_to_start_over_after_a_rewrite(store_name):
+    store = pos_core.get_transaction_store()
+    index = ring_up("Alice", ("Apple", 1), ("Bread", 1))
+    pos_core.delete_transaction(index, "Bread")
+    position = store.tail()[2]
+    pos_core.compact_transactions()
+    rows, voids, position = store.tail(position)
+    assert rows is None and voids is None
+    assert store.tail(position)[:2] == ([], [])
+
+def test_follower_publishes_sales_and_voids_of_other_processes(store_name, events, follower):
+    index = pos_core.get_transaction_store().next_index()
+    pos_core.get_transaction_store().record_many([sale(index, "Bob", "Milk", "Bread")])
+    assert follower.poll() == 1
+    topic, payload = events[-1]
+    assert topic == "sale_recorded" and payload["remote"]
+    assert (payload["index"], payload["customer"], sorted(payload["lines"])) == (index, "Bob", ["Bread", "Milk"])
+
+    pos_core.get_transaction_store().delete(index, "Milk")
+    assert follower.poll() == 1
+    assert events[-1] == ("sale_voided", {"remote": True, "index": index, "product": "Milk", "row": None})
+    assert follower.poll() == 0
+
+def test_follower_skips_what_this_process_published(store_name, events, follower):
+    index = ring_up("Alice", ("Apple", 1))
+    pos_core.delete_transaction(index, "Apple")
+    del events[:]
+    assert follower.poll() == 0
+    assert events == []
+
+def test_follower_resyncs_after_a_rewrite_or_a_burst(data_dir, events, follower, monkeypatch):
+    index = ring_up("Alice", ("Apple", 1), ("Bread", 1))
+    pos_core.delete_transaction(index, "Bread")
+    follower.poll()
+    pos_core.compact_transactions()
+    del events[:]
+    assert follower.poll() == 1
+    assert [topic for topic, _ in events] == ["sales_resynced"]
+
+    monkeypatch.setattr(pos_core, "FOLLOW_EVENT_ROWS", 2)
+    start = pos_core.get_transaction_store().next_index()
+    pos_core.get_transaction_store().record_many([sale(start + n, "Bob", "Milk") for n in range(3)])
+    assert follower.poll() == 1
+    assert [topic for topic, _ in events] == ["sales_resynced"] * 2
@@ -0,0 +1,46 @@
+from collections import Counter
+from datetime import date
+
+import pos_core
+from conftest import ring_up
+
+def rescanned(start=None, end=None):
+    rows = [row for row in pos_core.load_transactions()
+            if (start is None or pos_core.normalize_timestamp(row[6])[:10] >= start.isoformat())
+            and (end is None or pos_core.normalize_timestamp(row[6])[:10] <= end.isoformat())]
+    return pos_core.top_products_from_rows(rows, 100)
+
+def test_top_products_match_a_rescan(history):
+    assert pos_core.top_products(100) == rescanned()
+    assert pos_core.top_products(2) == rescanned()[:2]
+
+def test_top_products_within_a_window(history):
+    for start, end in ((date(2025, 2, 1), None), (None, date(2025, 1, 10)), (date(2025, 1, 8), date(2025, 1, 21)), (date(2026, 1, 1), None)):
+        assert dict(pos_core.top_products(100, start=start, end=end)) == dict(rescanned(start, end))
+
+def test_rankings_follow_sales_and_voids(history):
+    window = (date(2025, 2, 1), date(2025, 2, 28))
+    pos_core.top_products(100)
+    pos_core.top_products(100, *window)
+    with pos_core._write_lock:
+        rollup = pos_core.get_sales_rollup()
+        ranking, window_ranking = rollup._ranking, rollup._windows["2025-02-01", "2025-02-28"]
+    index = ring_up("Customer 2", ("Cheese", 40), timestamp="2025-02-10 10:00:00")
+    assert pos_core.top_products(1) == [("Cheese", dict(rescanned())["Cheese"])]
+    assert pos_core.top_products(1, *window) == rescanned(*window)[:1]
+    pos_core.delete_transaction(index, "Cheese")
+    assert pos_core.top_products(100) == rescanned()
+    assert dict(pos_core.top_products(100, *window)) == dict(rescanned(*window))
+    with pos_core._write_lock:  # Patched in place, not built again
+        assert rollup._ranking is ranking and rollup._windows["2025-02-01", "2025-02-28"] is window_ranking
+
+def test_ranking_orders_ties_by_first_sale():
+    ranking = pos_core.ProductRanking([("Milk", 2, 1), ("Apple", 3, 1), ("Bread", 2, 1)])
+    sold = Counter({"Milk": 2, "Apple": 3, "Bread": 2})
+    assert ranking.top(3) == sold.most_common(3)
+    ranking.add("Cheese", 2, 1)
+    ranking.add("Apple", -1, -1)  # Apple's only line voided
+    ranking.add("Apple", 1, 1)  # and sold again, after Cheese
+    assert ranking.top(10) == [("Milk", 2), ("Bread", 2), ("Cheese", 2), ("Apple", 1)]
+    ranking.add("Milk", 5, 1)
+    assert ranking.top(1) == [("Milk", 7)]
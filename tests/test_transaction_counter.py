@@ -0,0 +1,48 @@
+import csv
+import os
+
+import pos_core
+from conftest import ring_up
+
+def append_row(row):
+    with open("transactions.csv", "a", newline="") as file:
+        csv.writer(file).writerow(row)
+
+def test_indices_come_from_the_sidecar(data_dir):
+    first = ring_up("Alice", ("Apple", 1), ("Bread", 2))
+    second = ring_up("Bob", ("Milk", 1))
+    assert (first, second) == (1, 3)  # Every row uses up an index
+    with open("transactions.seq") as file:
+        assert int(file.read().split(",")[0]) == 4
+    assert pos_core.next_transaction_index() == 4
+
+def test_counter_is_rebuilt_when_the_csv_changed_behind_its_back(data_dir):
+    ring_up("Alice", ("Apple", 1))
+    append_row([40, "Editor", "Milk", 1.19, 1, 1.19, "2025-01-02 10:00:00"])
+    assert pos_core.next_transaction_index() == 41
+
+def test_counter_is_rebuilt_when_the_sidecar_is_missing_or_damaged(data_dir):
+    ring_up("Alice", ("Apple", 1), ("Bread", 1))
+    os.remove("transactions.seq")
+    assert pos_core.next_transaction_index() == 3
+    with open("transactions.seq", "w") as file:
+        file.write("not a counter")
+    assert pos_core.next_transaction_index() == 3
+
+def test_check_reports_and_repairs_a_wrong_counter(data_dir):
+    ring_up("Alice", ("Apple", 1))
+    stat = os.stat("transactions.csv")
+    with open("transactions.seq", "w") as file:
+        file.write(f"1,{stat.st_size},{stat.st_mtime_ns}")  # Matches the CSV, but is behind it
+    assert pos_core.check_transaction_counter() == (1, 2)
+    assert pos_core.next_transaction_index() == 2
+
+def test_voided_index_is_not_handed_out_again_after_compaction(data_dir):
+    ring_up("Alice", ("Apple", 1))
+    last = ring_up("Bob", ("Milk", 1))
+    pos_core.delete_transaction(last, "Milk")
+    pos_core.compact_transactions()
+    assert pos_core.check_transaction_counter() == (last + 1, last + 1)
+    os.utime("transactions.csv", ns=(0, 0))  # The sidecar no longer matches the CSV
+    assert pos_core.next_transaction_index() == last + 1
+    assert ring_up("Carol", ("Bread", 1)) == last + 1
@@ -0,0 +1,74 @@
+import os
+
+import pos_core
+from conftest import ring_up
+
+def stored(rows):
+    return [(int(row[0]), row[2]) for row in rows]
+
+def test_delete_leaves_a_tombstone_instead_of_rewriting_the_csv(data_dir):
+    index = ring_up("Alice", ("Apple", 1), ("Bread", 1))
+    size = os.path.getsize("transactions.csv")
+    deleted = pos_core.delete_transaction(index, "Apple")
+    assert stored([deleted]) == [(index, "Apple")]
+    assert os.path.getsize("transactions.csv") == size
+    assert pos_core.get_transaction_store().voids() == {(str(index), "Apple")}
+    assert stored(pos_core.load_transactions()) == [(index, "Bread")]
+
+def test_deleting_a_missing_row_changes_nothing(store_name):
+    index = ring_up("Alice", ("Apple", 1))
+    assert pos_core.delete_transaction(index, "Milk") is None
+    assert pos_core.delete_transaction(index + 100, "Apple") is None
+    assert stored(pos_core.load_transactions()) == [(index, "Apple")]
+
+def test_voided_rows_are_hidden_from_every_read(store_name):
+    first = ring_up("Alice", ("Apple", 1), ("Bread", 2), timestamp="2025-03-01 10:00:00")
+    second = ring_up("Bob", ("Milk", 1), timestamp="2025-03-02 11:00:00")
+    pos_core.delete_transaction(first, "Bread")
+    expected = [(first, "Apple"), (second, "Milk")]
+    assert stored(pos_core.load_transactions()) == expected
+    assert stored(pos_core.iter_transactions()) == expected
+    assert stored(pos_core.load_transactions(2025, 3, 1)) == [(first, "Apple")]
+    rows, cursor = pos_core.load_transactions_page(limit=10)
+    assert stored(rows) == expected[::-1] and cursor is None
+
+def test_compaction_drops_voided_rows_and_keeps_the_rest(store_name):
+    indices = [ring_up("Alice", ("Apple", 1), ("Bread", 1)) for _ in range(5)]
+    for index in indices[1::2]:
+        pos_core.delete_transaction(index, "Apple")
+    before = stored(pos_core.load_transactions())
+    pos_core.compact_transactions()
+    assert stored(pos_core.load_transactions()) == before
+    if store_name != "sqlite":  # SQLite deletes the rows outright, it has no void log
+        assert not pos_core.get_transaction_store().voids()
+    assert pos_core.check_sales_rollup() == []
+
+def test_compaction_removes_the_void_log(data_dir):
+    index = ring_up("Alice", ("Apple", 1), ("Bread", 1))
+    pos_core.delete_transaction(index, "Apple")
+    assert pos_core.compact_transactions() == 1
+    assert not os.path.exists("transactions_void.csv")
+    with open("transactions.csv") as file:
+        assert "Apple" not in file.read()
+
+def test_compaction_keeps_voided_indices_used(store_name):
+    ring_up("Alice", ("Apple", 1))
+    last = ring_up("Bob", ("Milk", 1), ("Bread", 1))
+    pos_core.delete_transaction(last, "Milk")
+    pos_core.delete_transaction(last, "Bread")
+    pos_core.compact_transactions()
+    if store_name == "csv":
+        os.remove("transactions.seq")  # Even a counter rebuilt from the compacted file
+        pos_core.check_transaction_counter()
+    pos_core.reset_state()
+    assert ring_up("Carol", ("Apple", 1)) > last
+
+def test_migration_keeps_voided_indices_used(data_dir, monkeypatch):
+    ring_up("Alice", ("Apple", 1))
+    last = ring_up("Bob", ("Milk", 1))
+    pos_core.delete_transaction(last, "Milk")
+    pos_core.compact_transactions()
+    assert pos_core.migrate_csv_to_sqlite() == (1, 0)
+    monkeypatch.setenv("POS_STORE", "sqlite")
+    pos_core.reset_state()
+    assert ring_up("Carol", ("Apple", 1)) > last